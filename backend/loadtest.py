@@ -0,0 +1,494 @@
+"""Load-test the API in process against local DynamoDB, S3 and SQS stand-ins.
+
+Usage:
+    python loadtest.py --requests 5000 --concurrency 32 --mix browse \\
+        --latency dynamodb=lognormal:6:0.4 --latency s3=lognormal:25:0.5 --latency sqs=lognormal:12:0.3
+
+    python loadtest.py --transport mangum --duration 30 --mix signup=1,login=4,upload=10,list=20 \\
+        --baseline loadtest-results/before.json --max-regression 0.1
+
+The app runs unmodified. ``--transport asgi`` drives main.app through httpx's
+ASGI transport on one event loop, as uvicorn would; ``--transport mangum``
+sends HTTP API (payload 2.0) events to main.handler from a pool of threads,
+one invocation per thread at a time like Lambda containers. Each of the
+--concurrency workers sends its next request as soon as the previous one
+returns. The stand-ins come from ml/standins.py, so latency specs are the
+same as replay.py's.
+
+Every run writes its report (throughput and p50/p95/p99 per endpoint, status
+codes, stand-in call counts) to loadtest-results/. With --baseline the change
+against an earlier report is printed per endpoint, and --max-regression makes
+the run fail when any endpoint's p95 grew by more than that fraction.
+"""
+
+import argparse
+import asyncio
+import base64
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from decimal import Decimal
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [os.path.join(HERE, "src"), os.path.join(HERE, "..", "ml")]
+
+LOCAL_QUEUE_URL = "https://sqs.local/000000000000/receipt-processing-queue"
+LOCAL_BULK_QUEUE_URL = "https://sqs.local/000000000000/receipt-processing-bulk-queue"
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+os.environ.setdefault("SQS_QUEUE_URL", LOCAL_QUEUE_URL)
+os.environ.setdefault("SQS_BULK_QUEUE_URL", LOCAL_BULK_QUEUE_URL)
+
+import httpx  # noqa: E402
+
+import main  # noqa: E402
+import standins  # noqa: E402
+import tracing  # noqa: E402
+
+RESULTS_DIR = os.path.join(HERE, "loadtest-results")
+# /receipts and the upload endpoints still act as the fixed test user
+LIST_USER = "testuser"
+PASSWORD = "loadtest-password"
+MERCHANTS = ["Walmart", "Target", "Costco", "Starbucks", "Shell", "Amazon", "CVS", "Trader Joe's"]
+CATEGORIES = ["Groceries", "Dining", "Transportation", "Shopping", "Health"]
+
+# Relative request weights per endpoint
+MIXES: Dict[str, Dict[str, float]] = {
+    # Dashboard traffic: mostly reads, occasional uploads
+    "browse": {"signup": 1, "login": 4, "upload": 5, "list": 50, "detail": 15, "image": 25},
+    # Checkout-counter traffic: uploads and the list refresh after each one
+    "upload": {"login": 2, "upload": 50, "list": 40, "image": 8},
+    # Sign-up burst (launch, marketing campaign)
+    "signup": {"signup": 60, "login": 30, "list": 10},
+}
+
+
+class Request(NamedTuple):
+    endpoint: str
+    method: str
+    path: str
+    query: str = ""
+    headers: Optional[Dict[str, str]] = None
+    body: bytes = b""
+
+
+class ApiStandIns:
+    """Stand-ins for the API's AWS clients, patched into main."""
+
+    def __init__(self, latencies: Dict[str, standins.LatencyModel]):
+        dynamodb = latencies.get("dynamodb")
+        self.s3 = standins.FakeS3(latencies.get("s3"))
+        self.sqs = standins.FakeSQS(latencies.get("sqs"))
+        self.users_table = standins.FakeTable("username", latency=dynamodb)
+        self.receipts_table = standins.FakeTable(
+            "user_id", "receipt_id", dynamodb,
+            indexes={main.CREATED_AT_INDEX: ("user_id", "created_at")}
+        )
+        self.stats_table = standins.FakeTable("user_id", "stat_key", dynamodb)
+        self._restore: List[Callable[[], None]] = []
+
+    def _patch(self, target: Any, name: str, value: Any) -> None:
+        previous = getattr(target, name)
+        setattr(target, name, value)
+        self._restore.append(lambda: setattr(target, name, previous))
+
+    def install(self) -> None:
+        self._patch(main, "s3_client", self.s3)
+        self._patch(main, "sqs_client", self.sqs)
+        self._patch(main, "users_table", self.users_table)
+        self._patch(main, "receipts_table", self.receipts_table)
+        self._patch(main, "stats_table", self.stats_table)
+        self._patch(main, "QUEUE_URL", LOCAL_QUEUE_URL)
+        self._patch(main, "BULK_QUEUE_URL", LOCAL_BULK_QUEUE_URL)
+        self._patch(main.denylist, "table", self.users_table)
+
+    def uninstall(self) -> None:
+        while self._restore:
+            self._restore.pop()()
+
+    def services(self) -> List[standins._StandIn]:
+        return [self.s3, self.sqs, self.users_table, self.receipts_table, self.stats_table]
+
+    def reset_stats(self) -> None:
+        for service in self.services():
+            service.reset_stats()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "s3": self.s3.stats(),
+            "sqs": self.sqs.stats(),
+            "dynamodb_users": self.users_table.stats(),
+            "dynamodb_receipts": self.receipts_table.stats(),
+            "dynamodb_stats": self.stats_table.stats(),
+        }
+
+
+class Traffic:
+    """Builds requests for each endpoint from the seeded users and receipts."""
+
+    def __init__(self, aws: ApiStandIns, users: int, receipts: int, upload_bytes: int, rng: random.Random):
+        self.rng = rng
+        self._lock = threading.Lock()
+        self.usernames = [f"loadtest-{i}" for i in range(users)]
+        for username in self.usernames:
+            aws.users_table.items[(username,)] = {
+                'username': username,
+                'password_hash': main.get_password_hash(PASSWORD),
+                'created_at': datetime.utcnow().isoformat()
+            }
+
+        now = datetime.utcnow()
+        self.receipt_ids = []
+        for i in range(receipts):
+            receipt_id = str(uuid.uuid4())
+            created_at = (now - timedelta(minutes=rng.randint(0, 300 * 24 * 60))).isoformat()
+            aws.receipts_table.items[(LIST_USER, receipt_id)] = {
+                'user_id': LIST_USER,
+                'receipt_id': receipt_id,
+                's3_key': main.build_upload_key(LIST_USER, receipt_id, "receipt.jpg"),
+                'status': 'COMPLETED',
+                'created_at': created_at,
+                'expires_at': main.archive.expires_at(created_at),
+                'merchant_name': rng.choice(MERCHANTS),
+                'total_amount': Decimal(f"{rng.uniform(2, 250):.2f}"),
+                'category': rng.choice(CATEGORIES),
+                'purchase_date': created_at[:10],
+                'alerts': [],
+                'anomalies': []
+            }
+            self.receipt_ids.append(receipt_id)
+
+        self.token = main.create_access_token({"sub": LIST_USER})
+        self.upload_body = rng.randbytes(upload_bytes)
+
+    def build(self, endpoints: List[str], weights: List[float]) -> Request:
+        with self._lock:
+            endpoint = self.rng.choices(endpoints, weights)[0]
+            return getattr(self, f"_{endpoint}")()
+
+    def _json(self, endpoint: str, path: str, data: dict) -> Request:
+        return Request(endpoint, "POST", path, headers={"content-type": "application/json"},
+                       body=json.dumps(data).encode())
+
+    def _signup(self) -> Request:
+        return self._json("signup", "/signup", {"username": f"loadtest-{uuid.uuid4().hex[:12]}", "password": PASSWORD})
+
+    def _login(self) -> Request:
+        return self._json("login", "/login", {"username": self.rng.choice(self.usernames), "password": PASSWORD})
+
+    def _upload(self) -> Request:
+        boundary = uuid.uuid4().hex
+        body = (
+            f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="receipt.jpg"\r\n'
+            f'Content-Type: image/jpeg\r\n\r\n'
+        ).encode() + self.upload_body + f'\r\n--{boundary}--\r\n'.encode()
+        return Request("upload", "POST", "/", headers={"content-type": f"multipart/form-data; boundary={boundary}"}, body=body)
+
+    def _list(self) -> Request:
+        # The dashboard asks for the compact first page; some clients page or filter by date
+        roll = self.rng.random()
+        if roll < 0.6:
+            query = "view=compact&limit=50"
+        elif roll < 0.85:
+            query = "limit=50"
+        else:
+            start = datetime.utcnow() - timedelta(days=self.rng.randint(30, 300))
+            query = f"view=compact&limit=50&from_date={start:%Y-%m-%d}&to_date={start + timedelta(days=30):%Y-%m-%d}"
+        return Request("list", "GET", "/receipts", query=query)
+
+    def _detail(self) -> Request:
+        return Request("detail", "GET", f"/receipts/{self.rng.choice(self.receipt_ids)}",
+                       headers={"authorization": f"Bearer {self.token}"})
+
+    def _image(self) -> Request:
+        return Request("image", "GET", f"/receipts/{self.rng.choice(self.receipt_ids)}/image")
+
+
+class Schedule:
+    """Hands out requests until the count or the deadline is reached."""
+
+    def __init__(self, traffic: Traffic, mix: Dict[str, float], requests: int, duration: float):
+        self.traffic = traffic
+        self.endpoints = list(mix)
+        self.weights = list(mix.values())
+        self.remaining = requests if requests > 0 else None
+        self.deadline = time.perf_counter() + duration if duration > 0 else None
+        self._lock = threading.Lock()
+
+    def next(self) -> Optional[Request]:
+        with self._lock:
+            if self.deadline is not None and time.perf_counter() >= self.deadline:
+                return None
+            if self.remaining is not None:
+                if self.remaining <= 0:
+                    return None
+                self.remaining -= 1
+        return self.traffic.build(self.endpoints, self.weights)
+
+
+class Recorder:
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = {}
+        self.statuses: Dict[str, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, endpoint: str, elapsed_ms: float, status: Any) -> None:
+        with self._lock:
+            self.latencies.setdefault(endpoint, []).append(elapsed_ms)
+            counts = self.statuses.setdefault(endpoint, {})
+            counts[str(status)] = counts.get(str(status), 0) + 1
+
+
+async def _run_asgi(schedule: Schedule, concurrency: int, recorder: Recorder) -> None:
+    transport = httpx.ASGITransport(app=main.app, raise_app_exceptions=False)
+    async with httpx.AsyncClient(transport=transport, base_url="http://loadtest.local") as client:
+
+        async def worker() -> None:
+            while (request := schedule.next()) is not None:
+                url = f"{request.path}?{request.query}" if request.query else request.path
+                started = time.perf_counter()
+                try:
+                    response = await client.request(request.method, url, headers=request.headers, content=request.body)
+                    status = response.status_code
+                except Exception as e:
+                    status = type(e).__name__
+                recorder.record(request.endpoint, (time.perf_counter() - started) * 1000, status)
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+
+def http_api_event(request: Request) -> Dict[str, Any]:
+    """API Gateway HTTP API (payload format 2.0) event for a request."""
+    headers = dict(request.headers or {}, host="loadtest.execute-api.local", **{"user-agent": "loadtest"})
+    binary = bool(request.body) and not headers.get("content-type", "").startswith("application/json")
+    now = time.time()
+    return {
+        "version": "2.0",
+        "routeKey": "ANY /{proxy+}",
+        "rawPath": request.path,
+        "rawQueryString": request.query,
+        "headers": headers,
+        "requestContext": {
+            "accountId": "000000000000",
+            "apiId": "loadtest",
+            "domainName": headers["host"],
+            "http": {
+                "method": request.method,
+                "path": request.path,
+                "protocol": "HTTP/1.1",
+                "sourceIp": "127.0.0.1",
+                "userAgent": "loadtest"
+            },
+            "requestId": uuid.uuid4().hex,
+            "routeKey": "ANY /{proxy+}",
+            "stage": "$default",
+            "time": datetime.utcfromtimestamp(now).strftime("%d/%b/%Y:%H:%M:%S +0000"),
+            "timeEpoch": int(now * 1000)
+        },
+        "body": base64.b64encode(request.body).decode() if binary else request.body.decode(),
+        "isBase64Encoded": binary
+    }
+
+
+def _run_mangum(schedule: Schedule, concurrency: int, recorder: Recorder) -> None:
+
+    def worker() -> None:
+        # Mangum drives the app on the calling thread's event loop
+        asyncio.set_event_loop(asyncio.new_event_loop())
+        while (request := schedule.next()) is not None:
+            event = http_api_event(request)
+            started = time.perf_counter()
+            try:
+                status = main.handler(event, None)["statusCode"]
+            except Exception as e:
+                status = type(e).__name__
+            recorder.record(request.endpoint, (time.perf_counter() - started) * 1000, status)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for future in [pool.submit(worker) for _ in range(concurrency)]:
+            future.result()
+
+
+def run(transport: str, schedule: Schedule, concurrency: int) -> tuple:
+    """Drive the schedule; returns (recorder, wall time in seconds)."""
+    recorder = Recorder()
+    started = time.perf_counter()
+    if transport == "asgi":
+        asyncio.run(_run_asgi(schedule, concurrency, recorder))
+    else:
+        _run_mangum(schedule, concurrency, recorder)
+    return recorder, time.perf_counter() - started
+
+
+def _is_error(status: str) -> bool:
+    return not (status.isdigit() and (200 <= int(status) < 300 or status == "304"))
+
+
+def build_report(recorder: Recorder, elapsed: float, aws: ApiStandIns, settings: Dict[str, Any]) -> Dict[str, Any]:
+    endpoints = {}
+    for endpoint in sorted(recorder.latencies):
+        values = recorder.latencies[endpoint]
+        statuses = recorder.statuses[endpoint]
+        endpoints[endpoint] = {
+            "requests": len(values),
+            "throughput_rps": round(len(values) / elapsed, 3) if elapsed > 0 else 0.0,
+            "errors": sum(count for status, count in statuses.items() if _is_error(status)),
+            "status": statuses,
+            "latency_ms": tracing.summarize(values),
+        }
+    total = sum(e["requests"] for e in endpoints.values())
+    everything = [v for values in recorder.latencies.values() for v in values]
+    return dict(
+        settings,
+        finished_at=datetime.utcnow().isoformat(timespec="seconds"),
+        requests=total,
+        errors=sum(e["errors"] for e in endpoints.values()),
+        wall_time_s=round(elapsed, 3),
+        throughput_rps=round(total / elapsed, 3) if elapsed > 0 else 0.0,
+        latency_ms=tracing.summarize(everything),
+        endpoints=endpoints,
+        services=aws.stats(),
+    )
+
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+    """Per-endpoint change against an earlier report (fractions; +0.1 = 10% higher)."""
+    changes = {}
+    for endpoint, current in report["endpoints"].items():
+        before = baseline.get("endpoints", {}).get(endpoint)
+        if not before:
+            continue
+        change = {}
+        for stat in ("p50", "p95", "p99"):
+            old, new = before["latency_ms"][stat], current["latency_ms"][stat]
+            change[stat] = round((new - old) / old, 4) if old else 0.0
+        old_rps = before["throughput_rps"]
+        change["throughput_rps"] = round((current["throughput_rps"] - old_rps) / old_rps, 4) if old_rps else 0.0
+        changes[endpoint] = change
+    return changes
+
+
+def format_report(report: Dict[str, Any], changes: Optional[Dict[str, Dict[str, Any]]] = None) -> str:
+    header = f"{'endpoint':<10}{'requests':>10}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>8}"
+    if changes is not None:
+        header += f"{'p95 vs base':>13}"
+    lines = [header]
+    rows = list(report["endpoints"].items()) + [("all", dict(report, requests=report["requests"]))]
+    for endpoint, data in rows:
+        latency = data["latency_ms"]
+        line = (
+            f"{endpoint:<10}{data['requests']:>10}{data['throughput_rps']:>10.1f}"
+            f"{latency['p50']:>10.1f}{latency['p95']:>10.1f}{latency['p99']:>10.1f}{data['errors']:>8}"
+        )
+        if changes is not None and endpoint in changes:
+            line += f"{changes[endpoint]['p95']:>+13.1%}"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def parse_mix(value: str) -> Dict[str, float]:
+    if value in MIXES:
+        return dict(MIXES[value])
+    mix = {}
+    for part in value.split(","):
+        endpoint, _, weight = part.partition("=")
+        if not hasattr(Traffic, f"_{endpoint.strip()}") or not weight:
+            raise SystemExit(f"Expected a mix name ({', '.join(MIXES)}) or ENDPOINT=WEIGHT pairs, got '{part}'")
+        mix[endpoint.strip()] = float(weight)
+    return mix
+
+
+def _parse_service_options(values: List[str]) -> Dict[str, str]:
+    parsed = {}
+    for value in values:
+        service, _, spec = value.partition("=")
+        if not spec:
+            raise SystemExit(f"Expected SERVICE=SPEC, got '{value}'")
+        parsed[service] = spec
+    return parsed
+
+
+def main_cli(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--transport", choices=["asgi", "mangum"], default="asgi")
+    parser.add_argument("--concurrency", type=int, default=16, help="Concurrent clients")
+    parser.add_argument("--requests", type=int, default=2000, help="Requests to send (ignored with --duration)")
+    parser.add_argument("--duration", type=float, default=0.0, help="Run for this many seconds instead")
+    parser.add_argument("--warmup", type=int, default=100, help="Requests sent first and left out of the report")
+    parser.add_argument("--mix", default="browse", help=f"{', '.join(MIXES)} or e.g. list=10,image=5,upload=2")
+    parser.add_argument("--latency", action="append", default=[], metavar="SERVICE=SPEC",
+                        help="dynamodb, s3 or sqs, e.g. dynamodb=lognormal:6:0.4 s3=fixed:20")
+    parser.add_argument("--users", type=int, default=200, help="Seeded users for login")
+    parser.add_argument("--receipts", type=int, default=1000, help="Seeded receipts for list, detail and image")
+    parser.add_argument("--upload-kb", type=int, default=300, help="Size of each uploaded image")
+    parser.add_argument("--seed", type=int, default=None, help="Seed for latency and traffic")
+    parser.add_argument("--label", default="", help="Stored in the report, e.g. a branch or change name")
+    parser.add_argument("--output", help="Report path (default loadtest-results/<time>-<transport>.json)")
+    parser.add_argument("--baseline", help="Earlier report to compare against")
+    parser.add_argument("--max-regression", type=float, default=None,
+                        help="Fail when an endpoint's p95 is this fraction above the baseline, e.g. 0.1")
+    args = parser.parse_args(argv)
+
+    rng = random.Random(args.seed)
+    specs = _parse_service_options(args.latency)
+    latencies = {service: standins.LatencyModel.parse(spec, rng=rng) for service, spec in specs.items()}
+    traffic_rng = random.Random(None if args.seed is None else args.seed + 1)
+    mix = parse_mix(args.mix)
+
+    aws = ApiStandIns(latencies)
+    aws.install()
+    try:
+        traffic = Traffic(aws, args.users, args.receipts, args.upload_kb * 1024, traffic_rng)
+        if args.warmup > 0:
+            run(args.transport, Schedule(traffic, mix, args.warmup, 0.0), args.concurrency)
+            aws.reset_stats()
+        recorder, elapsed = run(args.transport, Schedule(traffic, mix, args.requests, args.duration), args.concurrency)
+    finally:
+        aws.uninstall()
+
+    settings = {
+        "label": args.label,
+        "transport": args.transport,
+        "concurrency": args.concurrency,
+        "mix": mix,
+        "latency": specs,
+        "seeded": {"users": args.users, "receipts": args.receipts},
+        "upload_kb": args.upload_kb,
+    }
+    report = build_report(recorder, elapsed, aws, settings)
+
+    changes = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            changes = compare(report, json.load(f))
+        report["baseline"] = {"path": args.baseline, "changes": changes}
+
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"{datetime.utcnow():%Y%m%dT%H%M%S}-{args.transport}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    print(format_report(report, changes))
+    print(f"\nReport written to {output}")
+
+    if report["errors"]:
+        return 1
+    if changes and args.max_regression is not None:
+        regressed = [e for e, change in changes.items() if change["p95"] > args.max_regression]
+        if regressed:
+            print(f"p95 regressed more than {args.max_regression:.0%} on: {', '.join(regressed)}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
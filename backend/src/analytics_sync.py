@@ -0,0 +1,54 @@
+"""DynamoDB Streams consumer that mirrors receipts into the analytics database.
+
+Each invocation gets a batch of stream records; the new images are collapsed
+to the latest per receipt and written with one bulk upsert (see
+models.sync_receipts), so re-delivered batches are harmless. On failure the
+whole batch is reported back, and the event source bisects it to isolate a
+poison record.
+
+Removals made by TTL are skipped: those receipts were archived to S3, not
+deleted, and stay in the analytics database.
+"""
+
+from boto3.dynamodb.types import TypeDeserializer
+
+import models
+
+_deserializer = TypeDeserializer()
+_schema_ready = False
+
+
+def _image(record: dict, name: str) -> dict:
+    raw = record.get('dynamodb', {}).get(name) or {}
+    return {key: _deserializer.deserialize(value) for key, value in raw.items()}
+
+
+def handler(event, context):
+    global _schema_ready
+    records = event.get('Records', [])
+    changes = []
+    for record in records:
+        receipt_id = _image(record, 'Keys')['receipt_id']
+        if record.get('eventName') == 'REMOVE':
+            if (record.get('userIdentity') or {}).get('principalId') == 'dynamodb.amazonaws.com':
+                continue
+            changes.append((receipt_id, None))
+        else:
+            changes.append((receipt_id, _image(record, 'NewImage')))
+
+    try:
+        if not _schema_ready:
+            models.init_db()
+            _schema_ready = True
+        models.sync_receipts(changes)
+    except Exception as e:
+        print(f"Analytics sync failed for {len(records)} records: {e}")
+        # Report from the first record; the rest of the batch is retried
+        if not records:
+            raise
+        return {'batchItemFailures': [
+            {'itemIdentifier': records[0]['dynamodb']['SequenceNumber']}
+        ]}
+
+    print(f"Analytics sync: applied {len(changes)} changes")
+    return {'batchItemFailures': []}
@@ -0,0 +1,212 @@
+"""Cold storage for receipts that aged out of the hot table.
+
+Receipt rows carry `expires_at` (created_at + HOT_RETENTION_DAYS). When
+DynamoDB's TTL deletes one, the archiver (archiver.py) merges the old image
+into a gzip-compressed bundle per user and month:
+
+    archive/<user_id>/<YYYY-MM>.json.gz    {"receipts": {receipt_id: item}}
+    archive/<user_id>/manifest.json.gz     {"months": {month: count}, "receipts": {receipt_id: month}}
+
+Items stay in DynamoDB JSON as the stream delivers them, so numbers, the
+binary line items and sets round-trip exactly. The API falls back to these
+bundles for date ranges, receipt ids and search hits that are no longer in
+the hot table; reads are cached per container for ARCHIVE_CACHE_TTL seconds.
+"""
+
+import base64
+import calendar
+import gzip
+import json
+import os
+import re
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from boto3.dynamodb.types import TypeDeserializer
+from botocore.exceptions import ClientError
+
+ARCHIVE_PREFIX = "archive"
+HOT_RETENTION_DAYS = int(os.environ.get("HOT_RETENTION_DAYS", "365"))
+ARCHIVE_CACHE_TTL = int(os.environ.get("ARCHIVE_CACHE_TTL", "60"))
+ARCHIVE_CACHE_SIZE = int(os.environ.get("ARCHIVE_CACHE_SIZE", "256"))
+
+_deserializer = TypeDeserializer()
+_cache: Dict[str, Tuple[float, Optional[dict]]] = {}
+_cache_lock = threading.Lock()
+
+
+_FRACTION_RE = re.compile(r"\.(\d+)")
+
+
+def parse_utc(value: str) -> datetime:
+    """Naive UTC datetime from an ISO time, with or without a Z or offset.
+
+    Python 3.10's fromisoformat takes neither 'Z' nor fractions other than
+    3 or 6 digits, both of which S3 event times can have.
+    """
+    value = value.strip()
+    if value[-1:] in ('Z', 'z'):
+        value = value[:-1] + '+00:00'
+    value = _FRACTION_RE.sub(lambda m: '.' + m.group(1).ljust(6, '0')[:6], value, count=1)
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def expires_at(created_at: str) -> int:
+    """TTL (epoch seconds) for a row created at the given ISO time."""
+    created = parse_utc(created_at)
+    return calendar.timegm((created + timedelta(days=HOT_RETENTION_DAYS)).timetuple())
+
+
+def month_of(created_at: Optional[str]) -> str:
+    return (created_at or '')[:7] or 'unknown'
+
+
+def bundle_key(user_id: str, month: str) -> str:
+    return f"{ARCHIVE_PREFIX}/{user_id}/{month}.json.gz"
+
+
+def manifest_key(user_id: str) -> str:
+    return f"{ARCHIVE_PREFIX}/{user_id}/manifest.json.gz"
+
+
+def _decode_binary(value: dict) -> dict:
+    """Stream images carry binary values base64-encoded; TypeDeserializer wants bytes."""
+    if 'B' in value:
+        return {'B': base64.b64decode(value['B'])}
+    if 'BS' in value:
+        return {'BS': [base64.b64decode(v) for v in value['BS']]}
+    if 'M' in value:
+        return {'M': {k: _decode_binary(v) for k, v in value['M'].items()}}
+    if 'L' in value:
+        return {'L': [_decode_binary(v) for v in value['L']]}
+    return value
+
+
+def deserialize(image: dict) -> dict:
+    """Plain item (Decimal numbers, bytes) from an archived stream image."""
+    return {key: _deserializer.deserialize(_decode_binary(value)) for key, value in image.items()}
+
+
+def _string(image: dict, name: str) -> Optional[str]:
+    return (image.get(name) or {}).get('S')
+
+
+def _read(s3_client, bucket: str, key: str, cached: bool = True) -> Optional[dict]:
+    now = time.monotonic()
+    if cached:
+        with _cache_lock:
+            hit = _cache.get(key)
+            if hit is not None and hit[0] > now:
+                return hit[1]
+    try:
+        body = s3_client.get_object(Bucket=bucket, Key=key)['Body'].read()
+        data = json.loads(gzip.decompress(body))
+    except ClientError as e:
+        if e.response.get('Error', {}).get('Code') not in ('NoSuchKey', '404'):
+            raise
+        data = None
+    if cached:
+        with _cache_lock:
+            if len(_cache) >= ARCHIVE_CACHE_SIZE:
+                _cache.clear()
+            _cache[key] = (now + ARCHIVE_CACHE_TTL, data)
+    return data
+
+
+def _write(s3_client, bucket: str, key: str, data: dict) -> None:
+    s3_client.put_object(
+        Bucket=bucket,
+        Key=key,
+        Body=gzip.compress(json.dumps(data, separators=(',', ':')).encode('utf-8')),
+        ContentType='application/gzip'
+    )
+
+
+def clear_cache() -> None:
+    with _cache_lock:
+        _cache.clear()
+
+
+def read_manifest(s3_client, bucket: str, user_id: str, cached: bool = True) -> dict:
+    return _read(s3_client, bucket, manifest_key(user_id), cached) or {'months': {}, 'receipts': {}}
+
+
+def read_bundle(s3_client, bucket: str, user_id: str, month: str, cached: bool = True) -> Dict[str, dict]:
+    """receipt_id -> stream image for one user and month."""
+    data = _read(s3_client, bucket, bundle_key(user_id, month), cached)
+    return (data or {}).get('receipts', {})
+
+
+def archive_images(s3_client, bucket: str, images: Iterable[dict]) -> int:
+    """Merge expired rows (stream OldImages) into their bundles; returns rows archived.
+
+    Re-archiving the same row just overwrites it, so redelivered batches are
+    harmless. Bundles are written before the manifest points at them.
+    """
+    by_user: Dict[str, Dict[str, Dict[str, dict]]] = {}
+    for image in images:
+        user_id, receipt_id = _string(image, 'user_id'), _string(image, 'receipt_id')
+        month = month_of(_string(image, 'created_at'))
+        by_user.setdefault(user_id, {}).setdefault(month, {})[receipt_id] = image
+
+    archived = 0
+    for user_id, months in by_user.items():
+        manifest = read_manifest(s3_client, bucket, user_id, cached=False)
+        for month, images_by_id in months.items():
+            bundle = read_bundle(s3_client, bucket, user_id, month, cached=False)
+            bundle.update(images_by_id)
+            _write(s3_client, bucket, bundle_key(user_id, month), {'receipts': bundle})
+            manifest['months'][month] = len(bundle)
+            for receipt_id in images_by_id:
+                manifest['receipts'][receipt_id] = month
+            archived += len(images_by_id)
+        _write(s3_client, bucket, manifest_key(user_id), manifest)
+    return archived
+
+
+def get_archived(s3_client, bucket: str, user_id: str, receipt_id: str) -> Optional[dict]:
+    month = read_manifest(s3_client, bucket, user_id)['receipts'].get(receipt_id)
+    if month is None:
+        return None
+    image = read_bundle(s3_client, bucket, user_id, month).get(receipt_id)
+    return deserialize(image) if image else None
+
+
+def iter_archived(
+    s3_client,
+    bucket: str,
+    user_id: str,
+    from_iso: Optional[str] = None,
+    to_iso: Optional[str] = None,
+    newest_first: bool = True
+) -> Iterator[dict]:
+    """A user's archived receipts in created_at order, limited to the range."""
+    months = sorted(read_manifest(s3_client, bucket, user_id)['months'], reverse=newest_first)
+    for month in months:
+        if from_iso and month < from_iso[:7] or to_iso and month > to_iso[:7]:
+            continue
+        items = [deserialize(image) for image in read_bundle(s3_client, bucket, user_id, month).values()]
+        items.sort(key=lambda item: (item.get('created_at', ''), item['receipt_id']), reverse=newest_first)
+        for item in items:
+            created_at = item.get('created_at', '')
+            if from_iso and created_at < from_iso or to_iso and created_at > to_iso:
+                continue
+            yield item
+
+
+def delete_user_archive(s3_client, bucket: str, user_id: str) -> int:
+    """Remove every bundle for a user; returns objects deleted."""
+    deleted = 0
+    paginator = s3_client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket, Prefix=f"{ARCHIVE_PREFIX}/{user_id}/"):
+        keys: List[dict] = [{'Key': obj['Key']} for obj in page.get('Contents', [])]
+        if keys:
+            s3_client.delete_objects(Bucket=bucket, Delete={'Objects': keys, 'Quiet': True})
+            deleted += len(keys)
+    clear_cache()
+    return deleted
@@ -0,0 +1,89 @@
+"""DynamoDB Streams consumer that archives receipts removed by TTL.
+
+The event source only delivers REMOVE records made by the TTL service (see
+the filter in template.yaml), so user deletes are never archived. The old
+images are merged into per-user, per-month bundles (archive.archive_images).
+A user's rows share a stream shard and a shard is processed one batch at a
+time, so one user's bundles are never written concurrently.
+
+Rows created before TTL was enabled have no expires_at; backfill them once:
+
+    python archiver.py --backfill-ttl
+"""
+
+import argparse
+import os
+import sys
+
+import boto3
+
+import archive
+
+BUCKET_NAME = os.environ.get("RECEIPT_BUCKET_NAME", "receipt-inbox-uploads-ml-stack-v2")
+DYNAMODB_TABLE = os.environ.get("DYNAMODB_TABLE", "ReceiptMetadata-ML-v2")
+
+s3_client = boto3.client('s3')
+
+
+def _is_ttl_removal(record: dict) -> bool:
+    identity = record.get('userIdentity') or {}
+    return (
+        record.get('eventName') == 'REMOVE'
+        and identity.get('type') == 'Service'
+        and identity.get('principalId') == 'dynamodb.amazonaws.com'
+    )
+
+
+def handler(event, context):
+    records = [r for r in event.get('Records', []) if _is_ttl_removal(r)]
+    images = [r['dynamodb']['OldImage'] for r in records if r.get('dynamodb', {}).get('OldImage')]
+    try:
+        archived = archive.archive_images(s3_client, BUCKET_NAME, images)
+    except Exception as e:
+        print(f"Archiving failed for {len(images)} receipts: {e}")
+        if not records:
+            raise
+        # Merges are idempotent, so the whole batch is retried from the start
+        return {'batchItemFailures': [
+            {'itemIdentifier': records[0]['dynamodb']['SequenceNumber']}
+        ]}
+
+    print(f"Archived {archived} expired receipts")
+    return {'batchItemFailures': []}
+
+
+def backfill_ttl(table) -> int:
+    """Set expires_at on rows that predate it; returns rows updated."""
+    updated = 0
+    scan_args = {
+        'ProjectionExpression': 'user_id, receipt_id, created_at',
+        'FilterExpression': 'attribute_not_exists(expires_at) AND attribute_exists(created_at)'
+    }
+    while True:
+        page = table.scan(**scan_args)
+        for item in page.get('Items', []):
+            table.update_item(
+                Key={'user_id': item['user_id'], 'receipt_id': item['receipt_id']},
+                UpdateExpression='SET expires_at = :expires',
+                ConditionExpression='attribute_exists(receipt_id)',
+                ExpressionAttributeValues={':expires': archive.expires_at(item['created_at'])}
+            )
+            updated += 1
+        if 'LastEvaluatedKey' not in page:
+            return updated
+        scan_args['ExclusiveStartKey'] = page['LastEvaluatedKey']
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backfill-ttl", action="store_true", help="Set expires_at on rows that lack it")
+    args = parser.parse_args(argv)
+    if not args.backfill_ttl:
+        parser.error("nothing to do (use --backfill-ttl)")
+    table = boto3.resource('dynamodb').Table(DYNAMODB_TABLE)
+    print(f"Set expires_at on {backfill_ttl(table)} receipts")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
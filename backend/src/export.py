@@ -0,0 +1,276 @@
+"""Streaming receipt exports (CSV / Parquet).
+
+Receipts are paged out of DynamoDB with a generator and encoded chunk by
+chunk, so memory stays flat no matter how many receipts a user has. The
+same chunk iterators back the streaming endpoint and the background export
+that writes to S3 with a multipart upload.
+"""
+
+import csv
+import io
+import json
+import zlib
+from decimal import Decimal
+from typing import Iterable, Iterator, List, Optional
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet is optional; CSV always works
+    pa = None
+
+EXPORT_PAGE_SIZE = 500
+PARQUET_ROW_GROUP_SIZE = 5000
+# S3 multipart parts must be at least 5 MB (except the last)
+MULTIPART_PART_SIZE = 8 * 1024 * 1024
+
+RECEIPT_COLUMNS = [
+    'receipt_id', 'created_at', 'purchase_date', 'merchant_name', 'category',
+    'subtotal', 'tax', 'total', 'status', 'alert_count'
+]
+ITEM_COLUMNS = ['item_index', 'item_description', 'item_qty', 'item_unit_price', 'item_line_total']
+NUMERIC_COLUMNS = {'subtotal', 'tax', 'total', 'item_qty', 'item_unit_price', 'item_line_total'}
+INTEGER_COLUMNS = {'alert_count', 'item_index'}
+
+FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+}
+
+
+def parquet_available() -> bool:
+    return pa is not None
+
+
+def columns(include_items: bool) -> List[str]:
+    return RECEIPT_COLUMNS + (ITEM_COLUMNS if include_items else [])
+
+
+def iter_receipts(
+    table,
+    index_name: str,
+    user_id: str,
+    from_iso: Optional[str] = None,
+    to_iso: Optional[str] = None,
+    page_size: int = EXPORT_PAGE_SIZE
+) -> Iterator[dict]:
+    """Yield a user's receipts oldest first, one DynamoDB page at a time."""
+    key_condition = 'user_id = :uid'
+    values = {':uid': user_id}
+    if from_iso and to_iso:
+        key_condition += ' AND created_at BETWEEN :from AND :to'
+        values.update({':from': from_iso, ':to': to_iso})
+    elif from_iso:
+        key_condition += ' AND created_at >= :from'
+        values[':from'] = from_iso
+    elif to_iso:
+        key_condition += ' AND created_at <= :to'
+        values[':to'] = to_iso
+
+    query_args = {
+        'IndexName': index_name,
+        'KeyConditionExpression': key_condition,
+        'ExpressionAttributeValues': values,
+        'Limit': page_size
+    }
+    while True:
+        response = table.query(**query_args)
+        yield from response.get('Items', [])
+        if 'LastEvaluatedKey' not in response:
+            return
+        query_args['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+# Compact line items written by the worker (ml/item_codec.py): a version
+# byte, then zlib-compressed JSON columns with amounts in cents and
+# quantities in thousandths
+LINE_ITEMS_ATTRIBUTE = 'line_items_z'
+LINE_ITEMS_FORMAT_VERSION = 1
+_ITEM_COLUMNS = {
+    'd': ('description', None),
+    'q': ('qty', 1000),
+    'u': ('unit_price', 100),
+    't': ('line_total', 100),
+}
+
+
+def decode_line_items(data) -> list:
+    raw = bytes(getattr(data, 'value', data))
+    if not raw or raw[0] != LINE_ITEMS_FORMAT_VERSION:
+        raise ValueError(f"Unsupported line item encoding version {raw[:1]!r}")
+    columns = json.loads(zlib.decompress(raw[1:]))
+    count = len(columns.get('d', []))
+    items = []
+    for i in range(count):
+        item = {}
+        for key, (field, scale) in _ITEM_COLUMNS.items():
+            value = columns.get(key, [None] * count)[i]
+            if value is not None:
+                item[field] = value if scale is None else Decimal(value) / scale
+        items.append(item)
+    return items
+
+
+def line_items(receipt: dict) -> list:
+    """Decoded items: the compact attribute, or the older list of maps."""
+    if receipt.get(LINE_ITEMS_ATTRIBUTE) is not None:
+        return decode_line_items(receipt[LINE_ITEMS_ATTRIBUTE])
+    return receipt.get('line_items') or []
+
+
+def flatten(receipts: Iterable[dict], include_items: bool) -> Iterator[dict]:
+    """One row per receipt, or per line item with the receipt columns repeated."""
+    for receipt in receipts:
+        base = {
+            'receipt_id': receipt.get('receipt_id'),
+            'created_at': receipt.get('created_at'),
+            'purchase_date': receipt.get('purchase_date'),
+            'merchant_name': receipt.get('merchant_name') or receipt.get('merchant'),
+            'category': receipt.get('category'),
+            'subtotal': receipt.get('subtotal'),
+            'tax': receipt.get('tax'),
+            'total': receipt.get('total', receipt.get('total_amount')),
+            'status': receipt.get('status'),
+            'alert_count': len(receipt.get('alerts') or []),
+        }
+        items = line_items(receipt) if include_items else []
+        if not items:
+            yield dict(base, **{c: None for c in ITEM_COLUMNS}) if include_items else base
+            continue
+        for index, item in enumerate(items):
+            yield dict(
+                base,
+                item_index=index,
+                item_description=item.get('description'),
+                item_qty=item.get('qty'),
+                item_unit_price=item.get('unit_price'),
+                item_line_total=item.get('line_total'),
+            )
+
+
+def iter_csv(rows: Iterable[dict], include_items: bool, flush_rows: int = 500) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=columns(include_items), extrasaction='ignore')
+    writer.writeheader()
+    pending = 0
+    for row in rows:
+        writer.writerow({k: ('' if v is None else v) for k, v in row.items()})
+        pending += 1
+        if pending >= flush_rows:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+            pending = 0
+    yield buffer.getvalue().encode('utf-8')
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file that hands written bytes back to a generator."""
+
+    def __init__(self):
+        self.chunks: List[bytes] = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self) -> bytes:
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def _parquet_schema(include_items: bool):
+    fields = []
+    for name in columns(include_items):
+        if name in NUMERIC_COLUMNS:
+            fields.append(pa.field(name, pa.float64()))
+        elif name in INTEGER_COLUMNS:
+            fields.append(pa.field(name, pa.int64()))
+        else:
+            fields.append(pa.field(name, pa.string()))
+    return pa.schema(fields)
+
+
+def _parquet_value(name: str, value):
+    if value is None or value == '':
+        return None
+    if name in NUMERIC_COLUMNS:
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return None
+    if name in INTEGER_COLUMNS:
+        return int(value)
+    return str(value)
+
+
+def iter_parquet(rows: Iterable[dict], include_items: bool, row_group_size: int = PARQUET_ROW_GROUP_SIZE) -> Iterator[bytes]:
+    """Encode rows as Parquet, emitting bytes after every row group."""
+    if pa is None:
+        raise RuntimeError("pyarrow is not installed")
+
+    schema = _parquet_schema(include_items)
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema, compression='snappy')
+    batch = {name: [] for name in schema.names}
+
+    def write_group():
+        writer.write_table(pa.table(batch, schema=schema), row_group_size=row_group_size)
+        for values in batch.values():
+            values.clear()
+
+    count = 0
+    for row in rows:
+        for name in schema.names:
+            batch[name].append(_parquet_value(name, row.get(name)))
+        count += 1
+        if count % row_group_size == 0:
+            write_group()
+            yield sink.drain()
+    if count % row_group_size or count == 0:
+        write_group()
+    writer.close()
+    yield sink.drain()
+
+
+def encode(rows: Iterable[dict], fmt: str, include_items: bool) -> Iterator[bytes]:
+    if fmt == 'parquet':
+        return iter_parquet(rows, include_items)
+    return iter_csv(rows, include_items)
+
+
+def upload_stream(s3_client, bucket: str, key: str, chunks: Iterable[bytes], content_type: str) -> int:
+    """Multipart-upload a chunk stream to S3 without holding it all; returns bytes written."""
+    upload = s3_client.create_multipart_upload(Bucket=bucket, Key=key, ContentType=content_type)
+    upload_id = upload['UploadId']
+    parts = []
+    buffer = bytearray()
+    written = 0
+
+    def send(data: bytes):
+        number = len(parts) + 1
+        response = s3_client.upload_part(
+            Bucket=bucket, Key=key, UploadId=upload_id, PartNumber=number, Body=bytes(data)
+        )
+        parts.append({'ETag': response['ETag'], 'PartNumber': number})
+
+    try:
+        for chunk in chunks:
+            buffer.extend(chunk)
+            written += len(chunk)
+            if len(buffer) >= MULTIPART_PART_SIZE:
+                send(buffer)
+                buffer = bytearray()
+        if buffer or not parts:
+            send(buffer)
+        s3_client.complete_multipart_upload(
+            Bucket=bucket, Key=key, UploadId=upload_id, MultipartUpload={'Parts': parts}
+        )
+    except Exception:
+        s3_client.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id)
+        raise
+    return written
@@ -1,17 +1,34 @@
 import os
+import re
+import asyncio
+import time
+import functools
+import itertools
 import json
 import uuid
+import base64
+import zipfile
+import mimetypes
+import unicodedata
 import boto3
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import List, Optional
+from urllib.parse import unquote_plus
 from decimal import Decimal
+from concurrent.futures import ThreadPoolExecutor
 
-from fastapi import FastAPI, Depends, HTTPException, status, UploadFile, File, Form
+from fastapi import FastAPI, Depends, HTTPException, status, UploadFile, File, Form, Query, Header, Response
 from fastapi.security import OAuth2PasswordBearer
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from mangum import Mangum
 from jose import jwt, JWTError
+from botocore.config import Config
+from botocore.exceptions import ClientError
+
+import archive
+import export
 
 app = FastAPI()
 
@@ -22,6 +39,7 @@ app.add_middleware(
     allow_credentials=False,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag"],
 )
 
 # --- Configuration ---
@@ -31,18 +49,185 @@ ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
 BUCKET_NAME = os.environ.get("RECEIPT_BUCKET_NAME", "receipt-inbox-uploads-ml-stack-v2")
 QUEUE_URL = os.environ.get("SQS_QUEUE_URL")
+# Backfills go to their own queue so they can't starve interactive uploads;
+# without one both lanes share QUEUE_URL and the worker still tells them apart
+BULK_QUEUE_URL = os.environ.get("SQS_BULK_QUEUE_URL") or QUEUE_URL
+# Receipts a user may have processing before further single uploads are
+# demoted to the bulk lane (0 disables)
+INTERACTIVE_USER_CAP = int(os.environ.get("INTERACTIVE_USER_CAP", "25"))
+PRIORITY_INTERACTIVE = "interactive"
+PRIORITY_BULK = "bulk"
 DYNAMODB_TABLE = os.environ.get("DYNAMODB_TABLE", "ReceiptMetadata-ML-v2")
+STATS_TABLE = os.environ.get("STATS_TABLE", "UserStats-ML-v2")
+JOB_STATUS_TABLE = os.environ.get("JOB_STATUS_TABLE", "JobStatus-ML-v2")
+SEARCH_TABLE = os.environ.get("SEARCH_TABLE", "ReceiptSearch-ML-v2")
 ANOMALY_TOPIC_ARN = os.environ.get("ANOMALY_TOPIC_ARN", "")
 
 # --- AWS Clients ---
-s3_client = boto3.client('s3')
-sqs_client = boto3.client('sqs')
-sns_client = boto3.client('sns')
-dynamodb = boto3.resource('dynamodb')
+# boto3 is blocking. Async endpoints hand calls to a dedicated executor whose
+# threads share each client's connection pool, sized to match the executor.
+AWS_IO_WORKERS = int(os.environ.get("AWS_IO_WORKERS", "32"))
+aws_config = Config(max_pool_connections=AWS_IO_WORKERS, retries={'mode': 'standard'})
+aws_executor = ThreadPoolExecutor(max_workers=AWS_IO_WORKERS, thread_name_prefix="aws-io")
+
+s3_client = boto3.client('s3', config=aws_config)
+sqs_client = boto3.client('sqs', config=aws_config)
+sns_client = boto3.client('sns', config=aws_config)
+lambda_client = boto3.client('lambda', config=aws_config)
+dynamodb = boto3.resource('dynamodb', config=aws_config)
 receipts_table = dynamodb.Table(DYNAMODB_TABLE)
 users_table = dynamodb.Table("Users-ML-v2")  # We'll create this
+stats_table = dynamodb.Table(STATS_TABLE)  # Rollups maintained by the ML worker
+search_table = dynamodb.Table(SEARCH_TABLE)  # Inverted index maintained by the ML worker
+
+async def aws_call(fn, *args, **kwargs):
+    """Run a blocking boto3 call on the AWS executor without blocking the event loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(aws_executor, functools.partial(fn, *args, **kwargs))
+
+def aws_parallel(*calls):
+    """Run independent blocking calls concurrently from sync code; returns their results.
+    
+    Not for use from inside aws_executor itself (the caller would hold a worker).
+    """
+    futures = [aws_executor.submit(call) for call in calls]
+    return [future.result() for future in futures]
 
 import hashlib
+import threading
+from collections import OrderedDict
+
+# --- Receipt Lookup ---
+# GSI on receipt_id (KEYS_ONLY) used to find a receipt's owner without a scan
+RECEIPT_ID_INDEX = os.environ.get("RECEIPT_ID_INDEX", "receipt_id-index")
+RECEIPT_OWNER_CACHE_SIZE = int(os.environ.get("RECEIPT_OWNER_CACHE_SIZE", "10000"))
+
+# receipt_id -> user_id; ownership never changes, so entries only leave by LRU
+_receipt_owner_cache: "OrderedDict[str, str]" = OrderedDict()
+_receipt_owner_lock = threading.Lock()
+
+def _cache_receipt_owner(receipt_id: str, user_id: str):
+    with _receipt_owner_lock:
+        _receipt_owner_cache[receipt_id] = user_id
+        _receipt_owner_cache.move_to_end(receipt_id)
+        while len(_receipt_owner_cache) > RECEIPT_OWNER_CACHE_SIZE:
+            _receipt_owner_cache.popitem(last=False)
+
+def find_receipt_owner(receipt_id: str) -> Optional[str]:
+    """Return the user_id owning a receipt via the receipt_id GSI (cached)."""
+    with _receipt_owner_lock:
+        user_id = _receipt_owner_cache.get(receipt_id)
+        if user_id is not None:
+            _receipt_owner_cache.move_to_end(receipt_id)
+            return user_id
+    
+    response = receipts_table.query(
+        IndexName=RECEIPT_ID_INDEX,
+        KeyConditionExpression='receipt_id = :rid',
+        ExpressionAttributeValues={':rid': receipt_id},
+        Limit=1
+    )
+    items = response.get('Items', [])
+    if not items:
+        return None
+    
+    user_id = items[0]['user_id']
+    _cache_receipt_owner(receipt_id, user_id)
+    return user_id
+
+def find_receipt(receipt_id: str) -> Optional[dict]:
+    """Fetch a receipt by id alone: one index query (or cache hit) plus one get_item."""
+    user_id = find_receipt_owner(receipt_id)
+    if user_id is None:
+        return None
+    
+    response = receipts_table.get_item(Key={'user_id': user_id, 'receipt_id': receipt_id})
+    if 'Item' not in response:
+        # Deleted since it was cached
+        with _receipt_owner_lock:
+            _receipt_owner_cache.pop(receipt_id, None)
+        return None
+    return response['Item']
+
+# --- Receipt Listing ---
+# GSI (user_id, created_at) so listings page newest-first and support date ranges
+CREATED_AT_INDEX = os.environ.get("CREATED_AT_INDEX", "user_id-created_at-index")
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+END_OF_DAY = "T23:59:59.999999"
+
+# Attributes the dashboard list view needs (view=compact)
+COMPACT_FIELDS = [
+    'receipt_id', 'status', 'merchant_name', 'total_amount',
+    'category', 'purchase_date', 'created_at', 'alerts', 'anomalies'
+]
+_FIELD_NAME = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+
+def _validate_date(value: str) -> str:
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').strftime('%Y-%m-%d')
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid date '{value}', expected YYYY-MM-DD")
+
+def build_projection(fields: list) -> dict:
+    """ProjectionExpression with every name aliased (status, total, ... are reserved)."""
+    wanted = list(dict.fromkeys(['receipt_id'] + fields))
+    for field in wanted:
+        if not _FIELD_NAME.match(field):
+            raise HTTPException(status_code=400, detail=f"Invalid field '{field}'")
+    names = {f"#f{i}": field for i, field in enumerate(wanted)}
+    return {
+        'ProjectionExpression': ', '.join(names),
+        'ExpressionAttributeNames': names
+    }
+
+def encode_cursor(last_evaluated_key: Optional[dict]) -> Optional[str]:
+    """Opaque page token wrapping DynamoDB's LastEvaluatedKey."""
+    if not last_evaluated_key:
+        return None
+    raw = json.dumps(last_evaluated_key, default=str, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_cursor(cursor: str, user_id: str) -> dict:
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        key = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    # A cursor only resumes the caller's own partition
+    if not isinstance(key, dict) or key.get('user_id') != user_id:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return key
+
+# --- Archived Receipts ---
+# Rows older than HOT_RETENTION_DAYS are removed by TTL and archived to S3
+# bundles by archiver.py. Reads that run past the hot table continue there.
+def find_archived_receipt(user_id: str, receipt_id: str) -> Optional[dict]:
+    return archive.get_archived(s3_client, BUCKET_NAME, user_id, receipt_id)
+
+def project_item(item: dict, fields: Optional[list]) -> dict:
+    """Apply a listing projection to an archived item (the query does it for hot rows)."""
+    if not fields:
+        return item
+    return {field: item[field] for field in dict.fromkeys(['receipt_id'] + fields) if field in item}
+
+def archived_page(user_id: str, from_iso: Optional[str], to_iso: Optional[str],
+                  position: Optional[dict], limit: int, fields: Optional[list]) -> tuple:
+    """Up to `limit` archived receipts after position (newest first).
+    
+    Returns (items, next_position); next_position is None when nothing older remains.
+    """
+    after = (position['created_at'], position['receipt_id']) if position and 'receipt_id' in position else None
+    items, last = [], {}
+    for item in archive.iter_archived(s3_client, BUCKET_NAME, user_id, from_iso, to_iso):
+        key = (item.get('created_at', ''), item['receipt_id'])
+        if after and key >= after:
+            continue
+        if len(items) == limit:
+            return items, last
+        items.append(strip_line_items(project_item(item, fields)))
+        last = {'created_at': key[0], 'receipt_id': key[1]}
+    return items, None
 
 # --- Security Setup ---
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
@@ -52,6 +237,20 @@ class UserSignup(BaseModel):
     username: str
     password: str
 
+class UploadRequest(BaseModel):
+    filename: str
+    content_type: str
+    size: int
+
+class ExportRequest(BaseModel):
+    format: str = "csv"
+    from_date: Optional[str] = None
+    to_date: Optional[str] = None
+    include_items: bool = True
+
+class ImageUrlsRequest(BaseModel):
+    receipt_ids: List[str]
+
 class Token(BaseModel):
     access_token: str
     token_type: str
@@ -66,14 +265,161 @@ def get_password_hash(password):
     # Use SHA256 for password hashing
     return hashlib.sha256(password.encode()).hexdigest()
 
+# Tokens carry every claim authorization needs (sub, jti, iat), so requests
+# are authorized without reading the Users table. Revocation goes through a
+# small denylist item whose version each container polls at most every
+# DENYLIST_REFRESH_SECONDS.
+TOKEN_CLAIMS_VERSION = 1
+USER_CACHE_TTL = int(os.environ.get("USER_CACHE_TTL", "300"))
+USER_CACHE_SIZE = int(os.environ.get("USER_CACHE_SIZE", "1000"))
+DENYLIST_REFRESH_SECONDS = float(os.environ.get("DENYLIST_REFRESH_SECONDS", "15"))
+DENYLIST_KEY = "#denylist"  # Reserved Users-table key; signup rejects '#' names
+
 def create_access_token(data: dict):
     to_encode = data.copy()
     expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    to_encode.update({"exp": expire})
+    to_encode.update({
+        "exp": expire,
+        # Millisecond precision, like revocation cut-offs, so a login right
+        # after "log out everywhere" is not caught by it
+        "iat": round(time.time(), 3),
+        "jti": uuid.uuid4().hex,
+        "ver": TOKEN_CLAIMS_VERSION
+    })
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-def get_current_user(token: str = Depends(oauth2_scheme)):
+class TTLCache:
+    """Bounded LRU with per-entry expiry; safe to share between request threads."""
+    
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._items: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, key: str):
+        with self._lock:
+            entry = self._items.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self._items[key]
+                return None
+            self._items.move_to_end(key)
+            return entry[1]
+    
+    def put(self, key: str, value):
+        with self._lock:
+            self._items[key] = (time.monotonic() + self.ttl, value)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+    
+    def pop(self, key: str):
+        with self._lock:
+            self._items.pop(key, None)
+
+_user_cache = TTLCache(USER_CACHE_SIZE, USER_CACHE_TTL)
+
+def get_user_record(username: str) -> Optional[dict]:
+    """Users-table record, cached per container for USER_CACHE_TTL seconds."""
+    user = _user_cache.get(username)
+    if user is None:
+        user = users_table.get_item(Key={'username': username}).get('Item')
+        if user is not None:
+            _user_cache.put(username, user)
+    return user
+
+def _epoch(value) -> Decimal:
+    """Epoch seconds to the millisecond, as DynamoDB stores numbers."""
+    return Decimal(str(round(float(value), 3)))
+
+class Denylist:
+    """Revoked token ids and per-user not-before times, mirrored from one item.
+    
+    The item is {version, tokens: {jti: exp}, users: {username: not_before}};
+    entries are pruned once every token they could match has expired.
+    """
+    
+    def __init__(self, table, key: str, refresh_seconds: float):
+        self.table = table
+        self.key = key
+        self.refresh_seconds = refresh_seconds
+        self.version = None
+        self.tokens: dict = {}
+        self.users: dict = {}
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+    
+    def is_revoked(self, username: str, jti: Optional[str], issued_at: float) -> bool:
+        self._refresh()
+        if jti is not None and jti in self.tokens:
+            return True
+        return _epoch(issued_at) <= self.users.get(username, -1)
+    
+    def _refresh(self, force: bool = False):
+        with self._lock:
+            if not force and time.monotonic() - self._checked_at < self.refresh_seconds:
+                return
+            self._checked_at = time.monotonic()
+        
+        # Cheap version probe; the full item is only read when it changed
+        probe = self.table.get_item(
+            Key={'username': self.key},
+            ProjectionExpression='#v',
+            ExpressionAttributeNames={'#v': 'version'}
+        ).get('Item')
+        version = probe.get('version') if probe else None
+        if version == self.version and not force:
+            return
+        item = self.table.get_item(Key={'username': self.key}, ConsistentRead=True).get('Item') or {}
+        with self._lock:
+            self.version = item.get('version')
+            self.tokens = {k: int(v) for k, v in item.get('tokens', {}).items()}
+            self.users = {k: _epoch(v) for k, v in item.get('users', {}).items()}
+    
+    def revoke_token(self, jti: str, expires_at: int):
+        self._update(lambda tokens, users: tokens.__setitem__(jti, expires_at))
+    
+    def revoke_user(self, username: str, not_before: float):
+        not_before = _epoch(not_before)
+        self._update(lambda tokens, users: users.__setitem__(username, max(not_before, users.get(username, 0))))
+    
+    def _update(self, change, retries: int = 5):
+        """Read-modify-write guarded by the version attribute."""
+        for _ in range(retries):
+            item = self.table.get_item(Key={'username': self.key}, ConsistentRead=True).get('Item')
+            now = int(time.time())
+            prev = item.get('version') if item else None
+            tokens = {k: int(v) for k, v in (item or {}).get('tokens', {}).items() if int(v) > now}
+            users = {
+                k: _epoch(v) for k, v in (item or {}).get('users', {}).items()
+                if _epoch(v) + ACCESS_TOKEN_EXPIRE_MINUTES * 60 > now
+            }
+            change(tokens, users)
+            try:
+                self.table.put_item(
+                    Item={'username': self.key, 'version': (prev or 0) + 1, 'tokens': tokens, 'users': users},
+                    ConditionExpression='attribute_not_exists(username)' if prev is None else '#v = :prev',
+                    **({} if prev is None else {
+                        'ExpressionAttributeNames': {'#v': 'version'},
+                        'ExpressionAttributeValues': {':prev': prev}
+                    })
+                )
+            except ClientError as e:
+                if e.response.get('Error', {}).get('Code') != 'ConditionalCheckFailedException':
+                    raise
+                continue
+            with self._lock:
+                self.version, self.tokens, self.users = (prev or 0) + 1, tokens, users
+                self._checked_at = time.monotonic()
+            return
+        raise RuntimeError("Denylist update kept conflicting, try again")
+
+denylist = Denylist(users_table, DENYLIST_KEY, DENYLIST_REFRESH_SECONDS)
+
+def _decode_token(token: str) -> dict:
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -81,17 +427,34 @@ def get_current_user(token: str = Depends(oauth2_scheme)):
     )
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            raise credentials_exception
     except JWTError:
         raise credentials_exception
+    if payload.get("sub") is None:
+        raise credentials_exception
+    return payload
+
+def get_current_user(token: str = Depends(oauth2_scheme)):
+    credentials_exception = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Could not validate credentials",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+    payload = _decode_token(token)
+    username: str = payload["sub"]
     
     try:
-        response = users_table.get_item(Key={'username': username})
-        if 'Item' not in response:
+        if denylist.is_revoked(username, payload.get("jti"), float(payload.get("iat", 0))):
+            raise credentials_exception
+        if payload.get("ver") == TOKEN_CLAIMS_VERSION:
+            return {'username': username, 'token_id': payload["jti"], 'issued_at': payload["iat"]}
+        
+        # Tokens issued before claims were added still need the user record
+        user = get_user_record(username)
+        if user is None:
             raise credentials_exception
-        return response['Item']
+        return user
+    except HTTPException:
+        raise
     except:
         raise credentials_exception
 
@@ -100,6 +463,9 @@ def get_current_user(token: str = Depends(oauth2_scheme)):
 def signup(user: UserSignup):
     """Create user in DynamoDB and return JWT"""
     try:
+        if not user.username or user.username.startswith('#'):
+            raise HTTPException(status_code=400, detail="Invalid username")
+        
         # Check if user exists
         response = users_table.get_item(Key={'username': user.username})
         if 'Item' in response:
@@ -148,6 +514,21 @@ def login(user: UserSignup):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Login error: {str(e)}")
 
+@app.post("/logout")
+def logout(all_sessions: bool = False, token: str = Depends(oauth2_scheme)):
+    """Revoke this token, or every token issued to the user so far"""
+    user = get_current_user(token)
+    payload = _decode_token(token)
+    try:
+        if all_sessions or "jti" not in payload:
+            denylist.revoke_user(user['username'], time.time())
+            _user_cache.pop(user['username'])
+        else:
+            denylist.revoke_token(payload["jti"], int(payload["exp"]))
+        return {"message": "Logged out"}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Logout error: {str(e)}")
+
 # --- CORS Preflight Handler ---
 @app.options("/")
 @app.options("/{path:path}")
@@ -155,48 +536,409 @@ async def options_handler(path: str = ""):
     """Handle CORS preflight requests"""
     return {"status": "ok"}
 
-# --- Receipt Upload Endpoint ---
-@app.post("/")
-async def upload_receipt(file: UploadFile = File(...)):
-    """Upload receipt and trigger ML processing"""
+# --- Receipt Upload Endpoints ---
+# Clients upload straight to S3 with a presigned POST; the receipt row and the
+# SQS job are created when the object lands (S3 event) or on /complete,
+# whichever comes first.
+MAX_UPLOAD_BYTES = int(os.environ.get("MAX_UPLOAD_BYTES", str(20 * 1024 * 1024)))
+UPLOAD_URL_EXPIRES = int(os.environ.get("UPLOAD_URL_EXPIRES", "900"))
+ALLOWED_CONTENT_TYPES = {"image/jpeg", "image/jpg", "image/png", "image/heic", "image/heif", "image/webp"}
+UPLOAD_KEY_PATTERN = re.compile(r'^receipts/(?P<user_id>[^/]+)/(?P<receipt_id>[0-9a-f-]{36})_(?P<filename>.+)$')
+
+def build_upload_key(user_id: str, receipt_id: str, filename: str) -> str:
+    # Keep keys S3/URL friendly; the original name is only informational
+    safe_name = re.sub(r'[^A-Za-z0-9._-]', '_', os.path.basename(filename or '')) or 'receipt'
+    return f"receipts/{user_id}/{receipt_id}_{safe_name[:100]}"
+
+def create_receipt_row(user_id: str, receipt_id: str, s3_key: str, created_at: Optional[str] = None) -> bool:
+    """Insert the PROCESSING row; False if the receipt already exists."""
+    created_at = created_at or datetime.utcnow().isoformat()
+    try:
+        receipts_table.put_item(
+            Item={
+                'user_id': user_id,
+                'receipt_id': receipt_id,
+                's3_key': s3_key,
+                'status': 'PROCESSING',
+                'created_at': created_at,
+                # Removed by TTL after HOT_RETENTION_DAYS and archived to S3
+                'expires_at': archive.expires_at(created_at)
+            },
+            ConditionExpression='attribute_not_exists(receipt_id)'
+        )
+    except ClientError as e:
+        if e.response.get('Error', {}).get('Code') == 'ConditionalCheckFailedException':
+            return False
+        raise
+    _cache_receipt_owner(receipt_id, user_id)
+    return True
+
+def upload_priority(processing: int) -> str:
+    """Lane for a single upload, given the user's receipts now processing."""
+    if INTERACTIVE_USER_CAP and processing > INTERACTIVE_USER_CAP:
+        return PRIORITY_BULK
+    return PRIORITY_INTERACTIVE
+
+def enqueue_job(user_id: str, receipt_id: str, s3_key: str, origin: str, priority: str = PRIORITY_INTERACTIVE):
+    """Send SQS message to trigger ML processing"""
+    if not QUEUE_URL:
+        return
+    message = {
+        "job_id": receipt_id,
+        "user_id": user_id,
+        "s3_key": s3_key,
+        "priority": priority,
+        "origin": origin
+    }
+    sqs_client.send_message(
+        QueueUrl=BULK_QUEUE_URL if priority == PRIORITY_BULK else QUEUE_URL,
+        MessageBody=json.dumps(message)
+    )
+
+def finalize_upload(
+    user_id: str,
+    receipt_id: str,
+    s3_key: str,
+    created_at: Optional[str] = None,
+    origin: str = "s3_event"
+) -> bool:
+    """Create the receipt row and enqueue processing once per receipt.
+    
+    Returns False when the receipt was already finalized (S3 event and
+    /complete racing, or a redelivered event).
+    """
+    if not create_receipt_row(user_id, receipt_id, s3_key, created_at):
+        return False
+    # The upload counter picks the lane, so the job is sent after it
+    processing = record_upload(user_id)
+    enqueue_job(user_id, receipt_id, s3_key, origin, upload_priority(processing))
+    return True
+
+@app.post("/uploads")
+def create_upload(upload: UploadRequest):
+    """Presigned POST for uploading a receipt image directly to S3"""
     try:
-        # Use a test user for now
         test_user = {'username': 'testuser'}
-        # Generate unique IDs
+        content_type = upload.content_type.lower()
+        if content_type not in ALLOWED_CONTENT_TYPES:
+            raise HTTPException(status_code=400, detail=f"Unsupported content type: {upload.content_type}")
+        if upload.size <= 0 or upload.size > MAX_UPLOAD_BYTES:
+            raise HTTPException(status_code=400, detail=f"File size must be between 1 and {MAX_UPLOAD_BYTES} bytes")
+        
         receipt_id = str(uuid.uuid4())
-        s3_key = f"receipts/{test_user['username']}/{receipt_id}_{file.filename}"
+        s3_key = build_upload_key(test_user['username'], receipt_id, upload.filename)
         
-        # Upload to S3
-        file_content = await file.read()
-        s3_client.put_object(
+        # S3 enforces the key, type and size; the URL cannot be reused for other objects
+        post = s3_client.generate_presigned_post(
             Bucket=BUCKET_NAME,
             Key=s3_key,
-            Body=file_content,
-            ContentType=file.content_type
+            Fields={'Content-Type': content_type},
+            Conditions=[
+                {'Content-Type': content_type},
+                ['content-length-range', 1, MAX_UPLOAD_BYTES]
+            ],
+            ExpiresIn=UPLOAD_URL_EXPIRES
         )
         
-        # Create initial DynamoDB entry
-        receipts_table.put_item(
-            Item={
-                'user_id': test_user['username'],
+        return {
+            "receipt_id": receipt_id,
+            "key": s3_key,
+            "url": post['url'],
+            "fields": post['fields'],
+            "expires_in": UPLOAD_URL_EXPIRES
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Upload error: {str(e)}")
+
+@app.post("/uploads/{receipt_id}/complete")
+def complete_upload(receipt_id: str, key: str):
+    """Finalize a direct upload (the S3 event does the same if this call is lost)"""
+    try:
+        test_user = {'username': 'testuser'}
+        match = UPLOAD_KEY_PATTERN.match(key)
+        if not match or match.group('user_id') != test_user['username'] or match.group('receipt_id') != receipt_id:
+            raise HTTPException(status_code=400, detail="Key does not belong to this upload")
+        
+        try:
+            s3_client.head_object(Bucket=BUCKET_NAME, Key=key)
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                raise HTTPException(status_code=409, detail="Upload has not reached S3 yet")
+            raise
+        
+        created = finalize_upload(test_user['username'], receipt_id, key, origin="direct_upload")
+        return {
+            "receipt_id": receipt_id,
+            "status": "PROCESSING",
+            "message": "Receipt uploaded successfully" if created else "Receipt already submitted"
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Upload error: {str(e)}")
+
+def handle_s3_event(event: dict) -> dict:
+    """ObjectCreated notifications for receipts/ finalize uploads server-side."""
+    finalized = 0
+    for record in event.get('Records', []):
+        key = unquote_plus(record['s3']['object']['key'])
+        match = UPLOAD_KEY_PATTERN.match(key)
+        if not match:
+            print(f"Ignoring S3 object outside the upload layout: {key}")
+            continue
+        # eventTime looks like 2026-10-19T01:02:03.456Z; rows store naive UTC
+        event_time = record.get('eventTime')
+        created_at = archive.parse_utc(event_time).isoformat() if event_time else None
+        if finalize_upload(match.group('user_id'), match.group('receipt_id'), key, created_at):
+            finalized += 1
+    return {"finalized": finalized}
+
+# --- Bulk Upload ---
+# Many files (or zip archives of images) in one request: rows are written with
+# batch_writer, objects are streamed to S3 concurrently and jobs go out 10 per
+# SendMessageBatch. Progress lives in the user's stats partition under
+# BATCH#<batch_id>; the ML worker adds completed/failed as jobs finish.
+BULK_MAX_FILES = int(os.environ.get("BULK_MAX_FILES", "500"))
+BULK_UPLOAD_WORKERS = int(os.environ.get("BULK_UPLOAD_WORKERS", "8"))
+SQS_BATCH_SIZE = 10
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.heic', '.heif', '.webp'}
+
+def _image_content_type(filename: str) -> Optional[str]:
+    if os.path.splitext(filename.lower())[1] not in IMAGE_EXTENSIONS:
+        return None
+    return mimetypes.guess_type(filename)[0] or 'image/jpeg'
+
+def _bulk_entries(files: List[UploadFile]) -> list:
+    """(filename, content_type, opener) per image; zips are expanded lazily."""
+    entries = []
+    for upload in files:
+        name = upload.filename or 'receipt'
+        if name.lower().endswith('.zip') or upload.content_type in ('application/zip', 'application/x-zip-compressed'):
+            zf = zipfile.ZipFile(upload.file)
+            for info in zf.infolist():
+                base = os.path.basename(info.filename)
+                content_type = _image_content_type(base)
+                if info.is_dir() or base.startswith('.') or info.filename.startswith('__MACOSX/') or not content_type:
+                    continue
+                entries.append((base, content_type, lambda z=zf, i=info: z.open(i)))
+        elif upload.content_type in ALLOWED_CONTENT_TYPES or _image_content_type(name):
+            content_type = upload.content_type if upload.content_type in ALLOWED_CONTENT_TYPES else _image_content_type(name)
+            entries.append((name, content_type, lambda u=upload: u.file))
+    return entries
+
+def _send_jobs(messages: list) -> list:
+    """Enqueue bulk-lane jobs 10 per SendMessageBatch; returns the receipt ids that failed twice."""
+    failed = []
+    for start in range(0, len(messages), SQS_BATCH_SIZE):
+        pending = {m['job_id']: m for m in messages[start:start + SQS_BATCH_SIZE]}
+        for _ in range(2):
+            response = sqs_client.send_message_batch(
+                QueueUrl=BULK_QUEUE_URL,
+                Entries=[
+                    {'Id': str(i), 'MessageBody': json.dumps(m)}
+                    for i, m in enumerate(pending.values())
+                ]
+            )
+            ids = list(pending)
+            pending = {ids[int(f['Id'])]: pending[ids[int(f['Id'])]] for f in response.get('Failed', [])}
+            if not pending:
+                break
+        failed.extend(pending)
+    return failed
+
+@app.post("/uploads/bulk")
+def bulk_upload(files: List[UploadFile] = File(...)):
+    """Upload many receipt images, or zip archives of them, in one request"""
+    try:
+        test_user = {'username': 'testuser'}
+        user_id = test_user['username']
+        try:
+            entries = _bulk_entries(files)
+        except zipfile.BadZipFile:
+            raise HTTPException(status_code=400, detail="Invalid zip archive")
+        if not entries:
+            raise HTTPException(status_code=400, detail="No receipt images found")
+        if len(entries) > BULK_MAX_FILES:
+            raise HTTPException(status_code=400, detail=f"Too many files (max {BULK_MAX_FILES})")
+        
+        batch_id = str(uuid.uuid4())
+        created_at = datetime.utcnow().isoformat()
+        receipts = []
+        for filename, content_type, opener in entries:
+            receipt_id = str(uuid.uuid4())
+            receipts.append({
                 'receipt_id': receipt_id,
-                's3_key': s3_key,
-                'status': 'PROCESSING',
-                'created_at': datetime.utcnow().isoformat()
+                'filename': filename,
+                'content_type': content_type,
+                'opener': opener,
+                's3_key': build_upload_key(user_id, receipt_id, filename)
+            })
+        
+        stats_table.put_item(Item={
+            'user_id': user_id,
+            'stat_key': f"BATCH#{batch_id}",
+            'batch_id': batch_id,
+            'total': len(receipts),
+            'created_at': created_at
+        })
+        
+        # Rows go in before the objects so the S3 upload event finds them and
+        # does not enqueue a second job
+        with receipts_table.batch_writer() as batch:
+            for r in receipts:
+                batch.put_item(Item={
+                    'user_id': user_id,
+                    'receipt_id': r['receipt_id'],
+                    's3_key': r['s3_key'],
+                    'status': 'PROCESSING',
+                    'batch_id': batch_id,
+                    'created_at': created_at,
+                    'expires_at': archive.expires_at(created_at)
+                })
+        
+        def upload(r):
+            # Zip members are streamed from the archive; ZipFile serializes reads
+            with r['opener']() as body:
+                s3_client.upload_fileobj(body, BUCKET_NAME, r['s3_key'], ExtraArgs={'ContentType': r['content_type']})
+        
+        errors = []
+        uploaded = []
+        with ThreadPoolExecutor(max_workers=BULK_UPLOAD_WORKERS) as pool:
+            for r, future in [(r, pool.submit(upload, r)) for r in receipts]:
+                try:
+                    future.result()
+                    uploaded.append(r)
+                except Exception as e:
+                    errors.append({'filename': r['filename'], 'error': str(e)})
+        
+        failed_ids = {r['receipt_id'] for r in receipts} - {r['receipt_id'] for r in uploaded}
+        if failed_ids:
+            with receipts_table.batch_writer() as batch:
+                for receipt_id in failed_ids:
+                    batch.delete_item(Key={'user_id': user_id, 'receipt_id': receipt_id})
+        
+        unqueued = []
+        if QUEUE_URL and uploaded:
+            unqueued = _send_jobs([
+                {
+                    "job_id": r['receipt_id'],
+                    "user_id": user_id,
+                    "s3_key": r['s3_key'],
+                    "batch_id": batch_id,
+                    "priority": PRIORITY_BULK,
+                    "origin": "bulk_upload"
+                }
+                for r in uploaded
+            ])
+            for receipt_id in unqueued:
+                receipts_table.update_item(
+                    Key={'user_id': user_id, 'receipt_id': receipt_id},
+                    UpdateExpression='SET #status = :status, #error = :error',
+                    ExpressionAttributeNames={'#status': 'status', '#error': 'error'},
+                    ExpressionAttributeValues={':status': 'FAILED', ':error': 'Could not queue for processing'}
+                )
+            if unqueued:
+                stats_table.update_item(
+                    Key={'user_id': user_id, 'stat_key': 'TOTAL'},
+                    UpdateExpression='ADD failed :n, version :one',
+                    ExpressionAttributeValues={':n': len(unqueued), ':one': 1}
+                )
+        
+        stats_table.update_item(
+            Key={'user_id': user_id, 'stat_key': f"BATCH#{batch_id}"},
+            UpdateExpression='ADD uploaded :uploaded, upload_failed :upload_failed, failed :unqueued',
+            ExpressionAttributeValues={
+                ':uploaded': len(uploaded),
+                ':upload_failed': len(errors),
+                ':unqueued': len(unqueued)
             }
         )
+        if uploaded:
+            record_upload(user_id, len(uploaded))
         
-        # Send SQS message to trigger ML processing
-        if QUEUE_URL:
-            message = {
-                "job_id": receipt_id,
-                "user_id": test_user['username'],
-                "s3_key": s3_key
-            }
-            sqs_client.send_message(
-                QueueUrl=QUEUE_URL,
-                MessageBody=json.dumps(message)
-            )
+        return {
+            "batch_id": batch_id,
+            "total": len(receipts),
+            "uploaded": len(uploaded),
+            "errors": errors,
+            "receipt_ids": [r['receipt_id'] for r in uploaded]
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Upload error: {str(e)}")
+
+@app.get("/uploads/bulk/{batch_id}")
+def get_bulk_upload(batch_id: str):
+    """Progress of a bulk upload"""
+    try:
+        test_user = {'username': 'testuser'}
+        item = stats_table.get_item(
+            Key={'user_id': test_user['username'], 'stat_key': f"BATCH#{batch_id}"}
+        ).get('Item')
+        if item is None:
+            raise HTTPException(status_code=404, detail="Batch not found")
+        
+        total = item.get('total', 0)
+        uploaded = item.get('uploaded', 0)
+        completed = item.get('completed', 0)
+        failed = item.get('failed', 0)
+        upload_failed = item.get('upload_failed', 0)
+        processing = max(0, uploaded - completed - failed)
+        return {
+            "batch_id": batch_id,
+            "created_at": item.get('created_at'),
+            "total": total,
+            "uploaded": uploaded,
+            "upload_failed": upload_failed,
+            "completed": completed,
+            "failed": failed,
+            "processing": processing,
+            "done": uploaded + upload_failed >= total and processing == 0
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+
+@app.post("/")
+async def upload_receipt(file: UploadFile = File(...)):
+    """Upload receipt through the API (small files; prefer /uploads)"""
+    try:
+        # Use a test user for now
+        test_user = {'username': 'testuser'}
+        # Generate unique IDs
+        receipt_id = str(uuid.uuid4())
+        s3_key = build_upload_key(test_user['username'], receipt_id, file.filename)
+        
+        user_id = test_user['username']
+        
+        # Upload to S3 and create the row at the same time; the conditional
+        # put keeps this and the S3 event from both queueing the job
+        file_content = await file.read()
+        uploaded, created = await asyncio.gather(
+            aws_call(
+                s3_client.put_object,
+                Bucket=BUCKET_NAME,
+                Key=s3_key,
+                Body=file_content,
+                ContentType=file.content_type
+            ),
+            aws_call(create_receipt_row, user_id, receipt_id, s3_key),
+            return_exceptions=True
+        )
+        if isinstance(uploaded, Exception):
+            if created is True:
+                await aws_call(receipts_table.delete_item, Key={'user_id': user_id, 'receipt_id': receipt_id})
+            raise uploaded
+        if isinstance(created, Exception):
+            raise created
+        
+        if created:
+            processing = await aws_call(record_upload, user_id)
+            await aws_call(enqueue_job, user_id, receipt_id, s3_key, "upload", upload_priority(processing))
         
         return {
             "receipt_id": receipt_id,
@@ -206,73 +948,729 @@ async def upload_receipt(file: UploadFile = File(...)):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Upload error: {str(e)}")
 
-# --- Receipt Image Endpoint ---
-@app.get("/receipts/{receipt_id}/image")
-def get_receipt_image(receipt_id: str):
-    """Generate presigned URL for receipt image"""
+# --- Conditional GET ---
+# Every write to a user's receipts bumps `version` on their TOTAL stats item
+# (the worker does it in the same ADD as its rollups). Read endpoints derive
+# ETags from it, so an unchanged dashboard costs one small read and a 304.
+def bump_user_version(user_id: str):
+    stats_table.update_item(
+        Key={'user_id': user_id, 'stat_key': 'TOTAL'},
+        UpdateExpression='ADD version :one',
+        ExpressionAttributeValues={':one': 1}
+    )
+
+def get_user_version(user_id: str) -> int:
+    # Strongly consistent: a stale version would answer 304 for changed data
+    item = stats_table.get_item(
+        Key={'user_id': user_id, 'stat_key': 'TOTAL'},
+        ProjectionExpression='version',
+        ConsistentRead=True
+    ).get('Item') or {}
+    return int(item.get('version', 0))
+
+def make_etag(version: int, *parts) -> str:
+    digest = hashlib.sha1(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()[:16]
+    return f'W/"{version}-{digest}"'
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    # Weak comparison: W/"x" and "x" are equivalent for If-None-Match
+    opaque = lambda tag: tag[2:] if tag.startswith('W/') else tag
+    candidates = [opaque(tag.strip()) for tag in if_none_match.split(',')]
+    return '*' in candidates or opaque(etag) in candidates
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers={'ETag': etag, 'Cache-Control': 'private, no-cache'})
+
+# --- Receipt Export ---
+# GET streams the export straight back (fine locally and for modest sizes;
+# API Gateway buffers Lambda responses). POST runs it in the background,
+# writing to S3 with a multipart upload, and reports through /jobs/status.
+EXPORT_FUNCTION_NAME = os.environ.get("EXPORT_FUNCTION_NAME")
+EXPORT_PREFIX = "exports"
+
+def _export_range(from_date: Optional[str], to_date: Optional[str]) -> tuple:
+    return (
+        _validate_date(from_date) if from_date else None,
+        _validate_date(to_date) + END_OF_DAY if to_date else None
+    )
+
+def _export_format(fmt: str) -> str:
+    fmt = fmt.lower()
+    if fmt not in export.FORMATS:
+        raise HTTPException(status_code=400, detail="format must be csv or parquet")
+    if fmt == 'parquet' and not export.parquet_available():
+        raise HTTPException(status_code=501, detail="Parquet export is not available (pyarrow missing)")
+    return fmt
+
+def export_chunks(user_id: str, fmt: str, from_iso: Optional[str], to_iso: Optional[str], include_items: bool):
+    # Archived receipts are older than anything still in the hot table
+    receipts = itertools.chain(
+        archive.iter_archived(s3_client, BUCKET_NAME, user_id, from_iso, to_iso, newest_first=False),
+        export.iter_receipts(receipts_table, CREATED_AT_INDEX, user_id, from_iso, to_iso)
+    )
+    return export.encode(export.flatten(receipts, include_items), fmt, include_items)
+
+def run_export_job(user_id: str, export_id: str, fmt: str, from_iso: Optional[str],
+                   to_iso: Optional[str], include_items: bool):
+    """Write an export to S3 and record the outcome under the export id."""
+    content_type, extension = export.FORMATS[fmt]
+    key = f"{EXPORT_PREFIX}/{user_id}/{export_id}.{extension}"
+    job_status_source.publish(user_id, export_id, 'EXPORTING')
     try:
-        # Scan for receipt (no GSI available)
-        response = receipts_table.scan(
-            FilterExpression='receipt_id = :rid',
-            ExpressionAttributeValues={':rid': receipt_id}
+        size = export.upload_stream(
+            s3_client, BUCKET_NAME, key,
+            export_chunks(user_id, fmt, from_iso, to_iso, include_items),
+            content_type
         )
+        job_status_source.publish(user_id, export_id, 'COMPLETED', key=key, bytes=size, format=fmt)
+    except Exception as e:
+        print(f"Export {export_id} failed: {e}")
+        job_status_source.publish(user_id, export_id, 'FAILED', error=str(e))
+
+@app.get("/receipts/export")
+def export_receipts(
+    format: str = Query("csv", description="csv or parquet"),
+    from_date: Optional[str] = Query(None, description="Earliest created_at (YYYY-MM-DD)"),
+    to_date: Optional[str] = Query(None, description="Latest created_at (YYYY-MM-DD)"),
+    include_items: bool = Query(True, description="One row per line item")
+):
+    """Stream all of the user's receipts as CSV or Parquet"""
+    try:
+        user_id = 'testuser'
+        fmt = _export_format(format)
+        from_iso, to_iso = _export_range(from_date, to_date)
+        content_type, extension = export.FORMATS[fmt]
+        return StreamingResponse(
+            export_chunks(user_id, fmt, from_iso, to_iso, include_items),
+            media_type=content_type,
+            headers={'Content-Disposition': f'attachment; filename="receipts.{extension}"'}
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Export error: {str(e)}")
+
+@app.post("/receipts/export")
+def start_export(request: ExportRequest):
+    """Export in the background to S3; poll /receipts/export/{export_id} for the link"""
+    try:
+        user_id = 'testuser'
+        fmt = _export_format(request.format)
+        from_iso, to_iso = _export_range(request.from_date, request.to_date)
+        export_id = str(uuid.uuid4())
+        job = {
+            'user_id': user_id,
+            'export_id': export_id,
+            'fmt': fmt,
+            'from_iso': from_iso,
+            'to_iso': to_iso,
+            'include_items': request.include_items
+        }
         
-        if not response.get('Items'):
-            raise HTTPException(status_code=404, detail="Receipt not found")
+        job_status_source.publish(user_id, export_id, 'QUEUED')
+        if EXPORT_FUNCTION_NAME:
+            # Long exports run in their own function with a longer timeout
+            lambda_client.invoke(
+                FunctionName=EXPORT_FUNCTION_NAME,
+                InvocationType='Event',
+                Payload=json.dumps({'export_job': job}).encode()
+            )
+        else:
+            aws_executor.submit(run_export_job, **job)
+        
+        return {"export_id": export_id, "status": "QUEUED"}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Export error: {str(e)}")
+
+@app.get("/receipts/export/{export_id}")
+def get_export(export_id: str):
+    """Export status, with a download link once it is ready"""
+    try:
+        user_id = 'testuser'
+        job = job_status_source.fetch(user_id, [export_id]).get(export_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail="Export not found")
         
-        receipt = response['Items'][0]
-        s3_key = receipt.get('s3_key')
+        result = {"export_id": export_id, "status": job['stage']}
+        detail = job.get('detail') or {}
+        if job['stage'] == 'COMPLETED':
+            result['download_url'] = s3_client.generate_presigned_url(
+                'get_object',
+                Params={'Bucket': BUCKET_NAME, 'Key': detail['key']},
+                ExpiresIn=PRESIGNED_URL_EXPIRES
+            )
+            result['bytes'] = detail.get('bytes')
+        elif job['stage'] == 'FAILED':
+            result['error'] = detail.get('error')
+        return result
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+
+# --- Receipt Image Endpoints ---
+PRESIGNED_URL_EXPIRES = int(os.environ.get("PRESIGNED_URL_EXPIRES", "3600"))
+# Re-sign once a cached URL has less than this left, so clients never get a
+# URL that expires while the image is still on screen
+PRESIGNED_URL_MIN_REMAINING = int(os.environ.get("PRESIGNED_URL_MIN_REMAINING", "600"))
+IMAGE_URL_BATCH_MAX = 100
+
+# receipt_id -> (image_url, expires_at); the same URL is returned while it is
+# valid, so browsers can cache the image itself
+_presigned_url_cache = TTLCache(
+    int(os.environ.get("PRESIGNED_URL_CACHE_SIZE", "5000")),
+    PRESIGNED_URL_EXPIRES - PRESIGNED_URL_MIN_REMAINING
+)
+
+def presign_image(receipt_id: str, s3_key: str) -> tuple:
+    cached = _presigned_url_cache.get(receipt_id)
+    if cached is not None:
+        return cached
+    expires_at = int(time.time()) + PRESIGNED_URL_EXPIRES
+    presigned_url = s3_client.generate_presigned_url(
+        'get_object',
+        Params={'Bucket': BUCKET_NAME, 'Key': s3_key},
+        ExpiresIn=PRESIGNED_URL_EXPIRES
+    )
+    _presigned_url_cache.put(receipt_id, (presigned_url, expires_at))
+    return presigned_url, expires_at
+
+@app.get("/receipts/{receipt_id}/image")
+def get_receipt_image(receipt_id: str, response: Response):
+    """Presigned URL for receipt image (reused per container while valid)"""
+    try:
+        cached = _presigned_url_cache.get(receipt_id)
+        if cached is None:
+            receipt = find_receipt(receipt_id)
+            if receipt is None:
+                raise HTTPException(status_code=404, detail="Receipt not found")
+            
+            s3_key = receipt.get('s3_key')
+            
+            if not s3_key:
+                raise HTTPException(status_code=404, detail="Receipt image not found")
+            cached = presign_image(receipt_id, s3_key)
         
-        if not s3_key:
-            raise HTTPException(status_code=404, detail="Receipt image not found")
+        presigned_url, expires_at = cached
+        max_age = max(0, expires_at - int(time.time()) - PRESIGNED_URL_MIN_REMAINING)
+        response.headers['Cache-Control'] = f'private, max-age={max_age}'
+        return {"image_url": presigned_url, "expires_at": expires_at}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+
+@app.post("/receipts/images")
+def get_receipt_images(request: ImageUrlsRequest):
+    """Presigned URLs for many receipts at once"""
+    try:
+        receipt_ids = list(dict.fromkeys(request.receipt_ids))
+        if len(receipt_ids) > IMAGE_URL_BATCH_MAX:
+            raise HTTPException(status_code=400, detail=f"At most {IMAGE_URL_BATCH_MAX} receipt ids per request")
         
-        # Generate presigned URL (valid for 1 hour)
-        presigned_url = s3_client.generate_presigned_url(
-            'get_object',
-            Params={'Bucket': BUCKET_NAME, 'Key': s3_key},
-            ExpiresIn=3600
-        )
+        images = {}
+        keys = []
+        for receipt_id in receipt_ids:
+            cached = _presigned_url_cache.get(receipt_id)
+            if cached is not None:
+                images[receipt_id] = {"image_url": cached[0], "expires_at": cached[1]}
+                continue
+            user_id = find_receipt_owner(receipt_id)
+            if user_id is not None:
+                keys.append({'user_id': user_id, 'receipt_id': receipt_id})
+        
+        # One BatchGetItem instead of a get_item per receipt
+        while keys:
+            response = dynamodb.batch_get_item(RequestItems={
+                DYNAMODB_TABLE: {'Keys': keys, 'ProjectionExpression': 'receipt_id, s3_key'}
+            })
+            for item in response.get('Responses', {}).get(DYNAMODB_TABLE, []):
+                if item.get('s3_key'):
+                    url, expires_at = presign_image(item['receipt_id'], item['s3_key'])
+                    images[item['receipt_id']] = {"image_url": url, "expires_at": expires_at}
+            keys = response.get('UnprocessedKeys', {}).get(DYNAMODB_TABLE, {}).get('Keys', [])
         
-        return {"image_url": presigned_url}
+        return {
+            "images": images,
+            "missing": [receipt_id for receipt_id in receipt_ids if receipt_id not in images]
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+
+# --- Receipt Search ---
+# The worker keeps one item per (user_id, token) whose receipt_ids set lists
+# the receipts containing that merchant/item token (ml/search_index.py), so a
+# search reads only the postings of its terms, never the user's history.
+SEARCH_MAX_TERMS = 8
+SEARCH_MAX_PREFIX_TOKENS = 200  # distinct tokens one `term*` may expand to
+SEARCH_PAGE_SIZE = 50
+SEARCH_MAX_PAGE_SIZE = 100  # one BatchGetItem
+# Tokenization must match ml/search_index.py
+_SEARCH_TOKEN = re.compile(r'[a-z0-9]+')
+SEARCH_STOPWORDS = frozenset({'and', 'the', 'for', 'with', 'of', 'to', 'in', 'on', 'at', 'by', 'an'})
+
+def parse_search_query(q: str) -> List[tuple]:
+    """[(token, is_prefix)]; `ink print*` means ink AND a token starting with print."""
+    terms = []
+    for raw in q.split():
+        normalized = unicodedata.normalize('NFKD', raw).encode('ascii', 'ignore').decode('ascii').lower()
+        tokens = _SEARCH_TOKEN.findall(normalized)
+        for i, token in enumerate(tokens):
+            prefix = raw.endswith('*') and i == len(tokens) - 1
+            if len(token) < 2 or (not prefix and (token.isdigit() or token in SEARCH_STOPWORDS)):
+                continue
+            terms.append((token[:40], prefix))
+    terms = list(dict.fromkeys(terms))
+    if not terms:
+        raise HTTPException(status_code=400, detail="Query has no searchable terms")
+    if len(terms) > SEARCH_MAX_TERMS:
+        raise HTTPException(status_code=400, detail=f"At most {SEARCH_MAX_TERMS} search terms")
+    return terms
+
+def decode_posting(value) -> str:
+    """Inverse of ml/search_index.encode_posting (16-byte UUID or NUL-tagged text)."""
+    raw = bytes(getattr(value, 'value', value))
+    if len(raw) == 16:
+        return str(uuid.UUID(bytes=raw))
+    return raw[1:].decode('utf-8')
+
+def _exact_postings(user_id: str, tokens: List[str]) -> dict:
+    postings = {token: set() for token in tokens}
+    keys = [{'user_id': user_id, 'token': token} for token in tokens]
+    while keys:
+        response = dynamodb.batch_get_item(RequestItems={
+            SEARCH_TABLE: {'Keys': keys, 'ProjectionExpression': '#t, receipt_ids', 'ExpressionAttributeNames': {'#t': 'token'}}
+        })
+        for item in response.get('Responses', {}).get(SEARCH_TABLE, []):
+            postings[item['token']] = {decode_posting(v) for v in item.get('receipt_ids', ())}
+        keys = response.get('UnprocessedKeys', {}).get(SEARCH_TABLE, {}).get('Keys', [])
+    return postings
+
+def _prefix_postings(user_id: str, prefix: str) -> set:
+    """Union of the postings of every token starting with prefix."""
+    ids = set()
+    query_args = {
+        'KeyConditionExpression': 'user_id = :uid AND begins_with(#t, :p)',
+        'ExpressionAttributeNames': {'#t': 'token'},
+        'ExpressionAttributeValues': {':uid': user_id, ':p': prefix},
+        'Limit': SEARCH_MAX_PREFIX_TOKENS
+    }
+    page = search_table.query(**query_args)
+    for item in page.get('Items', []):
+        ids.update(decode_posting(v) for v in item.get('receipt_ids', ()))
+    return ids
+
+def search_receipt_ids(user_id: str, terms: List[tuple]) -> List[str]:
+    exact = [token for token, prefix in terms if not prefix]
+    prefixes = [token for token, prefix in terms if prefix]
+    calls = [functools.partial(_prefix_postings, user_id, p) for p in prefixes]
+    if exact:
+        calls.append(functools.partial(_exact_postings, user_id, exact))
+    results = aws_parallel(*calls)
+    postings = results[:len(prefixes)] + (list(results[-1].values()) if exact else [])
+    # Intersect smallest first; stop early once nothing can match
+    postings.sort(key=len)
+    matches = set(postings[0])
+    for ids in postings[1:]:
+        if not matches:
+            break
+        matches &= ids
+    return sorted(matches)
+
+@app.get("/receipts/search")
+def search_receipts(
+    response: Response,
+    q: str = Query(..., min_length=1, max_length=200, description="Terms to AND together; `term*` matches a prefix"),
+    limit: int = Query(SEARCH_PAGE_SIZE, ge=1, le=SEARCH_MAX_PAGE_SIZE),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
+    if_none_match: Optional[str] = Header(None)
+):
+    """Search receipts by merchant and line item text"""
+    user_id = 'testuser'
+    try:
+        terms = parse_search_query(q)
+        etag = make_etag(get_user_version(user_id), 'search', terms, limit, cursor)
+        if etag_matches(if_none_match, etag):
+            return not_modified(etag)
+        
+        matches = search_receipt_ids(user_id, terms)
+        remaining = [receipt_id for receipt_id in matches if cursor is None or receipt_id > cursor]
+        page_ids = remaining[:limit]
+        
+        items = []
+        keys = [{'user_id': user_id, 'receipt_id': receipt_id} for receipt_id in page_ids]
+        while keys:
+            batch = dynamodb.batch_get_item(RequestItems={
+                DYNAMODB_TABLE: dict(build_projection(COMPACT_FIELDS), Keys=keys)
+            })
+            items.extend(batch.get('Responses', {}).get(DYNAMODB_TABLE, []))
+            keys = batch.get('UnprocessedKeys', {}).get(DYNAMODB_TABLE, {}).get('Keys', [])
+        # The index keeps postings for receipts that have since been archived
+        found = {item['receipt_id'] for item in items}
+        for receipt_id in page_ids:
+            if receipt_id not in found:
+                archived = find_archived_receipt(user_id, receipt_id)
+                if archived is not None:
+                    items.append(strip_line_items(project_item(archived, COMPACT_FIELDS)))
+        items.sort(key=lambda item: item.get('created_at', ''), reverse=True)
+        
+        response.headers['ETag'] = etag
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return {
+            "receipts": items,
+            "count": len(items),
+            "total_matches": len(matches),
+            "next_cursor": page_ids[-1] if len(remaining) > limit else None
+        }
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
 
 # --- Receipt Retrieval Endpoints ---
+# Line items are stored compressed (export.LINE_ITEMS_ATTRIBUTE) and only
+# decoded for the detail view; listings drop the encoded blob
+def hydrate_line_items(receipt: dict) -> dict:
+    encoded = receipt.pop(export.LINE_ITEMS_ATTRIBUTE, None)
+    if encoded is not None:
+        receipt['line_items'] = export.decode_line_items(encoded)
+    return receipt
+
+def strip_line_items(receipt: dict) -> dict:
+    receipt.pop(export.LINE_ITEMS_ATTRIBUTE, None)
+    return receipt
+
 @app.get("/receipts/{receipt_id}")
-def get_receipt(receipt_id: str, current_user: dict = Depends(get_current_user)):
+def get_receipt(
+    receipt_id: str,
+    response: Response,
+    current_user: dict = Depends(get_current_user),
+    if_none_match: Optional[str] = Header(None)
+):
     """Fetch a single processed receipt"""
     try:
-        response = receipts_table.get_item(
+        etag = make_etag(get_user_version(current_user['username']), 'receipt', receipt_id)
+        if etag_matches(if_none_match, etag):
+            return not_modified(etag)
+        
+        result = receipts_table.get_item(
             Key={
                 'user_id': current_user['username'],
                 'receipt_id': receipt_id
             }
         )
         
-        if 'Item' not in response:
+        item = result.get('Item') or find_archived_receipt(current_user['username'], receipt_id)
+        if item is None:
             raise HTTPException(status_code=404, detail="Receipt not found")
         
-        return response['Item']
+        response.headers['ETag'] = etag
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return hydrate_line_items(item)
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
 
 @app.get("/receipts")
-def list_receipts():
-    """List all receipts for test user"""
+def list_receipts(
+    response: Response,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    from_date: Optional[str] = Query(None, description="Earliest created_at (YYYY-MM-DD)"),
+    to_date: Optional[str] = Query(None, description="Latest created_at (YYYY-MM-DD)"),
+    fields: Optional[str] = Query(None, description="Comma-separated attributes to return"),
+    view: str = Query("full", pattern="^(full|compact)$"),
+    if_none_match: Optional[str] = Header(None)
+):
+    """List receipts for test user, newest first, one page at a time"""
+    user_id = 'testuser'
     try:
-        response = receipts_table.query(
+        # Read the version before the query so the ETag never claims newer data
+        etag = make_etag(get_user_version(user_id), 'list', limit, cursor, from_date, to_date, fields, view)
+        if etag_matches(if_none_match, etag):
+            return not_modified(etag)
+        
+        from_iso = _validate_date(from_date) if from_date else None
+        to_iso = _validate_date(to_date) + END_OF_DAY if to_date else None
+        key_condition = 'user_id = :uid'
+        values = {':uid': user_id}
+        if from_iso and to_iso:
+            key_condition += ' AND created_at BETWEEN :from AND :to'
+            values.update({':from': from_iso, ':to': to_iso})
+        elif from_iso:
+            key_condition += ' AND created_at >= :from'
+            values[':from'] = from_iso
+        elif to_iso:
+            key_condition += ' AND created_at <= :to'
+            values[':to'] = to_iso
+        
+        query_args = {
+            'IndexName': CREATED_AT_INDEX,
+            'KeyConditionExpression': key_condition,
+            'ExpressionAttributeValues': values,
+            'ScanIndexForward': False,
+            'Limit': limit
+        }
+        
+        projection = COMPACT_FIELDS if view == 'compact' else None
+        if fields:
+            projection = [f.strip() for f in fields.split(',') if f.strip()]
+        if projection:
+            query_args.update(build_projection(projection))
+        
+        start = decode_cursor(cursor, user_id) if cursor else None
+        if start and start.get('archived'):
+            # Hot rows were exhausted on an earlier page
+            items, last_key = [], None
+        else:
+            if start:
+                query_args['ExclusiveStartKey'] = start
+            page = receipts_table.query(**query_args)
+            items = [strip_line_items(item) for item in page.get('Items', [])]
+            last_key = page.get('LastEvaluatedKey')
+        next_cursor = encode_cursor(last_key)
+        
+        if last_key is None:
+            # Older receipts continue in the S3 archive
+            position = start if start and start.get('archived') else None
+            older, next_position = archived_page(user_id, from_iso, to_iso, position, limit - len(items), projection)
+            items.extend(older)
+            if next_position is not None:
+                next_cursor = encode_cursor(dict(next_position, user_id=user_id, archived=True))
+        
+        response.headers['ETag'] = etag
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return {
+            "receipts": items,
+            "count": len(items),
+            "next_cursor": next_cursor
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+
+# --- Job Status ---
+# The worker overwrites one small item per job at each stage (OCR_DONE,
+# CATEGORIZED, COMPLETED, FAILED). /jobs/status long-polls those items with
+# BatchGetItem and answers as soon as any watched job moves, instead of the
+# client re-querying the whole receipt list.
+JOB_STATUS_MAX_IDS = 100
+JOB_STATUS_TTL_HOURS = int(os.environ.get("JOB_STATUS_TTL_HOURS", "24"))
+JOB_STATUS_MAX_WAIT = float(os.environ.get("JOB_STATUS_MAX_WAIT", "20"))  # below the API timeout
+JOB_STATUS_POLL_MIN = 0.25
+JOB_STATUS_POLL_MAX = 2.0
+
+class DynamoJobStatusSource:
+    """Reads stage items written by the worker's job_status channel."""
+    
+    def __init__(self, table_name: str):
+        self.table_name = table_name
+    
+    def publish(self, user_id: str, job_id: str, stage: str, **detail):
+        """Same item shape as the worker's channel (API-side jobs such as exports)."""
+        now_ms = int(time.time() * 1000)
+        item = {
+            'user_id': user_id,
+            'job_id': job_id,
+            'stage': stage,
+            'updated_at': now_ms,
+            'expires_at': now_ms // 1000 + JOB_STATUS_TTL_HOURS * 3600
+        }
+        if detail:
+            item['detail'] = detail
+        dynamodb.Table(self.table_name).put_item(Item=item)
+    
+    def fetch(self, user_id: str, job_ids: List[str]) -> dict:
+        statuses = {}
+        keys = [{'user_id': user_id, 'job_id': job_id} for job_id in job_ids]
+        while keys:
+            response = dynamodb.batch_get_item(RequestItems={
+                self.table_name: {
+                    'Keys': keys,
+                    'ConsistentRead': True,
+                    'ProjectionExpression': 'job_id, stage, updated_at, detail'
+                }
+            })
+            for item in response.get('Responses', {}).get(self.table_name, []):
+                statuses[item['job_id']] = {
+                    'stage': item['stage'],
+                    'updated_at': int(item['updated_at']),
+                    'detail': item.get('detail', {})
+                }
+            keys = response.get('UnprocessedKeys', {}).get(self.table_name, {}).get('Keys', [])
+        return statuses
+
+class InMemoryJobStatusSource:
+    """Stand-in for tests and local runs: publish() here instead of DynamoDB."""
+    
+    def __init__(self):
+        self._statuses: dict = {}
+        self._lock = threading.Lock()
+    
+    def publish(self, user_id: str, job_id: str, stage: str, **detail):
+        with self._lock:
+            previous = self._statuses.get((user_id, job_id), {}).get('updated_at', 0)
+            self._statuses[(user_id, job_id)] = {
+                'stage': stage,
+                'updated_at': max(int(time.time() * 1000), previous + 1),
+                'detail': detail
+            }
+    
+    def fetch(self, user_id: str, job_ids: List[str]) -> dict:
+        with self._lock:
+            return {
+                job_id: dict(self._statuses[(user_id, job_id)])
+                for job_id in job_ids if (user_id, job_id) in self._statuses
+            }
+
+job_status_source = DynamoJobStatusSource(JOB_STATUS_TABLE)
+
+def _changed_jobs(statuses: dict, job_ids: List[str], seen: dict) -> List[str]:
+    return [
+        job_id for job_id in job_ids
+        if statuses.get(job_id, {}).get('updated_at', 0) != seen.get(job_id, 0)
+    ]
+
+@app.get("/jobs/status")
+async def get_job_status(
+    ids: str = Query(..., description="Comma-separated receipt/job ids"),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous response"),
+    wait: float = Query(0, ge=0, le=JOB_STATUS_MAX_WAIT, description="Seconds to wait for a change")
+):
+    """Stage of one or more jobs; with a cursor and wait, returns once any of them moves"""
+    user_id = 'testuser'
+    try:
+        job_ids = list(dict.fromkeys(i.strip() for i in ids.split(',') if i.strip()))
+        if not job_ids or len(job_ids) > JOB_STATUS_MAX_IDS:
+            raise HTTPException(status_code=400, detail=f"Between 1 and {JOB_STATUS_MAX_IDS} ids required")
+        
+        seen = {}
+        if cursor:
+            try:
+                padded = cursor + '=' * (-len(cursor) % 4)
+                seen = json.loads(base64.urlsafe_b64decode(padded.encode()))
+            except (ValueError, TypeError):
+                raise HTTPException(status_code=400, detail="Invalid cursor")
+            if not isinstance(seen, dict):
+                raise HTTPException(status_code=400, detail="Invalid cursor")
+        
+        deadline = time.monotonic() + (wait if cursor else 0)
+        delay = JOB_STATUS_POLL_MIN
+        while True:
+            statuses = await aws_call(job_status_source.fetch, user_id, job_ids)
+            changed = _changed_jobs(statuses, job_ids, seen)
+            remaining = deadline - time.monotonic()
+            if changed or remaining <= 0:
+                break
+            # Sleeping on the event loop holds no thread while the client waits
+            await asyncio.sleep(min(delay, remaining))
+            delay = min(delay * 2, JOB_STATUS_POLL_MAX)
+        
+        jobs = {
+            job_id: statuses.get(job_id, {'stage': 'QUEUED', 'updated_at': 0, 'detail': {}})
+            for job_id in job_ids
+        }
+        next_seen = {job_id: job['updated_at'] for job_id, job in jobs.items()}
+        return {
+            "jobs": jobs,
+            "changed": changed,
+            "done": all(job['stage'] in ('COMPLETED', 'FAILED') for job in jobs.values()),
+            "next_cursor": base64.urlsafe_b64encode(
+                json.dumps(next_seen, separators=(',', ':')).encode()
+            ).decode().rstrip('=')
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+
+# --- Spending Stats ---
+def record_upload(user_id: str, count: int = 1) -> int:
+    """Count uploads; returns processing = uploaded - completed - failed."""
+    totals = stats_table.update_item(
+        Key={'user_id': user_id, 'stat_key': 'TOTAL'},
+        UpdateExpression='ADD uploaded :n, version :one',
+        ExpressionAttributeValues={':n': count, ':one': 1},
+        ReturnValues='ALL_NEW'
+    ).get('Attributes', {})
+    return int(totals.get('uploaded', 0) - totals.get('completed', 0) - totals.get('failed', 0))
+
+def _query_all(table, **kwargs) -> list:
+    items = []
+    while True:
+        response = table.query(**kwargs)
+        items.extend(response.get('Items', []))
+        if 'LastEvaluatedKey' not in response:
+            return items
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+@app.get("/stats")
+def get_stats():
+    """Dashboard totals and breakdowns from the worker's rollups (one partition query)"""
+    try:
+        user_id = 'testuser'
+        items = _query_all(
+            stats_table,
             KeyConditionExpression='user_id = :uid',
-            ExpressionAttributeValues={
-                ':uid': 'testuser'
-            },
-            ScanIndexForward=False
+            ExpressionAttributeValues={':uid': user_id}
         )
         
-        return {"receipts": response.get('Items', [])}
+        totals = {'uploaded': 0, 'completed': 0, 'failed': 0, 'anomalies': 0, 'total_spent': Decimal(0)}
+        breakdowns = {'MONTH': [], 'CATEGORY': [], 'MERCHANT': []}
+        subscriptions = []
+        for item in items:
+            stat_key = item['stat_key']
+            if stat_key == 'TOTAL':
+                for name in totals:
+                    totals[name] = item.get(name, totals[name])
+                continue
+            kind, _, name = stat_key.partition('#')
+            # Per-merchant charge history kept by the worker's recurring-charge detector
+            if kind == 'RECUR':
+                if item.get('recurring'):
+                    subscriptions.append({
+                        'merchant': item.get('merchant', name),
+                        'amount': Decimal(int(item['last_amount'])) / 100,
+                        'period_days': item.get('period'),
+                        'next_expected': item.get('next_expected')
+                    })
+                continue
+            # Rows whose last receipt moved elsewhere on re-processing stay at 0
+            if kind in breakdowns and item.get('receipt_count', 0) > 0:
+                breakdowns[kind].append({
+                    'name': name,
+                    'receipt_count': item['receipt_count'],
+                    'total_spent': item.get('total_spent', Decimal(0))
+                })
+        
+        totals['processing'] = max(0, totals['uploaded'] - totals['completed'] - totals['failed'])
+        return {
+            "totals": totals,
+            "by_month": sorted(breakdowns['MONTH'], key=lambda r: r['name']),
+            "by_category": sorted(breakdowns['CATEGORY'], key=lambda r: -r['total_spent']),
+            "by_merchant": sorted(breakdowns['MERCHANT'], key=lambda r: -r['total_spent']),
+            "subscriptions": sorted(subscriptions, key=lambda r: r['next_expected'] or '')
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+
+@app.get("/reports/spend-by-category")
+def spend_by_category_report(year: int = Query(..., ge=2000, le=2100)):
+    """Quarterly spend per category from the analytics mirror (SQL)"""
+    try:
+        # Imported lazily: only this report needs SQLAlchemy and the DB secret
+        import models
+        user_id = 'testuser'
+        rows = models.spend_by_category_per_quarter(user_id, year)
+        return {"year": year, "rows": rows}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
 
@@ -283,17 +1681,10 @@ def complete_receipt_manually(receipt_id: str):
     try:
         import random
         
-        # Scan for the receipt
-        response = receipts_table.scan(
-            FilterExpression='receipt_id = :rid',
-            ExpressionAttributeValues={':rid': receipt_id}
-        )
-        
-        if not response.get('Items'):
+        receipt = find_receipt(receipt_id)
+        if receipt is None:
             raise HTTPException(status_code=404, detail="Receipt not found")
         
-        receipt = response['Items'][0]
-        
         # Varied sample data for better visualization
         merchants = ["Walmart", "Target", "Whole Foods", "Costco", "Amazon", "Starbucks", "McDonald's"]
         categories = ["Groceries", "Shopping", "Food & Dining", "Transportation", "Entertainment"]
@@ -315,6 +1706,7 @@ def complete_receipt_manually(receipt_id: str):
                 ':date': datetime.utcnow().strftime('%Y-%m-%d')
             }
         )
+        bump_user_version(receipt['user_id'])
         
         return {"message": "Receipt completed successfully"}
     except HTTPException:
@@ -326,22 +1718,40 @@ def complete_receipt_manually(receipt_id: str):
 def clear_all_receipts():
     """Delete all receipts for testuser (for testing)"""
     try:
-        # Query all receipts for testuser
-        response = receipts_table.query(
+        # Every page of keys, deleted 25 per BatchWriteItem
+        receipt_keys = _query_all(
+            receipts_table,
             KeyConditionExpression='user_id = :uid',
-            ExpressionAttributeValues={':uid': 'testuser'}
+            ExpressionAttributeValues={':uid': 'testuser'},
+            ProjectionExpression='user_id, receipt_id'
         )
+        with receipts_table.batch_writer() as batch:
+            for item in receipt_keys:
+                batch.delete_item(Key={'user_id': item['user_id'], 'receipt_id': item['receipt_id']})
+        archived_objects = archive.delete_user_archive(s3_client, BUCKET_NAME, 'testuser')
         
-        # Delete each receipt
-        for item in response.get('Items', []):
-            receipts_table.delete_item(
-                Key={
-                    'user_id': item['user_id'],
-                    'receipt_id': item['receipt_id']
-                }
-            )
+        # Rollups describe the deleted receipts, so reset them too
+        stat_items = _query_all(
+            stats_table,
+            KeyConditionExpression='user_id = :uid',
+            ExpressionAttributeValues={':uid': 'testuser'},
+            ProjectionExpression='user_id, stat_key'
+        )
+        with stats_table.batch_writer() as batch:
+            for item in stat_items:
+                if item['stat_key'] != 'TOTAL':
+                    batch.delete_item(Key={'user_id': item['user_id'], 'stat_key': item['stat_key']})
+        # Keep the version moving forward so old ETags can never match again
+        stats_table.update_item(
+            Key={'user_id': 'testuser', 'stat_key': 'TOTAL'},
+            UpdateExpression='REMOVE uploaded, completed, failed, anomalies, total_spent ADD version :one',
+            ExpressionAttributeValues={':one': 1}
+        )
         
-        return {"message": f"Deleted {len(response.get('Items', []))} receipts"}
+        return {
+            "message": f"Deleted {len(receipt_keys)} receipts",
+            "archive_objects_deleted": archived_objects
+        }
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
 
@@ -349,17 +1759,10 @@ def clear_all_receipts():
 def add_anomalies_to_receipt(receipt_id: str):
     """Add sample anomalies to a receipt for testing"""
     try:
-        # Scan for the receipt
-        response = receipts_table.scan(
-            FilterExpression='receipt_id = :rid',
-            ExpressionAttributeValues={':rid': receipt_id}
-        )
-        
-        if not response.get('Items'):
+        receipt = find_receipt(receipt_id)
+        if receipt is None:
             raise HTTPException(status_code=404, detail="Receipt not found")
         
-        receipt = response['Items'][0]
-        
         # Sample anomalies
         anomalies = [
             "Unusually high amount for this merchant",
@@ -382,6 +1785,7 @@ def add_anomalies_to_receipt(receipt_id: str):
                 ':category': 'Shopping'
             }
         )
+        bump_user_version(receipt['user_id'])
         
         # Send email notification
         send_anomaly_notification(receipt_id, 'Luxury Store', '999.99', anomalies)
@@ -430,4 +1834,13 @@ def send_anomaly_notification(receipt_id: str, merchant: str, amount: str, anoma
     except Exception as e:
         print(f"Error sending notification: {str(e)}")
 
-handler = Mangum(app)
\ No newline at end of file
+http_handler = Mangum(app)
+
+def handler(event, context):
+    """Lambda entry point: S3 upload notifications or HTTP API requests."""
+    records = event.get('Records') or []
+    if records and records[0].get('eventSource') == 'aws:s3':
+        return handle_s3_event(event)
+    if 'export_job' in event:
+        return run_export_job(**event['export_job'])
+    return http_handler(event, context)
\ No newline at end of file
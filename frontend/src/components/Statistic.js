@@ -54,11 +54,16 @@ import "./Dashboard.css";
 
 const { TabPane } = Tabs;
 
+// Receipts per /receipts page; older ones load on demand
+const PAGE_SIZE = 50;
+
 const COLORS = ["#0088FE", "#00C49F", "#FFBB28", "#FF8042", "#8884D8", "#82CA9D", "#FFC658", "#FF6B9D"];
 
 function Dashboard(props) {
   const [receipts, setReceipts] = useState([]);
+  const [nextCursor, setNextCursor] = useState(null);
   const [loading, setLoading] = useState(true);
+  const [loadingMore, setLoadingMore] = useState(false);
   const [selectedReceipt, setSelectedReceipt] = useState(null);
   const [modalVisible, setModalVisible] = useState(false);
   const [emailModalVisible, setEmailModalVisible] = useState(false);
@@ -78,82 +83,108 @@ function Dashboard(props) {
     // Removed auto-refresh - use manual Refresh button instead
   }, []);
 
-  const fetchReceipts = async () => {
-    try {
-      const response = await axios.get(`${BASE_URL}/receipts`);
-      const receiptsData = response.data.receipts || [];
-      setReceipts(receiptsData);
-
-      const completed = receiptsData.filter((r) => r.status === "COMPLETED").length;
-      const processing = receiptsData.filter((r) => r.status === "PROCESSING").length;
-      const anomalies = receiptsData.filter((r) => r.alerts && r.alerts.length > 0).length;
+  // Wait for PROCESSING receipts to move instead of re-fetching the list
+  useEffect(() => {
+    const pending = receipts
+      .filter((r) => r.status === "PROCESSING")
+      .slice(0, 100)
+      .map((r) => r.receipt_id);
+    if (pending.length === 0) return undefined;
+
+    let cancelled = false;
+    const watch = async () => {
+      let cursor = null;
+      while (!cancelled) {
+        try {
+          const { data } = await axios.get(`${BASE_URL}/jobs/status`, {
+            params: { ids: pending.join(","), cursor, wait: cursor ? 20 : 0 },
+          });
+          if (cancelled) return;
+          // The first call also catches jobs that finished before the list loaded
+          const finished = (cursor ? data.changed : pending).some((id) =>
+            ["COMPLETED", "FAILED"].includes(data.jobs[id].stage)
+          );
+          if (finished) {
+            fetchReceipts();
+            return;
+          }
+          cursor = data.next_cursor;
+        } catch (error) {
+          console.error("Error waiting for job status:", error);
+          return;
+        }
+      }
+    };
+    watch();
+    return () => {
+      cancelled = true;
+    };
+  }, [receipts]);
 
-      setStats({
-        total: receiptsData.length,
-        completed,
-        processing,
-        anomalies,
-      });
+  const fetchReceiptPage = async (cursor) => {
+    const response = await axios.get(`${BASE_URL}/receipts`, {
+      params: { view: "compact", limit: PAGE_SIZE, cursor },
+    });
+    return { page: response.data.receipts || [], cursor: response.data.next_cursor || null };
+  };
 
-      calculateAnalytics(receiptsData);
+  // Only the newest page; totals and charts come from /stats
+  const fetchReceipts = async () => {
+    try {
+      const { page, cursor } = await fetchReceiptPage(null);
+      setReceipts(page);
+      setNextCursor(cursor);
     } catch (error) {
       console.error("Error fetching receipts:", error);
     } finally {
       setLoading(false);
     }
+    fetchStats();
   };
 
-  const calculateAnalytics = (receiptsData) => {
-    const completedReceipts = receiptsData.filter(
-      (r) => r.status === "COMPLETED" && r.total_amount
-    );
+  const loadMoreReceipts = async () => {
+    if (!nextCursor || loadingMore) return;
+    setLoadingMore(true);
+    try {
+      const { page, cursor } = await fetchReceiptPage(nextCursor);
+      setReceipts((current) => current.concat(page));
+      setNextCursor(cursor);
+    } catch (error) {
+      console.error("Error loading more receipts:", error);
+      antMessage.error("Failed to load more receipts");
+    } finally {
+      setLoadingMore(false);
+    }
+  };
 
-    const totalSpent = completedReceipts.reduce(
-      (sum, r) => sum + parseFloat(r.total_amount || 0),
-      0
-    );
+  const fetchStats = async () => {
+    try {
+      // Totals and breakdowns are maintained server-side by the ML worker
+      const { data } = await axios.get(`${BASE_URL}/stats`);
+      const totals = data.totals || {};
 
-    const categoryMap = {};
-    completedReceipts.forEach((r) => {
-      const category = r.category || "Other";
-      categoryMap[category] = (categoryMap[category] || 0) + parseFloat(r.total_amount || 0);
-    });
-    const byCategory = Object.entries(categoryMap).map(([name, value]) => ({
-      name,
-      value: parseFloat(value.toFixed(2)),
-    }));
-
-    const merchantMap = {};
-    completedReceipts.forEach((r) => {
-      const merchant = r.merchant_name || "Unknown";
-      merchantMap[merchant] = (merchantMap[merchant] || 0) + parseFloat(r.total_amount || 0);
-    });
-    const byMerchant = Object.entries(merchantMap)
-      .map(([name, value]) => ({
-        name,
-        value: parseFloat(value.toFixed(2)),
-      }))
-      .sort((a, b) => b.value - a.value)
-      .slice(0, 5);
-
-    const dateMap = {};
-    completedReceipts.forEach((r) => {
-      const date = r.purchase_date || new Date(r.created_at).toISOString().split("T")[0];
-      dateMap[date] = (dateMap[date] || 0) + parseFloat(r.total_amount || 0);
-    });
-    const overTime = Object.entries(dateMap)
-      .map(([date, amount]) => ({
-        date,
-        amount: parseFloat(amount.toFixed(2)),
-      }))
-      .sort((a, b) => new Date(a.date) - new Date(b.date));
-
-    setAnalytics({
-      byCategory,
-      byMerchant,
-      overTime,
-      totalSpent: parseFloat(totalSpent.toFixed(2)),
-    });
+      setStats({
+        total: Number(totals.uploaded || 0),
+        completed: Number(totals.completed || 0),
+        processing: Number(totals.processing || 0),
+        anomalies: Number(totals.anomalies || 0),
+      });
+
+      const toSeries = (rows) =>
+        (rows || []).map((r) => ({
+          name: r.name,
+          value: parseFloat(parseFloat(r.total_spent || 0).toFixed(2)),
+        }));
+
+      setAnalytics({
+        byCategory: toSeries(data.by_category),
+        byMerchant: toSeries(data.by_merchant).slice(0, 5),
+        overTime: toSeries(data.by_month).map((r) => ({ date: r.name, amount: r.value })),
+        totalSpent: parseFloat(parseFloat(totals.total_spent || 0).toFixed(2)),
+      });
+    } catch (error) {
+      console.error("Error fetching stats:", error);
+    }
   };
 
   const getCategoryColor = (category) => {
@@ -399,6 +430,13 @@ function Dashboard(props) {
               ))}
             </Row>
           )}
+          {nextCursor && (
+            <div style={{ textAlign: "center", marginTop: "16px" }}>
+              <Button onClick={loadMoreReceipts} loading={loadingMore}>
+                Load more
+              </Button>
+            </div>
+          )}
         </TabPane>
 
         <TabPane
@@ -475,7 +513,7 @@ function Dashboard(props) {
         >
           {analytics.overTime.length > 0 ? (
             <Card>
-              <h3>Spending Over Time</h3>
+              <h3>Spending by Month</h3>
               <ResponsiveContainer width="100%" height={400}>
                 <LineChart data={analytics.overTime}>
                   <CartesianGrid strokeDasharray="3 3" />
@@ -483,7 +521,7 @@ function Dashboard(props) {
                   <YAxis />
                   <Tooltip formatter={(value) => `$${value.toFixed(2)}`} />
                   <Legend />
-                  <Line type="monotone" dataKey="amount" stroke="#8884d8" name="Daily Spending" />
+                  <Line type="monotone" dataKey="amount" stroke="#8884d8" name="Monthly Spending" />
                 </LineChart>
               </ResponsiveContainer>
             </Card>
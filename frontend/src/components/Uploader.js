@@ -11,15 +11,26 @@ const Uploader = () => {
   const navigate = useNavigate();
 
   const uploadToBackend = async (file) => {
-    const formData = new FormData();
-    formData.append("file", file);
-
     try {
-      const response = await axios.post(`${BASE_URL}/`, formData, {
-        headers: {
-          "Content-Type": "multipart/form-data",
-        },
+      // 1. Ask the API for a presigned POST restricted to this file
+      const { data: upload } = await axios.post(`${BASE_URL}/uploads`, {
+        filename: file.name,
+        content_type: file.type || "image/jpeg",
+        size: file.size,
       });
+
+      // 2. Send the bytes straight to S3
+      const formData = new FormData();
+      Object.entries(upload.fields).forEach(([name, value]) => formData.append(name, value));
+      formData.append("file", file);
+      await axios.post(upload.url, formData);
+
+      // 3. Create the receipt and queue processing (the S3 event does this too)
+      const response = await axios.post(
+        `${BASE_URL}/uploads/${upload.receipt_id}/complete`,
+        null,
+        { params: { key: upload.key } }
+      );
       message.success(`${file.name} uploaded successfully. Redirecting to dashboard...`);
 
       // Redirect to dashboard after 1 second
@@ -40,7 +51,7 @@ const Uploader = () => {
   const attributes = {
     name: "file",
     multiple: true,
-    accept: "image/jpeg,image/jpg,image/png",
+    accept: "image/jpeg,image/jpg,image/png,image/heic,image/webp",
     customRequest: async ({ file, onSuccess, onError }) => {
       const response = await uploadToBackend(file);
 
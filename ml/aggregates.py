@@ -0,0 +1,110 @@
+"""Per-user spending rollups maintained incrementally with atomic ADD updates.
+
+Items live in the stats table under the user's partition:
+
+    TOTAL                 completed, failed, anomalies, total_spent, version
+    MONTH#<YYYY-MM>       receipt_count, total_spent
+    CATEGORY#<category>   receipt_count, total_spent
+    MERCHANT#<merchant>   receipt_count, total_spent
+    BATCH#<batch_id>      completed, failed (bulk upload progress)
+
+The API adds `uploaded` to TOTAL on upload, so processing = uploaded -
+completed - failed. When a receipt is re-processed, the previous result's
+contribution (from UPDATED_OLD) is subtracted before the new one is added.
+`version` goes up on every write; the API builds ETags from it.
+"""
+
+import os
+from decimal import Decimal
+from typing import Any, Dict, Optional, Tuple
+
+import boto3
+
+from config import get_logger
+import tracing
+
+logger = get_logger(__name__)
+
+STATS_TABLE = os.environ.get('STATS_TABLE', 'UserStats-ML-v2')
+stats_table = boto3.resource('dynamodb').Table(STATS_TABLE)
+
+TOTAL_KEY = "TOTAL"
+
+Delta = Dict[str, Dict[str, Decimal]]
+
+
+def record_result(user_id: str, old: Optional[Dict[str, Any]], new: Optional[Dict[str, Any]]) -> None:
+    """Apply the change from the previous receipt attributes to the new ones.
+
+    `old` / `new` are receipt rows (status, merchant, total, category,
+    purchase_date, alerts, batch_id); either may be None.
+    """
+    deltas: Delta = {TOTAL_KEY: {'version': Decimal(1)}}
+    _contribute(deltas, old, -1)
+    _contribute(deltas, new, +1)
+
+    batch_id = (new or {}).get('batch_id') or (old or {}).get('batch_id')
+    if batch_id:
+        total_counters = deltas.get(TOTAL_KEY, {})
+        deltas[f"BATCH#{batch_id}"] = {
+            name: total_counters[name] for name in ('completed', 'failed') if name in total_counters
+        }
+
+    with tracing.span("aggregates"):
+        for stat_key, counters in deltas.items():
+            counters = {name: value for name, value in counters.items() if value != 0}
+            if counters:
+                _add(user_id, stat_key, counters)
+
+
+def _contribute(deltas: Delta, receipt: Optional[Dict[str, Any]], sign: int) -> None:
+    if not receipt:
+        return
+    status = receipt.get('status')
+    total_counters = deltas.setdefault(TOTAL_KEY, {})
+
+    if status == 'FAILED':
+        _bump(total_counters, 'failed', sign)
+        return
+    if status != 'COMPLETED':
+        return
+
+    amount = _amount(receipt.get('total')) * sign
+    _bump(total_counters, 'completed', sign)
+    _bump(total_counters, 'total_spent', amount)
+    if receipt.get('alerts'):
+        _bump(total_counters, 'anomalies', sign)
+
+    for stat_key in _dimension_keys(receipt):
+        counters = deltas.setdefault(stat_key, {})
+        _bump(counters, 'receipt_count', sign)
+        _bump(counters, 'total_spent', amount)
+
+
+def _dimension_keys(receipt: Dict[str, Any]) -> Tuple[str, ...]:
+    # Only fields the writer sets on every write, so old and new resolve alike
+    month = (receipt.get('purchase_date') or '')[:7] or 'unknown'
+    category = receipt.get('category') or 'Other'
+    merchant = (receipt.get('merchant') or 'Unknown').strip().upper()
+    return (f"MONTH#{month}", f"CATEGORY#{category}", f"MERCHANT#{merchant}")
+
+
+def _bump(counters: Dict[str, Decimal], name: str, value) -> None:
+    counters[name] = counters.get(name, Decimal(0)) + Decimal(value)
+
+
+def _amount(value) -> Decimal:
+    if value is None:
+        return Decimal(0)
+    return Decimal(str(value))
+
+
+def _add(user_id: str, stat_key: str, counters: Dict[str, Decimal]) -> None:
+    names = {f"#c{i}": name for i, name in enumerate(counters)}
+    values = {f":c{i}": value for i, value in enumerate(counters.values())}
+    stats_table.update_item(
+        Key={'user_id': user_id, 'stat_key': stat_key},
+        UpdateExpression='ADD ' + ', '.join(f"#c{i} :c{i}" for i in range(len(counters))),
+        ExpressionAttributeNames=names,
+        ExpressionAttributeValues=values
+    )
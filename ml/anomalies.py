@@ -4,6 +4,8 @@ from typing import Optional
 
 from schemas import ParsedReceipt, AlertEvent
 from config import get_logger
+import merchants
+import tracing
 
 logger = get_logger(__name__)
 
@@ -13,10 +15,15 @@ TOTAL_CONSISTENCY_TOLERANCE = 0.05  # 5% tolerance
 
 def detect_anomalies(
     parsed: ParsedReceipt,
-    high_total_threshold: float = DEFAULT_HIGH_TOTAL_THRESHOLD
+    high_total_threshold: float = DEFAULT_HIGH_TOTAL_THRESHOLD,
+    check_duplicates: bool = True
 ) -> list[AlertEvent]:
-    """Detect anomalies: high total, inconsistency, duplicates."""
-    logger.info(f"Running anomaly detection for job {parsed.job_id}")
+    """Detect anomalies: high total, inconsistency, duplicates.
+
+    Duplicates depend on what was processed before, so reprocessing an
+    archive passes check_duplicates=False and keeps the earlier verdict.
+    """
+    logger.debug("Running anomaly detection for job %s", parsed.job_id)
     
     alerts = []
     
@@ -28,10 +35,10 @@ def detect_anomalies(
     if consistency_alert:
         alerts.append(consistency_alert)
     
-    duplicate_alert = _check_duplicate_receipt(parsed)
+    duplicate_alert = _check_duplicate_receipt(parsed) if check_duplicates else None
     if duplicate_alert:
         alerts.append(duplicate_alert)
-    logger.info(f"Detected {len(alerts)} anomalies")
+    logger.debug("Detected %d anomalies", len(alerts))
     return alerts
 
 
@@ -40,7 +47,7 @@ def _check_high_total(parsed: ParsedReceipt, threshold: float) -> Optional[Alert
         return None
     
     if parsed.total > threshold:
-        logger.warning(f"High total detected: ${parsed.total:.2f} (threshold: ${threshold:.2f})")
+        logger.debug("High total detected: $%.2f (threshold: $%.2f)", parsed.total, threshold)
         return AlertEvent(
             type="HIGH_TOTAL",
             message=f"Receipt total ${parsed.total:.2f} exceeds threshold of ${threshold:.2f}"
@@ -58,10 +65,9 @@ def _check_total_consistency(parsed: ParsedReceipt) -> Optional[AlertEvent]:
     tolerance = parsed.total * TOTAL_CONSISTENCY_TOLERANCE
     
     if difference > tolerance:
-        logger.warning(
-            f"Total inconsistency detected: "
-            f"subtotal ${parsed.subtotal:.2f} + tax ${parsed.tax:.2f} = ${expected_total:.2f}, "
-            f"but total is ${parsed.total:.2f} (difference: ${difference:.2f})"
+        logger.debug(
+            "Total inconsistency detected: subtotal $%.2f + tax $%.2f = $%.2f, but total is $%.2f (difference: $%.2f)",
+            parsed.subtotal, parsed.tax, expected_total, parsed.total, difference
         )
         return AlertEvent(
             type="POSSIBLE_ERROR",
@@ -81,7 +87,7 @@ def _check_duplicate_receipt(parsed: ParsedReceipt) -> Optional[AlertEvent]:
     import hashlib
     
     hash_components = [
-        parsed.merchant or "UNKNOWN",
+        merchants.canonicalize(parsed.merchant) or "UNKNOWN",
         parsed.purchase_date or "NO_DATE",
         f"{parsed.total:.2f}" if parsed.total else "0.00",
         str(len(parsed.items))
@@ -91,11 +97,13 @@ def _check_duplicate_receipt(parsed: ParsedReceipt) -> Optional[AlertEvent]:
     receipt_hash = hashlib.md5(hash_string.encode()).hexdigest()
     
     # Check if we've seen this receipt before
-    if receipt_hash in _RECEIPT_CACHE:
+    is_duplicate = receipt_hash in _RECEIPT_CACHE
+    tracing.cache_result("duplicate", is_duplicate)
+    if is_duplicate:
         previous = _RECEIPT_CACHE[receipt_hash]
-        logger.warning(
-            f"Duplicate receipt detected: "
-            f"merchant={parsed.merchant}, date={parsed.purchase_date}, total=${parsed.total:.2f}"
+        logger.debug(
+            "Duplicate receipt detected: merchant=%s, date=%s, total=$%.2f",
+            parsed.merchant, parsed.purchase_date, parsed.total or 0.0
         )
         return AlertEvent(
             type="DUPLICATE_RECEIPT",
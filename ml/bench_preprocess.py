@@ -0,0 +1,92 @@
+"""Benchmark pre-OCR image shrinking on a local corpus of receipt photos.
+
+Usage:
+    python bench_preprocess.py ~/receipt-photos --long-edge 2048 --quality 85 --output bench.json
+
+Reports per-image and total bytes saved plus pre-processing latency
+percentiles, so settings can be compared before changing the defaults.
+"""
+
+import argparse
+import json
+import os
+import sys
+from typing import Any, Dict, List, Optional
+
+import preprocess
+from tracing import summarize
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".heic", ".heif", ".webp")
+
+
+def run_benchmark(paths: List[str], long_edge: int, quality: int, crop: bool, repeat: int) -> Dict[str, Any]:
+    images = []
+    latencies: List[float] = []
+    total_in = total_out = 0
+
+    for path in paths:
+        with open(path, "rb") as f:
+            data = f.read()
+        try:
+            runs = [preprocess.preprocess_image(data, long_edge, quality, crop) for _ in range(repeat)]
+        except Exception as e:
+            images.append({"file": os.path.basename(path), "error": str(e)})
+            continue
+        result = runs[-1]
+        latencies.extend(r.elapsed_ms for r in runs)
+        total_in += result.original_bytes
+        total_out += len(result.image_bytes)
+        images.append({
+            "file": os.path.basename(path),
+            "original_bytes": result.original_bytes,
+            "output_bytes": len(result.image_bytes),
+            "original_size": list(result.original_size),
+            "output_size": [result.width, result.height],
+            "cropped": result.cropped,
+            "ms": round(min(r.elapsed_ms for r in runs), 3),
+        })
+
+    return {
+        "settings": {"long_edge": long_edge, "quality": quality, "crop": crop, "repeat": repeat},
+        "images": len(paths),
+        "total_original_bytes": total_in,
+        "total_output_bytes": total_out,
+        "bytes_saved": total_in - total_out,
+        "size_ratio": round(total_out / total_in, 4) if total_in else None,
+        "latency_ms": summarize(latencies),
+        "per_image": images,
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("corpus", help="Directory of receipt images")
+    parser.add_argument("--long-edge", type=int, default=2048)
+    parser.add_argument("--quality", type=int, default=85)
+    parser.add_argument("--no-crop", action="store_true", help="Disable background cropping")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per image (fastest is reported)")
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    args = parser.parse_args(argv)
+
+    if not preprocess.is_available():
+        parser.error("Pillow is required: pip install Pillow (and pillow-heif for HEIC)")
+
+    paths = sorted(
+        os.path.join(args.corpus, name)
+        for name in os.listdir(args.corpus)
+        if name.lower().endswith(IMAGE_EXTENSIONS)
+    )
+    if not paths:
+        parser.error(f"No images found in {args.corpus}")
+
+    report = run_benchmark(paths, args.long_edge, args.quality, not args.no_crop, args.repeat)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,71 @@
+"""Receipt categorization: Bedrock first, keyword rules as fallback."""
+
+import re
+from typing import Optional
+
+from schemas import ParsedReceipt
+from config import get_logger
+import categorize_bedrock
+import rate_limiter
+
+logger = get_logger(__name__)
+
+RULE_BASED_CONFIDENCE = 0.6
+
+# Keyword rules checked against merchant and item text (first match wins)
+CATEGORY_KEYWORDS = {
+    "Groceries": ["grocery", "market", "whole foods", "trader joe", "safeway", "kroger", "aldi", "costco", "walmart"],
+    "Restaurants": ["restaurant", "cafe", "coffee", "starbucks", "mcdonald", "pizza", "burger", "grill", "diner", "kitchen"],
+    "Gas": ["shell", "chevron", "exxon", "mobil", "arco", "fuel", "gas"],
+    "Transportation": ["uber", "lyft", "metro", "transit", "parking", "taxi"],
+    "Travel": ["hotel", "airline", "airlines", "inn", "marriott", "hilton", "airbnb"],
+    "Entertainment": ["cinema", "theater", "theatre", "amc", "concert", "ticket"],
+    "Health": ["pharmacy", "cvs", "walgreens", "clinic", "medical", "fitness", "gym"],
+    "Utilities": ["electric", "water", "internet", "comcast", "verizon", "at&t", "utility"],
+    "Subscriptions": ["netflix", "spotify", "hulu", "subscription", "prime"],
+    "Education": ["bookstore", "university", "college", "tuition", "course"],
+    "Home": ["home depot", "lowe", "ikea", "hardware", "furniture"],
+    "Personal Care": ["salon", "spa", "barber", "beauty", "sephora"],
+    "Insurance": ["insurance", "geico", "allstate", "progressive"],
+    "Shopping": ["target", "amazon", "best buy", "mall", "store", "outlet"],
+}
+
+_CATEGORY_PATTERNS = {
+    category: re.compile(r"\b(?:" + "|".join(re.escape(kw) for kw in keywords) + r")\b")
+    for category, keywords in CATEGORY_KEYWORDS.items()
+}
+
+
+def categorize_parsed_receipt(parsed: ParsedReceipt, use_ml: bool = True) -> ParsedReceipt:
+    """Assign one category to the receipt and copy it onto every line item."""
+    descriptions = [item.description for item in parsed.items]
+    category, confidence = None, 0.0
+
+    if use_ml:
+        try:
+            category, confidence = categorize_bedrock.bedrock_classify_receipt(
+                parsed.merchant, descriptions
+            )
+        except rate_limiter.RateLimitExceeded:
+            # Back-pressure: retry the whole job later rather than degrade to rules
+            raise
+        except Exception as e:
+            logger.warning("Bedrock categorization failed, using rules: %s", e)
+
+    if category is None:
+        category, confidence = rule_based_category(parsed.merchant, descriptions)
+
+    for item in parsed.items:
+        item.category = category
+        item.category_confidence = confidence
+
+    logger.debug("Categorized job %s as '%s' (%.2f)", parsed.job_id, category, confidence)
+    return parsed
+
+
+def rule_based_category(merchant: Optional[str], item_descriptions: list[str]) -> tuple[str, float]:
+    text = " ".join([merchant or ""] + item_descriptions).lower()
+    for category, pattern in _CATEGORY_PATTERNS.items():
+        if pattern.search(text):
+            return category, RULE_BASED_CONFIDENCE
+    return "Other", 0.3
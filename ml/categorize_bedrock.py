@@ -1,11 +1,14 @@
 
 
 import json
+import os
 import boto3
 from botocore.exceptions import ClientError
 from typing import Optional
 
 from config import get_logger, AWS_REGION
+import rate_limiter
+import tracing
 
 logger = get_logger(__name__)
 
@@ -28,21 +31,21 @@ CATEGORIES = [
     "Other"
 ]
 
-def bedrock_classify_receipt(
-    merchant: Optional[str],
-    item_descriptions: list[str]
-) -> tuple[str, float]:
-    
-    try:
+_bedrock_client = None
+
+
+def _get_bedrock_client():
+    """Create the Bedrock runtime client once per container."""
+    global _bedrock_client
+    if _bedrock_client is None:
         # Support cross-account Bedrock access via environment variables
-        import os
         bedrock_access_key = os.environ.get('BEDROCK_ACCESS_KEY')
         bedrock_secret_key = os.environ.get('BEDROCK_SECRET_KEY')
         
         if bedrock_access_key and bedrock_secret_key:
             # Use credentials from another AWS account
             logger.info("Using cross-account Bedrock credentials")
-            bedrock = boto3.client(
+            _bedrock_client = boto3.client(
                 'bedrock-runtime',
                 aws_access_key_id=bedrock_access_key,
                 aws_secret_access_key=bedrock_secret_key,
@@ -50,13 +53,31 @@ def bedrock_classify_receipt(
             )
         else:
             # Use default Lambda execution role
-            bedrock = boto3.client('bedrock-runtime', region_name=AWS_REGION)
+            _bedrock_client = boto3.client('bedrock-runtime', region_name=AWS_REGION)
+    return _bedrock_client
+
+
+def bedrock_classify_receipt(
+    merchant: Optional[str],
+    item_descriptions: list[str]
+) -> tuple[str, float]:
+    
+    try:
+        bedrock = _get_bedrock_client()
         
         # Build classification prompt for Claude
         merchant_text = f"Merchant: {merchant}" if merchant else "Merchant: Unknown"
         items_text = ", ".join(item_descriptions[:10]) if item_descriptions else "No items"
         
-        prompt = f
+        prompt = f"""Classify this purchase receipt into exactly one category.
+
+{merchant_text}
+Items: {items_text}
+
+Categories: {", ".join(CATEGORIES)}
+
+Respond with only a JSON object of the form:
+{{"category": "<one of the categories>", "confidence": <0.0-1.0>, "reasoning": "<short reason>"}}"""
 
         # Call Claude via Bedrock
         request_body = {
@@ -71,10 +92,13 @@ def bedrock_classify_receipt(
             "temperature": 0.1  # Low temperature for consistent categorization
         }
         
-        response = bedrock.invoke_model(
-            modelId="anthropic.claude-3-haiku-20240307-v1:0",  # Fast, cheap Claude model
-            body=json.dumps(request_body)
-        )
+        rate_limiter.acquire('bedrock')
+        tracing.incr("bedrock_calls")
+        with tracing.span("bedrock"):
+            response = bedrock.invoke_model(
+                modelId="anthropic.claude-3-haiku-20240307-v1:0",  # Fast, cheap Claude model
+                body=json.dumps(request_body)
+            )
         
         # Parse response
         response_body = json.loads(response['body'].read())
@@ -89,22 +113,27 @@ def bedrock_classify_receipt(
         
         # Validate category
         if category not in CATEGORIES:
-            logger.warning(f"Bedrock returned invalid category '{category}', defaulting to Other")
+            logger.warning("Bedrock returned invalid category '%s', defaulting to Other", category)
             category = "Other"
             confidence = 0.3
         
-        logger.info(f"Bedrock classified as '{category}' with confidence {confidence:.2f}")
-        logger.debug(f"Reasoning: {reasoning}")
+        logger.debug("Bedrock classified as '%s' with confidence %.2f", category, confidence)
+        logger.debug("Reasoning: %s", reasoning)
         
         return category, confidence
         
     except ClientError as e:
         error_code = e.response.get('Error', {}).get('Code', '')
-        logger.warning(f"Bedrock API error ({error_code}): {e}")
+        tracing.incr("bedrock_errors")
+        if error_code == 'ThrottlingException':
+            tracing.incr("bedrock_throttles")
+        logger.warning("Bedrock API error (%s): %s", error_code, e)
+        raise
+    except rate_limiter.RateLimitExceeded:
         raise
     except json.JSONDecodeError as e:
-        logger.error(f"Failed to parse Bedrock response as JSON: {e}")
+        logger.error("Failed to parse Bedrock response as JSON: %s", e)
         raise
     except Exception as e:
-        logger.error(f"Unexpected error in Bedrock classification: {e}")
+        logger.error("Unexpected error in Bedrock classification: %s", e)
         raise
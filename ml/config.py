@@ -1,7 +1,14 @@
 
 
+import atexit
+import contextvars
+import json
 import os
 import logging
+import queue
+import sys
+import threading
+from logging.handlers import QueueHandler, QueueListener
 from typing import Optional
 
 # AWS Configuration
@@ -16,6 +23,130 @@ SQS_OCR_QUEUE_URL: Optional[str] = os.getenv("SQS_OCR_QUEUE_URL")
 
 # Logging
 LOG_LEVEL: str = os.getenv("LOG_LEVEL", "INFO")
+LOG_DEBUG_SAMPLE_RATE: float = float(os.getenv("LOG_DEBUG_SAMPLE_RATE", "0"))  # fraction of jobs logged at DEBUG
+LOG_QUEUE_SIZE: int = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+
+# Image pre-processing before OCR
+PREPROCESS_ENABLED: bool = os.getenv("PREPROCESS_ENABLED", "true").lower() == "true"
+PREPROCESS_LONG_EDGE: int = int(os.getenv("PREPROCESS_LONG_EDGE", "2048"))
+PREPROCESS_JPEG_QUALITY: int = int(os.getenv("PREPROCESS_JPEG_QUALITY", "85"))
+
+# Tiled OCR for long receipts (height / width >= TILED_OCR_ASPECT)
+TILED_OCR_ENABLED: bool = os.getenv("TILED_OCR_ENABLED", "true").lower() == "true"
+TILED_OCR_ASPECT: float = float(os.getenv("TILED_OCR_ASPECT", "2.5"))
+TILED_OCR_TILE_ASPECT: float = float(os.getenv("TILED_OCR_TILE_ASPECT", "1.5"))  # tile height / width
+TILED_OCR_OVERLAP: float = float(os.getenv("TILED_OCR_OVERLAP", "0.15"))  # fraction of tile height
+TILED_OCR_MAX_TILES: int = int(os.getenv("TILED_OCR_MAX_TILES", "8"))
+TILED_OCR_MAX_WORKERS: int = int(os.getenv("TILED_OCR_MAX_WORKERS", "4"))
+TILED_OCR_TILE_WIDTH: int = int(os.getenv("TILED_OCR_TILE_WIDTH", "1024"))
+
+# Shared rate limits (calls/second across all containers; 0 disables)
+RATE_LIMIT_TABLE: Optional[str] = os.getenv("RATE_LIMIT_TABLE")
+REKOGNITION_RATE_LIMIT: float = float(os.getenv("REKOGNITION_RATE_LIMIT", "0"))
+BEDROCK_RATE_LIMIT: float = float(os.getenv("BEDROCK_RATE_LIMIT", "0"))
+RATE_LIMIT_BURST_SECONDS: float = float(os.getenv("RATE_LIMIT_BURST_SECONDS", "1"))
+RATE_LIMIT_LEASE: int = int(os.getenv("RATE_LIMIT_LEASE", "5"))
+RATE_LIMIT_MAX_WAIT: float = float(os.getenv("RATE_LIMIT_MAX_WAIT", "5"))
+
+# Priority lanes. Interactive jobs (single uploads) and bulk jobs (bulk
+# uploads, backfills) arrive on separate queues. Each lane is guaranteed its
+# weighted share of the rate limits above and borrows the other lane's idle
+# tokens; bulk jobs are also capped per user so one backfill can't hold the lane.
+LANE_INTERACTIVE = "interactive"
+LANE_BULK = "bulk"
+INTERACTIVE_WEIGHT: float = float(os.getenv("INTERACTIVE_WEIGHT", "3"))
+BULK_WEIGHT: float = float(os.getenv("BULK_WEIGHT", "1"))
+LANE_BORROW_RESERVE: float = float(os.getenv("LANE_BORROW_RESERVE", "0.5"))  # fraction of a lane's burst it keeps
+BULK_USER_RATE: float = float(os.getenv("BULK_USER_RATE", "2"))  # bulk jobs/second per user (0 disables)
+BULK_DEFER_MAX_SECONDS: int = int(os.getenv("BULK_DEFER_MAX_SECONDS", "60"))
+
+# Job stage notifications read by the API's status long-poll (unset disables)
+JOB_STATUS_TABLE: Optional[str] = os.getenv("JOB_STATUS_TABLE")
+JOB_STATUS_TTL_HOURS: int = int(os.getenv("JOB_STATUS_TTL_HOURS", "24"))
+
+# Per-user search index (merchant / item tokens -> receipt ids; unset disables)
+SEARCH_TABLE: Optional[str] = os.getenv("SEARCH_TABLE")
+SEARCH_INDEX_WORKERS: int = int(os.getenv("SEARCH_INDEX_WORKERS", "8"))
+
+# Recurring-charge detection (per-merchant ring buffer in the stats table)
+RECURRING_ENABLED: bool = os.getenv("RECURRING_ENABLED", "true").lower() == "true"
+RECURRING_HISTORY_SIZE: int = int(os.getenv("RECURRING_HISTORY_SIZE", "12"))
+RECURRING_PRICE_INCREASE: float = float(os.getenv("RECURRING_PRICE_INCREASE", "0.02"))  # fraction
+
+# Reprocessing archived OCR output (reprocess.py). PIPELINE_VERSION is
+# stored on every result; bump it when parse/categorize/anomaly logic changes.
+PIPELINE_VERSION: int = int(os.getenv("PIPELINE_VERSION", "1"))
+RECEIPT_ID_INDEX: str = os.getenv("RECEIPT_ID_INDEX", "receipt_id-index")
+REPROCESS_PREFIX: str = os.getenv("REPROCESS_PREFIX", "rekognition-output/")
+
+# Metrics (CloudWatch Embedded Metric Format)
+METRICS_ENABLED: bool = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+METRICS_NAMESPACE: str = os.getenv("METRICS_NAMESPACE", "ReceiptInbox/Pipeline")
+METRICS_SERVICE: str = os.getenv("METRICS_SERVICE", "MLProcessor")
+
+# Profiling (disabled unless PROFILE_SAMPLE_RATE > 0)
+PROFILE_SAMPLE_RATE: float = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILER: str = os.getenv("PROFILER", "cprofile")  # cprofile | pyinstrument
+PROFILE_DIR: str = os.getenv("PROFILE_DIR", "/tmp/profiles")
+
+# Loggers share one queue-backed handler: callers only enqueue the record,
+# and a listener thread does the %-formatting and the write. Records are
+# formatted late, so pass immutable arguments (ids, numbers, strings).
+_base_level = getattr(logging, LOG_LEVEL.upper(), logging.INFO)
+_debug_sampled: contextvars.ContextVar[bool] = contextvars.ContextVar("debug_sampled", default=False)
+_log_queue: Optional[queue.Queue] = None
+_queue_handler: Optional[logging.Handler] = None
+_log_setup_lock = threading.Lock()
+
+
+class _DebugSampleFilter(logging.Filter):
+    """Below LOG_LEVEL, only pass records logged while a sampled job is current."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.levelno >= _base_level or _debug_sampled.get()
+
+
+class _DeferredQueueHandler(QueueHandler):
+    """Enqueues records unformatted; drops them instead of blocking when the queue is full."""
+
+    dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class _LineFormatter(logging.Formatter):
+    """Text lines; dict messages (per-job records) become one JSON line."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        if isinstance(record.msg, dict):
+            return json.dumps(record.msg, default=str)
+        return super().format(record)
+
+
+def _get_queue_handler() -> logging.Handler:
+    global _log_queue, _queue_handler
+    if _queue_handler is None:
+        with _log_setup_lock:
+            if _queue_handler is None:
+                _log_queue = queue.Queue(LOG_QUEUE_SIZE)
+                stream = logging.StreamHandler(sys.stderr)
+                stream.setFormatter(_LineFormatter(
+                    fmt='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+                    datefmt='%Y-%m-%d %H:%M:%S'
+                ))
+                listener = QueueListener(_log_queue, stream)
+                listener.start()
+                atexit.register(listener.stop)
+                _queue_handler = _DeferredQueueHandler(_log_queue)
+    return _queue_handler
+
 
 def get_logger(name: str) -> logging.Logger:
     
@@ -23,17 +154,36 @@ def get_logger(name: str) -> logging.Logger:
     
     # Only configure if not already configured
     if not logger.handlers:
-        handler = logging.StreamHandler()
-        formatter = logging.Formatter(
-            fmt='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-            datefmt='%Y-%m-%d %H:%M:%S'
-        )
-        handler.setFormatter(formatter)
-        logger.addHandler(handler)
-        logger.setLevel(getattr(logging, LOG_LEVEL.upper(), logging.INFO))
+        logger.addHandler(_get_queue_handler())
+        logger.addFilter(_DebugSampleFilter())
+        # DEBUG records are only created when some jobs are sampled for them
+        logger.setLevel(logging.DEBUG if LOG_DEBUG_SAMPLE_RATE > 0 else _base_level)
+        # The Lambda runtime's root handler would write every line a second time
+        logger.propagate = False
     
     return logger
 
+
+def get_record_logger(name: str) -> logging.Logger:
+    """Logger for structured records that are written whatever LOG_LEVEL says."""
+    logger = logging.getLogger(name)
+    if not logger.handlers:
+        logger.addHandler(_get_queue_handler())
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+    return logger
+
+
+def set_debug_logging(enabled: bool) -> None:
+    """Log DEBUG records for the current job (see tracing.JobTrace.identify)."""
+    _debug_sampled.set(enabled)
+
+
+def flush_logs() -> None:
+    """Wait until queued records are written (before a Lambda invocation returns)."""
+    if _log_queue is not None:
+        _log_queue.join()
+
 def validate_config() -> None:
     
     if not S3_BUCKET_RECEIPTS:
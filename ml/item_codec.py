@@ -0,0 +1,81 @@
+"""Compact binary encoding for a receipt's line items.
+
+Items are stored column by column (descriptions, quantities, unit prices,
+line totals) rather than as a list of maps, so attribute names are not
+repeated per item. Amounts are integer cents and quantities integer
+thousandths, and the whole thing is zlib-compressed into one binary
+attribute (`line_items_z`). A typical receipt's items fit in a few hundred
+bytes. Readers decode it only when they actually need the items.
+
+Layout: one version byte, then zlib(JSON {"d": [...], "q": [...], "u": [...], "t": [...]}).
+"""
+
+import json
+import zlib
+from decimal import Decimal
+from typing import Any, Dict, Iterable, List, Optional
+
+FORMAT_VERSION = 1
+ATTRIBUTE = 'line_items_z'
+
+# column key -> (item field, scale)
+_COLUMNS = {
+    'd': ('description', None),
+    'q': ('qty', 1000),
+    'u': ('unit_price', 100),
+    't': ('line_total', 100),
+}
+
+
+def _scaled(value: Any, scale: int) -> Optional[int]:
+    if value is None or value == '':
+        return None
+    try:
+        return int((Decimal(str(value)) * scale).to_integral_value())
+    except ArithmeticError:
+        return None
+
+
+def encode(items: Iterable[Dict[str, Any]]) -> Optional[bytes]:
+    """Encode parsed items; returns None when there are none."""
+    items = [item for item in items or [] if isinstance(item, dict)]
+    if not items:
+        return None
+    columns = {}
+    for key, (field, scale) in _COLUMNS.items():
+        if scale is None:
+            columns[key] = [item.get(field) for item in items]
+        else:
+            columns[key] = [_scaled(item.get(field), scale) for item in items]
+    payload = json.dumps(columns, separators=(',', ':')).encode('utf-8')
+    return bytes([FORMAT_VERSION]) + zlib.compress(payload, 9)
+
+
+def decode(data: Any) -> List[Dict[str, Any]]:
+    """Inverse of encode(); accepts bytes or boto3's Binary wrapper."""
+    if data is None:
+        return []
+    raw = bytes(getattr(data, 'value', data))
+    if not raw or raw[0] != FORMAT_VERSION:
+        raise ValueError(f"Unsupported line item encoding version {raw[:1]!r}")
+    columns = json.loads(zlib.decompress(raw[1:]))
+    count = len(columns.get('d', []))
+    items = []
+    for i in range(count):
+        item = {}
+        for key, (field, scale) in _COLUMNS.items():
+            value = columns.get(key, [None] * count)[i]
+            if value is None:
+                continue
+            item[field] = value if scale is None else Decimal(value) / scale
+        items.append(item)
+    return items
+
+
+def line_items(receipt: Optional[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Items from a receipt row: the compact attribute, or the older list of maps."""
+    if not receipt:
+        return []
+    if receipt.get(ATTRIBUTE) is not None:
+        return decode(receipt[ATTRIBUTE])
+    return receipt.get('line_items') or []
@@ -0,0 +1,103 @@
+"""Publish job stage transitions for the API's status long-poll.
+
+Each job has one small item in the job status table (user_id, job_id) that
+is overwritten at every stage, so the API can watch many jobs with a single
+BatchGetItem instead of re-querying the receipt list. Items expire after
+JOB_STATUS_TTL_HOURS. Publishing is best effort: a lost update only delays
+the client until the next stage or its own timeout.
+"""
+
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import boto3
+
+from config import get_logger
+import config
+import tracing
+
+logger = get_logger(__name__)
+
+OCR_DONE = "OCR_DONE"
+CATEGORIZED = "CATEGORIZED"
+COMPLETED = "COMPLETED"
+FAILED = "FAILED"
+
+
+class DynamoJobStatusChannel:
+
+    def __init__(self, table):
+        self.table = table
+
+    def publish(self, user_id: str, job_id: str, stage: str, detail: Dict[str, Any]) -> None:
+        now_ms = int(time.time() * 1000)
+        item = {
+            'user_id': user_id,
+            'job_id': job_id,
+            'stage': stage,
+            'updated_at': now_ms,
+            'expires_at': now_ms // 1000 + config.JOB_STATUS_TTL_HOURS * 3600,
+        }
+        if detail:
+            item['detail'] = detail
+        self.table.put_item(Item=item)
+
+
+class InMemoryJobStatusChannel:
+    """Stand-in channel for tests and local replay; waiters wake on publish."""
+
+    def __init__(self):
+        self.events: List[Tuple[str, str, str, Dict[str, Any]]] = []
+        self.latest: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        self._changed = threading.Condition()
+
+    def publish(self, user_id: str, job_id: str, stage: str, detail: Dict[str, Any]) -> None:
+        with self._changed:
+            self.events.append((user_id, job_id, stage, detail))
+            previous = self.latest.get((user_id, job_id), {}).get('updated_at', 0)
+            self.latest[(user_id, job_id)] = {
+                'stage': stage,
+                'updated_at': max(int(time.time() * 1000), previous + 1),
+                'detail': detail,
+            }
+            self._changed.notify_all()
+
+    def wait_for(self, user_id: str, job_id: str, stages: tuple, timeout: float) -> Optional[str]:
+        """Block until the job reaches one of `stages`; returns it, or None on timeout."""
+        deadline = time.monotonic() + timeout
+        with self._changed:
+            while True:
+                stage = self.latest.get((user_id, job_id), {}).get('stage')
+                if stage in stages:
+                    return stage
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self._changed.wait(remaining)
+
+
+channel = None
+_channel_lock = threading.Lock()
+
+
+def _get_channel():
+    global channel
+    if channel is None and config.JOB_STATUS_TABLE:
+        with _channel_lock:
+            if channel is None:
+                table = boto3.resource('dynamodb', region_name=config.AWS_REGION).Table(config.JOB_STATUS_TABLE)
+                channel = DynamoJobStatusChannel(table)
+    return channel
+
+
+def publish(user_id: str, job_id: str, stage: str, **detail: Any) -> None:
+    target = _get_channel()
+    if target is None:
+        return
+    try:
+        with tracing.span("job_status"):
+            target.publish(user_id, job_id, stage, detail)
+    except Exception as e:
+        tracing.incr("job_status_errors")
+        logger.warning("Failed to publish stage %s for job %s: %s", stage, job_id, e)
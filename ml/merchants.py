@@ -0,0 +1,305 @@
+"""Merchant-name canonicalization.
+
+OCR'd merchant lines vary per store and per photo ("WAL-MART #1234",
+"Walmart Supercenter", "WALMART"). canonicalize() maps them to one display
+name so duplicate hashing, categorization, rollups, recurring-charge
+detection and search all agree on the merchant.
+
+Lookup order:
+1. Memo cache of raw string -> canonical name (bounded LRU).
+2. Trie over the compact normalized form (tokens joined without spaces,
+   store numbers and filler words dropped). The longest known alias that
+   ends on a token boundary wins, but only if everything after it is a
+   location ("walmart san jose ca"). "Target Optical" and "Shell Beach
+   Cafe" are different businesses and don't match this way.
+3. Trigram index for OCR errors ("WALMAPT"). Candidates must be about as
+   long as the input and score a Dice coefficient >= FUZZY_THRESHOLD.
+
+Names that match nothing are cleaned (store numbers removed) and returned.
+Spellings with the same normalized form all get the most frequent one seen
+(ties go to the lexicographically smallest). After CONFIRM_AFTER sightings
+that spelling is added to the trie and trigram index, so OCR variants of it
+resolve to it too. This happens per container. Callers keep the raw string
+so a wrong match can be spotted and redone. After warm-up a lookup is a
+dict hit; a miss costs a few microseconds.
+"""
+
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+MEMO_SIZE = 20000
+FUZZY_THRESHOLD = 0.6
+MIN_FUZZY_LENGTH = 4  # shorter names have too few trigrams to compare
+CONFIRM_AFTER = 2
+
+# canonical name -> aliases (any spelling; normalized the same way as input)
+KNOWN_MERCHANTS: Dict[str, List[str]] = {
+    "Walmart": ["walmart", "wal mart", "wm supercenter", "walmart neighborhood market"],
+    "Target": ["target", "super target"],
+    "Costco": ["costco", "costco wholesale"],
+    "Whole Foods": ["whole foods", "whole foods market", "wfm"],
+    "Trader Joe's": ["trader joes", "trader joe"],
+    "Safeway": ["safeway"],
+    "Kroger": ["kroger"],
+    "Aldi": ["aldi"],
+    "Starbucks": ["starbucks", "starbucks coffee"],
+    "McDonald's": ["mcdonalds", "mc donalds"],
+    "Shell": ["shell", "shell oil"],
+    "Chevron": ["chevron"],
+    "Exxon": ["exxon", "exxonmobil"],
+    "Mobil": ["mobil"],
+    "ARCO": ["arco", "am pm"],
+    "Uber": ["uber", "uber trip", "uber eats"],
+    "Lyft": ["lyft"],
+    "Marriott": ["marriott"],
+    "Hilton": ["hilton"],
+    "Airbnb": ["airbnb"],
+    "AMC Theatres": ["amc", "amc theatres", "amc theaters"],
+    "CVS": ["cvs", "cvs pharmacy"],
+    "Walgreens": ["walgreens"],
+    "Comcast": ["comcast", "xfinity"],
+    "Verizon": ["verizon", "verizon wireless"],
+    "AT&T": ["at t", "att"],
+    "Netflix": ["netflix", "netflix com"],
+    "Spotify": ["spotify"],
+    "Hulu": ["hulu"],
+    "Amazon": ["amazon", "amazon com", "amzn mktp", "amzn"],
+    "Best Buy": ["best buy", "bestbuy"],
+    "The Home Depot": ["home depot"],
+    "Lowe's": ["lowes", "lowe s home improvement"],
+    "IKEA": ["ikea"],
+    "Sephora": ["sephora"],
+    "GEICO": ["geico"],
+    "Allstate": ["allstate"],
+    "Progressive": ["progressive"],
+}
+
+# Dropped before matching: they vary between receipts of the same merchant
+NOISE_WORDS = frozenset({
+    "the", "inc", "llc", "ltd", "co", "corp", "company", "store", "stores",
+    "supercenter", "superstore", "no", "num", "number", "location",
+})
+# Allowed after a prefix match ("WALMART SAN JOSE CA"): US states and
+# their codes, and large cities
+LOCATION_NAMES = frozenset({
+    "alabama", "alaska", "arizona", "arkansas", "california", "colorado",
+    "connecticut", "delaware", "florida", "georgia", "hawaii", "idaho",
+    "illinois", "indiana", "iowa", "kansas", "kentucky", "louisiana", "maine",
+    "maryland", "massachusetts", "michigan", "minnesota", "mississippi",
+    "missouri", "montana", "nebraska", "nevada", "new hampshire", "new jersey",
+    "new mexico", "new york", "north carolina", "north dakota", "ohio",
+    "oklahoma", "oregon", "pennsylvania", "rhode island", "south carolina",
+    "south dakota", "tennessee", "texas", "utah", "vermont", "virginia",
+    "washington", "west virginia", "wisconsin", "wyoming",
+    *"al ak az ar ca co ct de dc fl ga hi id il in ia ks ky la me md ma mi mn ms mo mt "
+     "ne nv nh nj nm ny nc nd oh ok or pa ri sc sd tn tx ut vt va wa wv wi wy us usa".split(),
+    "los angeles", "san diego", "san jose", "san francisco", "san antonio",
+    "chicago", "houston", "phoenix", "philadelphia", "dallas", "austin",
+    "fort worth", "jacksonville", "columbus", "charlotte", "indianapolis",
+    "seattle", "denver", "boston", "el paso", "nashville", "detroit",
+    "portland", "las vegas", "memphis", "louisville", "baltimore",
+    "milwaukee", "albuquerque", "tucson", "fresno", "sacramento",
+    "kansas city", "atlanta", "miami", "oakland", "minneapolis", "tulsa",
+    "new orleans", "cleveland", "pittsburgh", "st louis", "orlando", "tampa",
+})
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+_STORE_NUMBER_RE = re.compile(r"(?:#|\bno\.?\s*|\bstore\s+)\s*\d+\b|\b\d{3,}\s*$", re.IGNORECASE)
+
+_END = "$"
+_LOCATIONS = {tuple(name.split()) for name in LOCATION_NAMES}
+_LONGEST_LOCATION = max(len(p) for p in _LOCATIONS)
+
+
+def _all_locations(tokens: List[str]) -> bool:
+    """True if the tokens are nothing but location names ("san jose ca")."""
+    i = 0
+    while i < len(tokens):
+        for size in range(min(_LONGEST_LOCATION, len(tokens) - i), 0, -1):
+            if tuple(tokens[i:i + size]) in _LOCATIONS:
+                i += size
+                break
+        else:
+            return False
+    return True
+
+
+def normalize_tokens(name: str) -> List[str]:
+    text = unicodedata.normalize("NFKD", name).encode("ascii", "ignore").decode("ascii").lower()
+    text = text.replace("'", "")
+    text = _STORE_NUMBER_RE.sub(" ", text)
+    return [t for t in _TOKEN_RE.findall(text) if t not in NOISE_WORDS and not t.isdigit()]
+
+
+def _trigrams(compact: str) -> Set[str]:
+    padded = f"  {compact} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _comparable_length(a: str, b: str) -> bool:
+    # OCR errors barely change length; a much longer name is another business
+    return abs(len(a) - len(b)) <= max(2, len(a) // 4)
+
+
+def _dice(a: str, b: str) -> float:
+    grams_a, grams_b = _trigrams(a), _trigrams(b)
+    return 2.0 * len(grams_a & grams_b) / (len(grams_a) + len(grams_b))
+
+
+def clean_display_name(name: str) -> str:
+    """Raw name with store numbers and extra whitespace removed."""
+    cleaned = " ".join(_STORE_NUMBER_RE.sub(" ", name).split())
+    return cleaned.strip(" -#,.") or name.strip()
+
+
+class MerchantIndex:
+
+    def __init__(self, known: Optional[Dict[str, Iterable[str]]] = None, memo_size: int = MEMO_SIZE):
+        self._trie: dict = {}
+        self._trigrams: Dict[str, Set[int]] = {}
+        self._entries: List[Tuple[str, str, int]] = []  # (compact alias, canonical, trigram count)
+        self._compact: Dict[str, str] = {}
+        self._memo: "OrderedDict[str, Tuple[str, str]]" = OrderedDict()  # raw -> (compact, canonical)
+        self._memo_size = memo_size
+        self._sightings: Dict[str, Dict[str, int]] = {}  # compact -> spelling -> count
+        self._lock = threading.Lock()
+        for canonical, aliases in (known or {}).items():
+            self.add(canonical, aliases)
+
+    def __len__(self) -> int:
+        return len(self._compact)
+
+    def add(self, canonical: str, aliases: Iterable[str] = ()) -> None:
+        """Register a merchant and its spellings (the canonical name is an alias too)."""
+        with self._lock:
+            added = []
+            for alias in [canonical, *aliases]:
+                compact = "".join(normalize_tokens(alias))
+                if not compact or compact in self._compact:
+                    continue
+                added.append(compact)
+                self._compact[compact] = canonical
+                node = self._trie
+                for ch in compact:
+                    node = node.setdefault(ch, {})
+                node[_END] = canonical
+                grams = _trigrams(compact)
+                entry_id = len(self._entries)
+                self._entries.append((compact, canonical, len(grams)))
+                for gram in grams:
+                    self._trigrams.setdefault(gram, set()).add(entry_id)
+            if added:
+                self._evict(added)
+
+    def _evict(self, aliases: List[str]) -> None:
+        """Forget memoized lookups that one of the new aliases could now match."""
+        stale = [
+            raw for raw, (compact, _) in self._memo.items()
+            if compact and any(
+                compact.startswith(alias)
+                or _comparable_length(compact, alias) and _dice(compact, alias) >= FUZZY_THRESHOLD
+                for alias in aliases
+            )
+        ]
+        for raw in stale:
+            del self._memo[raw]
+
+    def canonicalize(self, raw: Optional[str]) -> Optional[str]:
+        if not raw or not raw.strip():
+            return raw
+        with self._lock:
+            hit = self._memo.get(raw)
+            if hit is not None:
+                self._memo.move_to_end(raw)
+                return hit[1]
+
+        tokens = normalize_tokens(raw)
+        canonical = self._lookup(tokens)
+        if canonical is None:
+            canonical = self._observe_unknown(clean_display_name(raw), tokens)
+
+        with self._lock:
+            self._memo[raw] = ("".join(tokens), canonical)
+            while len(self._memo) > self._memo_size:
+                self._memo.popitem(last=False)
+        return canonical
+
+    def _lookup(self, tokens: List[str]) -> Optional[str]:
+        if not tokens:
+            return None
+        compact = "".join(tokens)
+        exact = self._compact.get(compact)
+        if exact is not None:
+            return exact
+        return self._prefix_match(tokens) or self._fuzzy_match(compact)
+
+    def _prefix_match(self, tokens: List[str]) -> Optional[str]:
+        """Longest alias that is a prefix of the input, ends between tokens and
+        is followed only by location names."""
+        boundaries = {}
+        position = 0
+        for count, token in enumerate(tokens, 1):
+            position += len(token)
+            boundaries[position] = count
+
+        node, best = self._trie, None
+        for i, ch in enumerate("".join(tokens)):
+            node = node.get(ch)
+            if node is None:
+                break
+            if _END in node and (i + 1) in boundaries and _all_locations(tokens[boundaries[i + 1]:]):
+                best = node[_END]
+        return best
+
+    def _fuzzy_match(self, compact: str) -> Optional[str]:
+        if len(compact) < MIN_FUZZY_LENGTH:
+            return None
+        grams = _trigrams(compact)
+        shared: Dict[int, int] = {}
+        for gram in grams:
+            for entry_id in self._trigrams.get(gram, ()):
+                shared[entry_id] = shared.get(entry_id, 0) + 1
+        best, best_score = None, FUZZY_THRESHOLD
+        for entry_id, common in shared.items():
+            alias, canonical, size = self._entries[entry_id]
+            if not _comparable_length(compact, alias):
+                continue
+            score = 2.0 * common / (len(grams) + size)
+            if score >= best_score:
+                best, best_score = canonical, score
+        return best
+
+    def _observe_unknown(self, display: str, tokens: List[str]) -> str:
+        """Name for an unmatched merchant: the most frequent spelling seen
+        (ties to the smallest), promoted into the dictionary once the
+        normalized form has been seen CONFIRM_AFTER times."""
+        compact = "".join(tokens)
+        if not compact:
+            return display
+        with self._lock:
+            if len(self._sightings) >= MEMO_SIZE:
+                self._sightings.clear()
+            spellings = self._sightings.setdefault(compact, {})
+            spellings[display] = spellings.get(display, 0) + 1
+            chosen = min(spellings, key=lambda name: (-spellings[name], name))
+            confirmed = sum(spellings.values()) >= CONFIRM_AFTER
+        if confirmed:
+            self.add(chosen)
+            with self._lock:
+                self._sightings.pop(compact, None)
+        return chosen
+
+
+index = MerchantIndex(KNOWN_MERCHANTS)
+
+
+def canonicalize(raw: Optional[str]) -> Optional[str]:
+    """Canonical display name for an OCR'd merchant string (None stays None)."""
+    return index.canonicalize(raw)
+
+
+def confirm(canonical: str, aliases: Iterable[str] = ()) -> None:
+    """Add a merchant (e.g. one a user corrected) so future variants resolve to it."""
+    index.add(canonical, aliases)
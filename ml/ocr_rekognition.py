@@ -0,0 +1,58 @@
+"""AWS Rekognition text detection for receipt images."""
+
+import json
+from typing import Any, Dict
+
+import boto3
+
+from config import get_logger, AWS_REGION
+import rate_limiter
+
+logger = get_logger(__name__)
+
+# AWS clients (module-level so they are reused across warm invocations)
+rekognition_client = boto3.client('rekognition', region_name=AWS_REGION)
+s3_client = boto3.client('s3', region_name=AWS_REGION)
+
+
+def run_rekognition_on_s3_object(bucket: str, key: str) -> Dict[str, Any]:
+    """Run DetectText on an image stored in S3."""
+    logger.debug("Calling Rekognition DetectText on s3://%s/%s", bucket, key)
+    rate_limiter.acquire('rekognition')
+    response = rekognition_client.detect_text(
+        Image={'S3Object': {'Bucket': bucket, 'Name': key}}
+    )
+    logger.debug("Rekognition returned %d detections", len(response.get('TextDetections', [])))
+    return response
+
+
+def run_rekognition_on_bytes(image_bytes: bytes) -> Dict[str, Any]:
+    """Run DetectText on in-memory image bytes (max 5 MB)."""
+    logger.debug("Calling Rekognition DetectText on %d bytes", len(image_bytes))
+    rate_limiter.acquire('rekognition')
+    response = rekognition_client.detect_text(Image={'Bytes': image_bytes})
+    logger.debug("Rekognition returned %d detections", len(response.get('TextDetections', [])))
+    return response
+
+
+def download_image(bucket: str, key: str) -> bytes:
+    """Fetch the uploaded image so it can be pre-processed locally."""
+    response = s3_client.get_object(Bucket=bucket, Key=key)
+    return response['Body'].read()
+
+
+def save_rekognition_output_to_s3(
+    rekognition_response: Dict[str, Any],
+    output_bucket: str,
+    output_key: str
+) -> None:
+    """Archive the raw Rekognition response as JSON."""
+    # ResponseMetadata is per-request noise, not OCR output
+    payload = {k: v for k, v in rekognition_response.items() if k != 'ResponseMetadata'}
+    s3_client.put_object(
+        Bucket=output_bucket,
+        Key=output_key,
+        Body=json.dumps(payload),
+        ContentType='application/json'
+    )
+    logger.debug("Saved Rekognition output to s3://%s/%s", output_bucket, output_key)
@@ -6,6 +6,7 @@ from typing import Optional, List, Dict, Any
 
 from schemas import ParsedReceipt, ReceiptItem
 from config import get_logger
+import merchants
 
 logger = get_logger(__name__)
 
@@ -16,23 +17,24 @@ def parse_rekognition_response(
     rekognition_s3_key: str
 ) -> ParsedReceipt:
     
-    logger.info(f"Parsing Rekognition response for job {job_id}")
+    logger.debug("Parsing Rekognition response for job %s", job_id)
     
     # Extract all text lines
     text_lines = extract_text_lines(rekognition_response)
-    logger.debug(f"Extracted {len(text_lines)} text lines")
+    logger.debug("Extracted %d text lines", len(text_lines))
     
     # Extract merchant (usually first few lines)
-    merchant = extract_merchant(text_lines)
-    logger.info(f"Extracted merchant: {merchant}")
+    raw_merchant = extract_merchant(text_lines)
+    merchant = merchants.canonicalize(raw_merchant)
+    logger.debug("Extracted merchant: %s (raw: %s)", merchant, raw_merchant)
     
     # Extract date
     purchase_date = extract_date(text_lines)
-    logger.info(f"Extracted date: {purchase_date}")
+    logger.debug("Extracted date: %s", purchase_date)
     
     # Extract line items
     items = extract_line_items(text_lines)
-    logger.info(f"Extracted {len(items)} line items")
+    logger.debug("Extracted %d line items", len(items))
     
     # Extract totals from text
     subtotal, tax, total = extract_totals(text_lines)
@@ -40,7 +42,7 @@ def parse_rekognition_response(
     # If total not found, calculate from items
     if total is None and items:
         calculated_total = sum(item.line_total for item in items)
-        logger.info(f"Total not found in text, calculated from items: ${calculated_total:.2f}")
+        logger.debug("Total not found in text, calculated from items: $%.2f", calculated_total)
         total = calculated_total
         # Estimate subtotal and tax if not found
         if subtotal is None:
@@ -48,13 +50,14 @@ def parse_rekognition_response(
         if tax is None:
             tax = 0.0
     
-    logger.info(f"Final totals - Subtotal: {subtotal}, Tax: {tax}, Total: {total}")
+    logger.debug("Final totals - Subtotal: %s, Tax: %s, Total: %s", subtotal, tax, total)
     
     # Create ParsedReceipt
     receipt = ParsedReceipt(
         job_id=job_id,
         user_id=user_id,
         merchant=merchant,
+        merchant_raw=raw_merchant,
         purchase_date=purchase_date,
         subtotal=subtotal,
         tax=tax,
@@ -0,0 +1,143 @@
+"""Shrink receipt photos before OCR: orient, grayscale, crop, downscale, re-encode."""
+
+import io
+import time
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+from config import get_logger
+import config
+
+logger = get_logger(__name__)
+
+try:
+    from PIL import Image, ImageFilter, ImageOps, ImageStat
+except ImportError:  # Pillow is optional; the pipeline falls back to OCR on the original
+    Image = None
+
+try:
+    import pillow_heif
+    pillow_heif.register_heif_opener()
+except ImportError:
+    pillow_heif = None
+
+# Crop detection runs on a thumbnail this size (long edge, pixels)
+CROP_ANALYSIS_SIZE = 256
+# Only crop when the detected receipt covers this fraction of the frame
+CROP_MIN_AREA = 0.2
+CROP_MAX_AREA = 0.95
+CROP_MARGIN = 0.02
+
+
+@dataclass
+class PreprocessResult:
+    image_bytes: bytes
+    width: int
+    height: int
+    original_bytes: int
+    original_size: Tuple[int, int]
+    cropped: bool
+    elapsed_ms: float
+
+    @property
+    def bytes_saved(self) -> int:
+        return self.original_bytes - len(self.image_bytes)
+
+
+def is_available() -> bool:
+    return Image is not None
+
+
+def preprocess_image(
+    image_bytes: bytes,
+    long_edge: Optional[int] = None,
+    quality: Optional[int] = None,
+    crop: bool = True
+) -> PreprocessResult:
+    """Return a grayscale JPEG no larger than long_edge on its longest side.
+
+    Tall receipts keep their height and are bounded to TILED_OCR_TILE_WIDTH wide.
+    """
+    if Image is None:
+        raise RuntimeError("Pillow is not installed")
+
+    long_edge = long_edge or config.PREPROCESS_LONG_EDGE
+    quality = quality or config.PREPROCESS_JPEG_QUALITY
+    start = time.perf_counter()
+
+    img = Image.open(io.BytesIO(image_bytes))
+    original_size = img.size
+
+    # Let the JPEG decoder downscale by 1/2, 1/4 or 1/8 while decoding (not for
+    # long receipts in either orientation, EXIF rotation is applied afterwards)
+    if img.format == "JPEG" and max(img.size) < min(img.size) * config.TILED_OCR_ASPECT:
+        img.draft("L", (long_edge, long_edge))
+
+    img = ImageOps.exif_transpose(img)
+    img = img.convert("L")
+
+    cropped = False
+    if crop:
+        box = _find_receipt_box(img)
+        if box is not None:
+            img = img.crop(box)
+            cropped = True
+
+    # Long receipts are tiled for OCR, so bound their width instead of their
+    # height; shrinking the long edge would make the text unreadable
+    tall = img.height / float(img.width) >= config.TILED_OCR_ASPECT
+    limit = config.TILED_OCR_TILE_WIDTH if tall else long_edge
+    current = img.width if tall else max(img.size)
+    if current > limit:
+        scale = limit / float(current)
+        new_size = (max(1, round(img.width * scale)), max(1, round(img.height * scale)))
+        img = img.resize(new_size, Image.BILINEAR, reducing_gap=2.0)
+
+    img = ImageOps.autocontrast(img, cutoff=1)
+
+    out = io.BytesIO()
+    img.save(out, format="JPEG", quality=quality)
+    result = PreprocessResult(
+        image_bytes=out.getvalue(),
+        width=img.width,
+        height=img.height,
+        original_bytes=len(image_bytes),
+        original_size=original_size,
+        cropped=cropped,
+        elapsed_ms=(time.perf_counter() - start) * 1000.0
+    )
+    logger.debug(
+        "Preprocessed image %dx%d (%d B) -> %dx%d (%d B) in %.1f ms",
+        original_size[0], original_size[1], result.original_bytes,
+        result.width, result.height, len(result.image_bytes), result.elapsed_ms
+    )
+    return result
+
+
+def _find_receipt_box(gray) -> Optional[Tuple[int, int, int, int]]:
+    """Bounding box of the bright paper region, or None if no clear receipt."""
+    thumb = gray.copy()
+    thumb.thumbnail((CROP_ANALYSIS_SIZE, CROP_ANALYSIS_SIZE))
+
+    mean = ImageStat.Stat(thumb).mean[0]
+    threshold = mean + (255 - mean) * 0.25
+    mask = thumb.point(lambda p: 255 if p > threshold else 0).filter(ImageFilter.MedianFilter(5))
+    bbox = mask.getbbox()
+    if bbox is None:
+        return None
+
+    left, top, right, bottom = bbox
+    area = (right - left) * (bottom - top) / float(thumb.width * thumb.height)
+    if area < CROP_MIN_AREA or area > CROP_MAX_AREA:
+        return None
+
+    sx = gray.width / float(thumb.width)
+    sy = gray.height / float(thumb.height)
+    mx = gray.width * CROP_MARGIN
+    my = gray.height * CROP_MARGIN
+    return (
+        max(0, int(left * sx - mx)),
+        max(0, int(top * sy - my)),
+        min(gray.width, int(right * sx + mx)),
+        min(gray.height, int(bottom * sy + my)),
+    )
@@ -0,0 +1,279 @@
+"""Token-bucket rate limiting shared across worker containers.
+
+Each bucket is one DynamoDB item (tokens, updated_at). Containers refill and
+take tokens with a conditional update, and lease a few tokens at a time so
+most calls are served from memory instead of a DynamoDB round trip. When no
+token arrives within RATE_LIMIT_MAX_WAIT, RateLimitExceeded is raised and the
+SQS handler leaves the message on the queue.
+
+With priority lanes each service has one bucket per lane, refilled at the
+lane's weighted share of the rate (INTERACTIVE_WEIGHT : BULK_WEIGHT). A lane
+whose bucket is empty borrows from the other lane's bucket, but only tokens
+above LANE_BORROW_RESERVE of its burst, so an idle lane's capacity is used
+while a busy lane keeps its share. Calls are charged to the lane set with
+lane() (interactive by default).
+"""
+
+import contextvars
+import math
+import threading
+import time
+from contextlib import contextmanager
+from decimal import Decimal
+from typing import Dict, Iterator, Optional
+
+import boto3
+from botocore.exceptions import ClientError
+
+from config import get_logger
+import config
+import tracing
+
+logger = get_logger(__name__)
+
+# Leased tokens not used within this window are dropped, so an idle container
+# cannot hoard quota and release it later as a burst
+LEASE_TTL_SECONDS = 1.0
+MAX_CONDITIONAL_RETRIES = 5
+MAX_USER_BUCKETS = 1000
+USER_BUCKET_TTL_SECONDS = 24 * 3600  # idle per-user bucket items expire
+
+_lane: contextvars.ContextVar[str] = contextvars.ContextVar("rate_limit_lane", default=config.LANE_INTERACTIVE)
+
+
+class RateLimitExceeded(Exception):
+    """No token became available within the allowed wait."""
+
+    def __init__(self, bucket_id: str, waited: float):
+        super().__init__(f"Rate limit '{bucket_id}' exhausted after waiting {waited:.2f}s")
+        self.bucket_id = bucket_id
+        self.waited = waited
+
+
+class DynamoTokenBucket:
+
+    def __init__(
+        self,
+        bucket_id: str,
+        rate: float,
+        capacity: float,
+        table,
+        lease_size: int = 5,
+        ttl_seconds: Optional[int] = None
+    ):
+        self.bucket_id = bucket_id
+        self.rate = rate
+        self.capacity = capacity
+        self.table = table
+        self.lease_size = max(1, lease_size)
+        self.ttl_seconds = ttl_seconds
+        self._local_tokens = 0
+        self._lease_expires = 0.0
+        self._lock = threading.Lock()
+
+    def try_acquire(self, n: int = 1, keep: float = 0.0) -> float:
+        """Take n tokens; returns 0 on success or the suggested wait in seconds.
+
+        With keep > 0 (another lane borrowing) only tokens above `keep` are
+        taken, straight from the shared item and without leasing ahead.
+        """
+        if keep > 0:
+            granted, wait = self._lease(n, keep)
+            return 0.0 if granted >= n else wait
+        with self._lock:
+            now = time.monotonic()
+            if now >= self._lease_expires:
+                self._local_tokens = 0
+            if self._local_tokens >= n:
+                self._local_tokens -= n
+                tracing.incr("rate_limit_local_hits")
+                return 0.0
+
+            want = max(n, self.lease_size) - self._local_tokens
+            granted, wait = self._lease(want)
+            if granted:
+                self._local_tokens += granted
+                self._lease_expires = now + LEASE_TTL_SECONDS
+            if self._local_tokens >= n:
+                self._local_tokens -= n
+                return 0.0
+            return wait
+
+    def acquire(
+        self,
+        n: int = 1,
+        max_wait: Optional[float] = None,
+        borrow_from: Optional["DynamoTokenBucket"] = None
+    ) -> None:
+        max_wait = config.RATE_LIMIT_MAX_WAIT if max_wait is None else max_wait
+        start = time.monotonic()
+        while True:
+            wait = self.try_acquire(n)
+            if wait > 0 and borrow_from is not None:
+                borrow_wait = borrow_from.try_acquire(n, keep=borrow_from.capacity * config.LANE_BORROW_RESERVE)
+                if borrow_wait <= 0:
+                    tracing.incr("rate_limit_borrowed")
+                    return
+                wait = min(wait, borrow_wait)
+            if wait <= 0:
+                return
+            waited = time.monotonic() - start
+            if waited + wait > max_wait:
+                tracing.incr("rate_limit_rejections")
+                raise RateLimitExceeded(self.bucket_id, waited)
+            tracing.incr("rate_limit_waits")
+            time.sleep(wait)
+
+    def _lease(self, want: int, keep: float = 0.0) -> tuple:
+        """Refill from elapsed time and take up to `want` whole tokens above `keep` atomically."""
+        for _ in range(MAX_CONDITIONAL_RETRIES):
+            tracing.incr("rate_limit_remote_calls")
+            now_ms = int(time.time() * 1000)
+            item = self.table.get_item(Key={'bucket_id': self.bucket_id}, ConsistentRead=True).get('Item')
+
+            if item is None:
+                tokens, prev_ms = float(self.capacity), None
+            else:
+                prev_ms = int(item['updated_at'])
+                elapsed = max(0, now_ms - prev_ms) / 1000.0
+                tokens = min(float(self.capacity), float(item['tokens']) + elapsed * self.rate)
+
+            granted = min(want, int(math.floor(tokens - keep)))
+            if granted <= 0:
+                return 0, (1.0 + keep - tokens) / self.rate
+
+            try:
+                self._write(tokens - granted, now_ms, prev_ms)
+                return granted, 0.0
+            except ClientError as e:
+                if e.response.get('Error', {}).get('Code') != 'ConditionalCheckFailedException':
+                    raise
+                # Another container updated the bucket first; re-read and retry
+                tracing.incr("rate_limit_conflicts")
+
+        return 0, 1.0 / self.rate
+
+    def _write(self, tokens: float, now_ms: int, prev_ms: Optional[int]) -> None:
+        if prev_ms is None:
+            condition = 'attribute_not_exists(bucket_id)'
+            values = {':tokens': _decimal(tokens), ':now': now_ms}
+        else:
+            condition = 'updated_at = :prev'
+            values = {':tokens': _decimal(tokens), ':now': now_ms, ':prev': prev_ms}
+        update = 'SET tokens = :tokens, updated_at = :now'
+        if self.ttl_seconds:
+            update += ', expires_at = :expires'
+            values[':expires'] = now_ms // 1000 + self.ttl_seconds
+        self.table.update_item(
+            Key={'bucket_id': self.bucket_id},
+            UpdateExpression=update,
+            ConditionExpression=condition,
+            ExpressionAttributeValues=values
+        )
+
+
+def _decimal(value: float) -> Decimal:
+    return Decimal(str(round(value, 6)))
+
+
+_table = None
+_buckets: Dict[str, DynamoTokenBucket] = {}
+_buckets_lock = threading.Lock()
+
+
+def _get_table():
+    global _table
+    if _table is None:
+        _table = boto3.resource('dynamodb', region_name=config.AWS_REGION).Table(config.RATE_LIMIT_TABLE)
+    return _table
+
+
+def _limit_for(name: str) -> float:
+    return {
+        'rekognition': config.REKOGNITION_RATE_LIMIT,
+        'bedrock': config.BEDROCK_RATE_LIMIT,
+    }.get(name, 0.0)
+
+
+def _lane_weights() -> Dict[str, float]:
+    """Weight per lane, or {} when lanes are disabled (a weight <= 0)."""
+    weights = {config.LANE_INTERACTIVE: config.INTERACTIVE_WEIGHT, config.LANE_BULK: config.BULK_WEIGHT}
+    return weights if min(weights.values()) > 0 else {}
+
+
+def get_bucket(name: str, lane: Optional[str] = None) -> Optional[DynamoTokenBucket]:
+    """Shared bucket for a service (or one lane's share of it), or None when
+    limiting is not configured."""
+    rate = _limit_for(name)
+    if not config.RATE_LIMIT_TABLE or rate <= 0:
+        return None
+    bucket_id = name
+    if lane is not None:
+        weights = _lane_weights()
+        rate *= weights[lane] / sum(weights.values())
+        bucket_id = f"{name}#{lane}"
+    with _buckets_lock:
+        if bucket_id not in _buckets:
+            _buckets[bucket_id] = DynamoTokenBucket(
+                bucket_id=bucket_id,
+                rate=rate,
+                capacity=max(1.0, rate * config.RATE_LIMIT_BURST_SECONDS),
+                table=_get_table(),
+                lease_size=config.RATE_LIMIT_LEASE
+            )
+        return _buckets[bucket_id]
+
+
+def user_bucket(user_id: str) -> Optional[DynamoTokenBucket]:
+    """Per-user bucket pacing a user's bulk jobs (None when disabled)."""
+    rate = config.BULK_USER_RATE
+    if not config.RATE_LIMIT_TABLE or rate <= 0:
+        return None
+    bucket_id = f"user#{user_id}"
+    with _buckets_lock:
+        if bucket_id not in _buckets:
+            user_ids = [key for key in _buckets if key.startswith("user#")]
+            if len(user_ids) >= MAX_USER_BUCKETS:
+                for key in user_ids:
+                    del _buckets[key]
+            # No lease: tokens held by one container would let the user run ahead elsewhere
+            _buckets[bucket_id] = DynamoTokenBucket(
+                bucket_id=bucket_id,
+                rate=rate,
+                capacity=max(1.0, rate * config.RATE_LIMIT_BURST_SECONDS),
+                table=_get_table(),
+                lease_size=1,
+                ttl_seconds=USER_BUCKET_TTL_SECONDS
+            )
+        return _buckets[bucket_id]
+
+
+@contextmanager
+def lane(name: str) -> Iterator[None]:
+    """Charge rate-limited calls made inside the block to a priority lane."""
+    token = _lane.set(name)
+    try:
+        yield
+    finally:
+        _lane.reset(token)
+
+
+def acquire(name: str, n: int = 1) -> None:
+    """Block until n tokens are available for `name` (no-op if unconfigured)."""
+    if get_bucket(name) is None:
+        return
+    weights = _lane_weights()
+    current = _lane.get()
+    if weights and current in weights:
+        other = next(lane_name for lane_name in weights if lane_name != current)
+        bucket, borrow_from = get_bucket(name, current), get_bucket(name, other)
+    else:
+        bucket, borrow_from = get_bucket(name), None
+    with tracing.span(f"rate_limit_{name}"):
+        bucket.acquire(n, borrow_from=borrow_from)
+
+
+def reset() -> None:
+    """Forget cached buckets (after changing config or the table)."""
+    with _buckets_lock:
+        _buckets.clear()
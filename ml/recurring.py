@@ -0,0 +1,243 @@
+"""Incremental recurring-charge (subscription) detection.
+
+Each (user, merchant) pair has one RECUR#<merchant> item in the stats table.
+It holds a fixed-size ring buffer of the most recent charges (day number,
+amount in cents, receipt id) plus running estimates of the charge period:
+an exponentially weighted mean of the gaps between charges and of their
+deviation. A new receipt reads and conditionally rewrites that one item, so
+the work per receipt is constant and never scans the user's history.
+
+Alerts produced:
+
+    NEW_SUBSCRIPTION  the merchant's charges just became regular
+    PRICE_INCREASE    a recurring charge went up by more than RECURRING_PRICE_INCREASE
+    MISSED_CHARGE     the gap since the last charge spans one or more periods
+                      (noticed when the next charge arrives, without a scan)
+"""
+
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any, Dict, List, Optional
+
+from botocore.exceptions import ClientError
+
+from config import get_logger
+from schemas import AlertEvent, ParsedReceipt
+import aggregates
+import config
+import tracing
+
+logger = get_logger(__name__)
+
+STAT_PREFIX = "RECUR#"
+EWMA_ALPHA = Decimal("0.3")
+MIN_PERIOD_DAYS = 5  # closer charges are repeat visits, not a cycle
+MAX_PERIOD_DAYS = 400
+MIN_OCCURRENCES = 3
+PERIOD_TOLERANCE = Decimal("0.2")  # deviation allowed, as a fraction of the period
+AMOUNT_TOLERANCE = Decimal("0.1")  # spread allowed between recent amounts
+MAX_CONDITIONAL_RETRIES = 3
+ALERT_TYPES = ("NEW_SUBSCRIPTION", "PRICE_INCREASE", "MISSED_CHARGE")
+
+
+class ChargeHistory:
+    """Ring buffer of recent charges plus incremental period estimates."""
+
+    def __init__(self, item: Optional[Dict[str, Any]], capacity: int):
+        item = item or {}
+        self.capacity = capacity
+        self.days: List[int] = [int(d) for d in item.get('days', [])]
+        self.amounts: List[int] = [int(a) for a in item.get('amounts', [])]
+        self.receipt_ids: List[str] = list(item.get('receipt_ids', []))
+        self.head = int(item.get('head', 0))
+        self.last_day: Optional[int] = int(item['last_day']) if 'last_day' in item else None
+        self.last_amount: Optional[int] = int(item['last_amount']) if 'last_amount' in item else None
+        self.intervals = int(item.get('intervals', 0))
+        self.period = Decimal(str(item.get('period', 0)))
+        self.period_dev = Decimal(str(item.get('period_dev', 0)))
+        self.recurring = bool(item.get('recurring', False))
+        self.version = int(item.get('version', 0))
+
+    def seen(self, receipt_id: str) -> bool:
+        return receipt_id in self.receipt_ids
+
+    def push(self, day: int, amount: int, receipt_id: str) -> None:
+        if len(self.days) < self.capacity:
+            self.days.append(day)
+            self.amounts.append(amount)
+            self.receipt_ids.append(receipt_id)
+        else:
+            self.days[self.head] = day
+            self.amounts[self.head] = amount
+            self.receipt_ids[self.head] = receipt_id
+        self.head = (self.head + 1) % self.capacity
+
+    def recent_amounts(self, n: int) -> List[int]:
+        """The last n amounts pushed, newest first."""
+        size = len(self.amounts)
+        return [self.amounts[(self.head - 1 - i) % size] for i in range(min(n, size))]
+
+    def observe(self, day: int, amount: int, receipt_id: str, merchant: str) -> List[AlertEvent]:
+        alerts: List[AlertEvent] = []
+        self.push(day, amount, receipt_id)
+
+        if self.last_day is None:
+            self.last_day, self.last_amount = day, amount
+            return alerts
+        if day < self.last_day:
+            # Receipt uploaded late; kept in history but the estimates only move forward
+            return alerts
+
+        gap = day - self.last_day
+        previous_amount = self.last_amount
+        self.last_day, self.last_amount = day, amount
+        if gap < MIN_PERIOD_DAYS:
+            return alerts
+
+        cycles = 1
+        if self.recurring and self.period > 0:
+            cycles = max(1, int((Decimal(gap) / self.period).to_integral_value()))
+            if cycles > 1 and abs(Decimal(gap) - cycles * self.period) <= self._slack():
+                alerts.append(AlertEvent(
+                    type="MISSED_CHARGE",
+                    message=(
+                        f"No {merchant} charge for {gap} days; expected one about every "
+                        f"{self.period:.0f} days ({cycles - 1} missed)"
+                    )
+                ))
+            else:
+                cycles = 1
+
+        self._update_period(Decimal(gap) / cycles)
+
+        was_recurring = self.recurring
+        self.recurring = self._looks_recurring()
+        if self.recurring and not was_recurring:
+            alerts.append(AlertEvent(
+                type="NEW_SUBSCRIPTION",
+                message=(
+                    f"{merchant} looks like a subscription: ${Decimal(amount) / 100:.2f} "
+                    f"about every {self.period:.0f} days"
+                )
+            ))
+        elif (
+            self.recurring and was_recurring and previous_amount
+            and amount > previous_amount * (1 + config.RECURRING_PRICE_INCREASE)
+        ):
+            alerts.append(AlertEvent(
+                type="PRICE_INCREASE",
+                message=(
+                    f"{merchant} charge went up from ${Decimal(previous_amount) / 100:.2f} "
+                    f"to ${Decimal(amount) / 100:.2f}"
+                )
+            ))
+        return alerts
+
+    def _slack(self) -> Decimal:
+        return max(self.period * PERIOD_TOLERANCE, 3 * self.period_dev, Decimal(2))
+
+    def _update_period(self, interval: Decimal) -> None:
+        if self.intervals == 0:
+            self.period, self.period_dev = interval, Decimal(0)
+        else:
+            self.period_dev = (1 - EWMA_ALPHA) * self.period_dev + EWMA_ALPHA * abs(interval - self.period)
+            self.period = (1 - EWMA_ALPHA) * self.period + EWMA_ALPHA * interval
+        self.intervals += 1
+
+    def _looks_recurring(self) -> bool:
+        if self.intervals < MIN_OCCURRENCES - 1:
+            return False
+        if not MIN_PERIOD_DAYS <= self.period <= MAX_PERIOD_DAYS:
+            return False
+        if self.period_dev > self.period * PERIOD_TOLERANCE:
+            return False
+        if self.recurring:
+            # Once established, a price change alone doesn't end the subscription
+            return True
+        recent = self.recent_amounts(MIN_OCCURRENCES)
+        return max(recent) - min(recent) <= max(recent) * AMOUNT_TOLERANCE
+
+    def to_item(self) -> Dict[str, Any]:
+        item = {
+            'days': self.days,
+            'amounts': self.amounts,
+            'receipt_ids': self.receipt_ids,
+            'head': self.head,
+            'intervals': self.intervals,
+            'period': _round(self.period),
+            'period_dev': _round(self.period_dev),
+            'recurring': self.recurring,
+        }
+        if self.last_day is not None:
+            item['last_day'] = self.last_day
+            item['last_amount'] = self.last_amount
+            if self.recurring:
+                item['next_expected'] = date.fromordinal(self.last_day + int(self.period)).isoformat()
+        return item
+
+
+def _round(value: Decimal) -> Decimal:
+    return value.quantize(Decimal("0.01"))
+
+
+def _charge_day(purchase_date: Optional[str]) -> int:
+    try:
+        return datetime.strptime(purchase_date or '', '%Y-%m-%d').date().toordinal()
+    except ValueError:
+        return date.today().toordinal()
+
+
+def merchant_key(merchant: str) -> str:
+    return f"{STAT_PREFIX}{merchant.strip().upper()}"
+
+
+def detect_recurring(parsed: ParsedReceipt) -> List[AlertEvent]:
+    """Record this receipt's charge and return any recurrence alerts (best effort)."""
+    if not config.RECURRING_ENABLED or not parsed.merchant or not parsed.total:
+        return []
+    amount = int((Decimal(str(parsed.total)) * 100).to_integral_value())
+    day = _charge_day(parsed.purchase_date)
+    key = {'user_id': parsed.user_id, 'stat_key': merchant_key(parsed.merchant)}
+    try:
+        with tracing.span("recurring"):
+            for _ in range(MAX_CONDITIONAL_RETRIES):
+                table = aggregates.stats_table
+                item = table.get_item(Key=key, ConsistentRead=True).get('Item')
+                history = ChargeHistory(item, config.RECURRING_HISTORY_SIZE)
+                if history.seen(parsed.job_id):
+                    # Re-processing must not count the same charge twice
+                    return []
+                alerts = history.observe(day, amount, parsed.job_id, parsed.merchant)
+                try:
+                    _save(table, key, history, parsed.merchant)
+                except ClientError as e:
+                    if e.response.get('Error', {}).get('Code') != 'ConditionalCheckFailedException':
+                        raise
+                    tracing.incr("recurring_conflicts")
+                    continue
+                if alerts:
+                    logger.debug("Recurring alerts for %s: %s", parsed.merchant, [a.type for a in alerts])
+                return alerts
+    except Exception as e:
+        tracing.incr("recurring_errors")
+        logger.warning("Recurring-charge detection failed for job %s: %s", parsed.job_id, e)
+    return []
+
+
+def _save(table, key: Dict[str, str], history: ChargeHistory, merchant: str) -> None:
+    state = dict(history.to_item(), merchant=merchant)
+    names = {f"#a{i}": name for i, name in enumerate(state)}
+    values = {f":a{i}": value for i, value in enumerate(state.values())}
+    values[':next'] = history.version + 1
+    if history.version:
+        condition = 'version = :prev'
+        values[':prev'] = history.version
+    else:
+        condition = 'attribute_not_exists(version)'
+    table.update_item(
+        Key=key,
+        UpdateExpression='SET ' + ', '.join(f"#a{i} = :a{i}" for i in range(len(state))) + ', version = :next',
+        ConditionExpression=condition,
+        ExpressionAttributeNames=names,
+        ExpressionAttributeValues=values
+    )
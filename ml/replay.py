@@ -0,0 +1,298 @@
+"""Replay recorded or synthetic receipt jobs through sqs_handler.handler locally.
+
+Usage:
+    python replay.py --input recordings/ --concurrency 8 \\
+        --latency rekognition=lognormal:400:0.5 --latency bedrock=lognormal:600:0.3 \\
+        --throttle bedrock=0.05 --output replay-report.json
+
+    python replay.py --synthetic 200 --concurrency 16
+
+    # Interactive jobs next to a 2,000-receipt bulk upload, per-lane latency in the report
+    python replay.py --synthetic 200 --bulk 2000 --concurrency 8 --bulk-concurrency 2 \
+        --rate-limit rekognition=20 --latency rekognition=lognormal:400:0.5
+    # ... and the same load on one shared queue, as before priority lanes
+    python replay.py --synthetic 200 --bulk 2000 --concurrency 10 --shared-queue ...
+
+``--input`` may contain raw Rekognition DetectText responses (``*.json`` with
+``TextDetections``), SQS events (``*.json`` with ``Records``) or receipt photos
+(run with ``PREPROCESS_ENABLED=true`` to exercise pre-processing). Every job runs
+through the real handler with the AWS clients replaced by standins.
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+os.environ.setdefault("METRICS_ENABLED", "false")
+# Synthetic jobs have no image to download; set to "true" when replaying photos
+os.environ.setdefault("PREPROCESS_ENABLED", "false")
+
+import standins  # noqa: E402
+import tracing  # noqa: E402
+
+REPLAY_USER = "replay-user"
+REPLAY_BULK_USER = "replay-bulk-user"
+QUEUE_ARNS = {
+    "interactive": "arn:aws:sqs:us-east-1:000000000000:receipt-processing-queue",
+    "bulk": "arn:aws:sqs:us-east-1:000000000000:receipt-processing-bulk-queue",
+}
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".heic", ".heif", ".webp")
+
+
+def load_records(input_dir: Optional[str], synthetic: int, aws: standins.AwsStandIns) -> List[Dict[str, Any]]:
+    """Build SQS records; recorded OCR output and photos are registered with the stand-ins."""
+    records: List[Dict[str, Any]] = []
+
+    if input_dir:
+        for name in sorted(os.listdir(input_dir)):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                job_id = os.path.splitext(name)[0]
+                s3_key = f"receipts/{REPLAY_USER}/{name}"
+                with open(os.path.join(input_dir, name), "rb") as f:
+                    aws.s3.objects[(standins.LOCAL_BUCKET, s3_key)] = {"Body": f.read(), "ContentType": None}
+                records.append(_record(job_id, s3_key))
+                continue
+            if not name.endswith(".json"):
+                continue
+            with open(os.path.join(input_dir, name)) as f:
+                data = json.load(f)
+            if "Records" in data:
+                records.extend(data["Records"])
+            elif "TextDetections" in data:
+                job_id = os.path.splitext(name)[0]
+                s3_key = f"receipts/{REPLAY_USER}/{job_id}.jpg"
+                aws.rekognition.add_response(s3_key, data)
+                records.append(_record(job_id, s3_key))
+
+    for _ in range(synthetic):
+        job_id = str(uuid.uuid4())
+        # Unregistered keys get a synthetic DetectText response
+        records.append(_record(job_id, f"receipts/{REPLAY_USER}/{job_id}.jpg"))
+
+    return records
+
+
+def bulk_records(count: int) -> List[Dict[str, Any]]:
+    """Synthetic jobs from one user's bulk upload, queued in the bulk lane."""
+    records = []
+    for _ in range(count):
+        job_id = str(uuid.uuid4())
+        s3_key = f"receipts/{REPLAY_BULK_USER}/{job_id}.jpg"
+        records.append(_record(job_id, s3_key, REPLAY_BULK_USER, "bulk", "bulk_upload"))
+    return records
+
+
+def _record(
+    job_id: str,
+    s3_key: str,
+    user_id: str = REPLAY_USER,
+    priority: str = "interactive",
+    origin: str = "upload"
+) -> Dict[str, Any]:
+    body = {"job_id": job_id, "user_id": user_id, "s3_key": s3_key, "priority": priority, "origin": origin}
+    return {
+        "messageId": job_id,
+        "receiptHandle": job_id,
+        "eventSourceARN": QUEUE_ARNS[priority],
+        "body": json.dumps(body),
+    }
+
+
+def _priority(record: Dict[str, Any]) -> str:
+    return json.loads(record["body"]).get("priority", "interactive")
+
+
+def replay(
+    records: List[Dict[str, Any]],
+    aws: standins.AwsStandIns,
+    concurrency: int,
+    visibility_timeout: float = 1.0,
+    max_receives: int = 5,
+    bulk_concurrency: int = 2,
+    shared_queue: bool = False
+) -> Dict[str, Any]:
+    """Run records through the handler. Interactive and bulk records get their
+    own worker pools (the per-queue consumer concurrency in template.yaml)
+    unless shared_queue, which runs everything from one pool, bulk first."""
+    import sqs_handler
+
+    traces: List[tracing.JobTrace] = []
+    traces_lock = threading.Lock()
+    in_flight = {"now": 0, "max": 0}
+    redeliveries = {"count": 0, "dead_lettered": 0}
+
+    def collect(trace: tracing.JobTrace) -> None:
+        with traces_lock:
+            traces.append(trace)
+
+    def run_one(record: Dict[str, Any]) -> None:
+        with traces_lock:
+            in_flight["now"] += 1
+            in_flight["max"] = max(in_flight["max"], in_flight["now"])
+        try:
+            # One record per invocation, matching BatchSize: 1 in template.yaml;
+            # batchItemFailures are redelivered like SQS would after the timeout
+            receive = 0
+            while True:
+                receive += 1
+                record["attributes"] = dict(sent, ApproximateReceiveCount=str(receive))
+                response = sqs_handler.handler({"Records": [record]}, None)
+                if not response.get("batchItemFailures"):
+                    return
+                # Deferred by the per-user cap: back after the visibility it set
+                deferred_for = aws.sqs.visibility.pop(record.get("receiptHandle"), None)
+                if deferred_for is None and receive >= max_receives:
+                    with traces_lock:
+                        redeliveries["dead_lettered"] += 1
+                    return
+                with traces_lock:
+                    redeliveries["count"] += 1
+                time.sleep(visibility_timeout if deferred_for is None else deferred_for)
+        finally:
+            with traces_lock:
+                in_flight["now"] -= 1
+
+    lanes: Dict[str, List[Dict[str, Any]]] = {"interactive": [], "bulk": []}
+    for record in records:
+        lanes[_priority(record)].append(record)
+
+    aws.install()
+    tracing.add_listener(collect)
+    sent = {"SentTimestamp": str(int(time.time() * 1000))}
+    started = time.perf_counter()
+    try:
+        if shared_queue:
+            with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                list(pool.map(run_one, lanes["bulk"] + lanes["interactive"]))
+        else:
+            with ThreadPoolExecutor(max_workers=concurrency) as interactive_pool, \
+                    ThreadPoolExecutor(max_workers=max(1, bulk_concurrency)) as bulk_pool:
+                futures = [interactive_pool.submit(run_one, r) for r in lanes["interactive"]]
+                futures += [bulk_pool.submit(run_one, r) for r in lanes["bulk"]]
+                for future in futures:
+                    future.result()
+    finally:
+        elapsed = time.perf_counter() - started
+        tracing.remove_listener(collect)
+        aws.uninstall()
+
+    stage_values: Dict[str, List[float]] = {}
+    counters: Dict[str, int] = {}
+    for trace in traces:
+        stage_values.setdefault("total", []).append(trace.total_ms)
+        for stage, ms in trace.stages.items():
+            stage_values.setdefault(stage, []).append(ms)
+        for name, value in trace.counters.items():
+            counters[name] = counters.get(name, 0) + value
+
+    failures = [t for t in traces if t.outcome == "Failure"]
+    throttled = [t for t in traces if t.outcome == "Throttled"]
+    deferred = [t for t in traces if t.outcome == "Deferred"]
+    lane_latency: Dict[str, Dict[str, Any]] = {}
+    for lane in lanes:
+        done = [t for t in traces if t.priority == lane and t.outcome == "Success"]
+        if done:
+            lane_latency[lane] = {
+                "queue": tracing.summarize([t.queue_ms or 0.0 for t in done]),
+                "processing": tracing.summarize([t.total_ms for t in done]),
+                "end_to_end": tracing.summarize([(t.queue_ms or 0.0) + t.total_ms for t in done]),
+            }
+    failed_stages: Dict[str, int] = {}
+    for trace in failures:
+        stage = trace.failed_stage or "unknown"
+        failed_stages[stage] = failed_stages.get(stage, 0) + 1
+
+    return {
+        "jobs": len(records),
+        "attempts": len(traces),
+        "succeeded": len(traces) - len(failures) - len(throttled) - len(deferred),
+        "failed": len(failures),
+        "throttled_attempts": len(throttled),
+        "deferred_attempts": len(deferred),
+        "redeliveries": redeliveries["count"],
+        "dead_lettered": redeliveries["dead_lettered"],
+        "failed_stages": failed_stages,
+        "concurrency": concurrency,
+        "bulk_concurrency": None if shared_queue else bulk_concurrency,
+        "max_jobs_in_flight": in_flight["max"],
+        "wall_time_s": round(elapsed, 3),
+        "throughput_jobs_per_s": round((len(traces) - len(failures) - len(throttled) - len(deferred)) / elapsed, 3) if elapsed > 0 else 0.0,
+        "lane_latency_ms": lane_latency,
+        "stage_latency_ms": {stage: tracing.summarize(values) for stage, values in sorted(stage_values.items())},
+        "counters": counters,
+        "services": aws.stats(),
+    }
+
+
+def _parse_service_options(values: List[str], cast) -> Dict[str, Any]:
+    parsed = {}
+    for value in values:
+        service, _, spec = value.partition("=")
+        if not spec:
+            raise SystemExit(f"Expected SERVICE=VALUE, got '{value}'")
+        parsed[service] = cast(spec)
+    return parsed
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--input", help="Directory of recorded Rekognition JSON or SQS events")
+    parser.add_argument("--synthetic", type=int, default=0, help="Number of synthetic jobs to add")
+    parser.add_argument("--concurrency", type=int, default=4, help="Concurrent handler invocations (interactive lane)")
+    parser.add_argument("--bulk", type=int, default=0, help="Synthetic bulk-upload jobs from one user (bulk lane)")
+    parser.add_argument("--bulk-concurrency", type=int, default=2, help="Concurrent handler invocations for the bulk lane")
+    parser.add_argument("--shared-queue", action="store_true",
+                        help="Run both lanes from one pool of --concurrency workers, bulk jobs first")
+    parser.add_argument("--latency", action="append", default=[], metavar="SERVICE=SPEC",
+                        help="e.g. rekognition=lognormal:400:0.5, s3=fixed:20, dynamodb=uniform:5:15")
+    parser.add_argument("--throttle", action="append", default=[], metavar="SERVICE=RATE",
+                        help="Fraction of calls that raise ThrottlingException, e.g. bedrock=0.05")
+    parser.add_argument("--rate-limit", action="append", default=[], metavar="SERVICE=TPS",
+                        help="Enable the shared token bucket, e.g. rekognition=20 bedrock=10")
+    parser.add_argument("--visibility-timeout", type=float, default=1.0,
+                        help="Seconds before a throttled message is redelivered")
+    parser.add_argument("--seed", type=int, default=None, help="Seed for latency and synthetic data")
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    args = parser.parse_args(argv)
+
+    if not args.input and args.synthetic <= 0 and args.bulk <= 0:
+        parser.error("provide --input, --synthetic and/or --bulk")
+
+    rng = random.Random(args.seed)
+    specs = _parse_service_options(args.latency, str)
+    throttles = _parse_service_options(args.throttle, float)
+    latencies = {
+        service: standins.LatencyModel.parse(specs.get(service, "fixed:0"), throttles.get(service, 0.0), rng)
+        for service in set(specs) | set(throttles)
+    }
+
+    rate_limits = _parse_service_options(args.rate_limit, float)
+    if rate_limits:
+        import config
+        config.RATE_LIMIT_TABLE = "local-rate-limits"
+        config.REKOGNITION_RATE_LIMIT = rate_limits.get("rekognition", 0.0)
+        config.BEDROCK_RATE_LIMIT = rate_limits.get("bedrock", 0.0)
+
+    aws = standins.AwsStandIns(latencies, seed=args.seed)
+    records = load_records(args.input, args.synthetic, aws) + bulk_records(args.bulk)
+    report = replay(records, aws, args.concurrency, args.visibility_timeout,
+                    bulk_concurrency=args.bulk_concurrency, shared_queue=args.shared_queue)
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    print(text)
+    return 0 if report["failed"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,335 @@
+"""Re-run archived OCR output through the current pipeline.
+
+Every processed receipt's DetectText response is archived at
+rekognition-output/<job_id>.json. When parse, categorize or anomaly logic
+changes, bump PIPELINE_VERSION (config.py) and run:
+
+    python reprocess.py --concurrency 8 --rate 20 --output reprocess-report.json
+    python reprocess.py --dry-run --limit 500     # compare only, no writes
+
+Archives are listed a page at a time (S3 returns keys in order). A receipt
+whose row already has pipeline_version >= PIPELINE_VERSION is skipped before
+its archive is read, so reruns only do what is left. Each page runs on a
+thread pool, job starts are spaced to at most --rate per second (Bedrock calls
+are also bounded by rate_limiter, charged to the bulk lane so interactive
+uploads keep their share), and once a page is finished its last key is
+saved to reprocess/v<N>/checkpoint.json in the output bucket. A restarted run
+continues after it; failed receipts are listed in the report and picked up
+by a run with --restart, which skips everything already current. Rows are
+written with a condition, so a receipt that was deleted or already
+reprocessed in the meantime is left alone.
+
+The report counts results per outcome and, for each compared field, how many
+receipts changed from the previous version, with a few examples. It is
+printed and saved next to the checkpoint.
+"""
+
+import argparse
+import json
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from botocore.exceptions import ClientError
+
+from config import get_logger
+import config
+import item_codec
+import ocr_rekognition
+import rate_limiter
+import recurring
+import sqs_handler
+import tracing
+
+logger = get_logger(__name__)
+
+PAGE_SIZE = 200
+MAX_SAMPLES = 20
+# Alerts that depend on processing history rather than the receipt itself;
+# they are carried over from the previous result instead of recomputed
+HISTORY_ALERT_TYPES = frozenset({"DUPLICATE_RECEIPT", *recurring.ALERT_TYPES})
+
+UPDATED = "updated"
+UNCHANGED = "unchanged"
+SKIPPED = "skipped"
+ORPHANED = "orphaned"
+FAILED = "failed"
+
+
+class Pacer:
+    """Spaces job starts at least 1/rate seconds apart across threads (rate <= 0: no limit)."""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self) -> None:
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
+def checkpoint_key(version: int) -> str:
+    return f"reprocess/v{version}/checkpoint.json"
+
+
+def report_key(version: int) -> str:
+    return f"reprocess/v{version}/report.json"
+
+
+def _load_json(bucket: str, key: str) -> Optional[Dict[str, Any]]:
+    try:
+        response = ocr_rekognition.s3_client.get_object(Bucket=bucket, Key=key)
+    except ClientError as e:
+        if e.response.get('Error', {}).get('Code') in ('NoSuchKey', '404'):
+            return None
+        raise
+    return json.loads(response['Body'].read())
+
+
+def _save_json(bucket: str, key: str, data: Dict[str, Any]) -> None:
+    ocr_rekognition.s3_client.put_object(
+        Bucket=bucket,
+        Key=key,
+        Body=json.dumps(data, indent=2, default=str),
+        ContentType='application/json'
+    )
+
+
+def list_archive_pages(bucket: str, prefix: str, start_after: Optional[str]) -> Iterator[Tuple[List[str], str]]:
+    """Yield (archive keys, last listed key) per page, starting after start_after."""
+    token = None
+    while True:
+        kwargs = {'Bucket': bucket, 'Prefix': prefix, 'MaxKeys': PAGE_SIZE}
+        if token:
+            kwargs['ContinuationToken'] = token
+        elif start_after:
+            kwargs['StartAfter'] = start_after
+        response = ocr_rekognition.s3_client.list_objects_v2(**kwargs)
+        contents = response.get('Contents', [])
+        if contents:
+            yield [o['Key'] for o in contents if o['Key'].endswith('.json')], contents[-1]['Key']
+        if not response.get('IsTruncated'):
+            return
+        token = response['NextContinuationToken']
+
+
+def job_id_from_key(key: str) -> str:
+    return key.rsplit('/', 1)[-1][:-len('.json')]
+
+
+def find_owner(job_id: str) -> Optional[str]:
+    response = sqs_handler.table.query(
+        IndexName=config.RECEIPT_ID_INDEX,
+        KeyConditionExpression='receipt_id = :rid',
+        ExpressionAttributeValues={':rid': job_id},
+        Limit=1
+    )
+    items = response.get('Items', [])
+    return items[0]['user_id'] if items else None
+
+
+def _amount(value: Any) -> Optional[str]:
+    if value is None or value == '':
+        return None
+    try:
+        return str(Decimal(str(value)).quantize(Decimal('0.01')))
+    except InvalidOperation:
+        return str(value)
+
+
+def summarize_row(row: Dict[str, Any]) -> Dict[str, Any]:
+    """The compared fields of a stored receipt row."""
+    return {
+        'merchant': row.get('merchant'),
+        'purchase_date': row.get('purchase_date'),
+        'subtotal': _amount(row.get('subtotal')),
+        'tax': _amount(row.get('tax')),
+        'total': _amount(row.get('total')),
+        'category': row.get('category'),
+        'alerts': sorted(a.get('type') for a in row.get('alerts') or []),
+        'items': len(item_codec.line_items(row)),
+    }
+
+
+def summarize_result(result: Dict[str, Any]) -> Dict[str, Any]:
+    """The same fields for a fresh result, as update_dynamodb would store them."""
+    parsed = result['parsed_receipt']
+    items = parsed.get('items') or []
+    return {
+        'merchant': parsed.get('merchant') or 'Unknown',
+        'purchase_date': parsed.get('purchase_date'),
+        'subtotal': _amount(parsed.get('subtotal')),
+        'tax': _amount(parsed.get('tax')),
+        'total': _amount(parsed.get('total')),
+        'category': items[0].get('category', 'Other') if items else 'Other',
+        'alerts': sorted(a['type'] for a in result['alerts']),
+        'items': len(items),
+    }
+
+
+def compare(old: Dict[str, Any], new: Dict[str, Any]) -> Dict[str, List[Any]]:
+    return {field: [old[field], new[field]] for field in old if old[field] != new[field]}
+
+
+def reprocess_one(key: str, bucket: str, target_version: int, pacer: Pacer, dry_run: bool) -> Tuple[str, str, Dict[str, List[Any]]]:
+    """Returns (outcome, job_id, changed fields)."""
+    job_id = job_id_from_key(key)
+    user_id = find_owner(job_id)
+    row = None
+    if user_id:
+        row = sqs_handler.table.get_item(
+            Key={'user_id': user_id, 'receipt_id': job_id},
+            ConsistentRead=True
+        ).get('Item')
+    if row is None:
+        # Receipt deleted since its OCR was archived
+        return ORPHANED, job_id, {}
+    if int(row.get('pipeline_version', 0)) >= target_version:
+        return SKIPPED, job_id, {}
+
+    pacer.wait()
+    rekognition_response = _load_json(bucket, key)
+    if rekognition_response is None:
+        return ORPHANED, job_id, {}
+    result = sqs_handler.analyze_receipt(job_id, user_id, rekognition_response, key, reprocessing=True)
+    result['alerts'] += [a for a in row.get('alerts') or [] if a.get('type') in HISTORY_ALERT_TYPES]
+    changes = compare(summarize_row(row), summarize_result(result))
+
+    if not dry_run:
+        try:
+            sqs_handler.update_dynamodb(user_id, job_id, result, reprocessing=True)
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') != 'ConditionalCheckFailedException':
+                raise
+            return SKIPPED, job_id, {}
+    return (UPDATED if changes else UNCHANGED), job_id, changes
+
+
+class Report:
+
+    def __init__(self, target_version: int, dry_run: bool, state: Optional[Dict[str, Any]] = None):
+        state = state or {}
+        self.target_version = target_version
+        self.dry_run = dry_run
+        self.outcomes: Dict[str, int] = dict(state.get('outcomes', {}))
+        self.changed_fields: Dict[str, int] = dict(state.get('changed_fields', {}))
+        self.samples: List[Dict[str, Any]] = list(state.get('samples', []))
+        self.errors: List[Dict[str, str]] = list(state.get('errors', []))
+        self.started_at = state.get('started_at') or datetime.utcnow().isoformat()
+        self._lock = threading.Lock()
+
+    def add(self, outcome: str, job_id: str, changes: Dict[str, List[Any]], error: Optional[str] = None) -> None:
+        with self._lock:
+            self.outcomes[outcome] = self.outcomes.get(outcome, 0) + 1
+            for field in changes:
+                self.changed_fields[field] = self.changed_fields.get(field, 0) + 1
+            if changes and len(self.samples) < MAX_SAMPLES:
+                self.samples.append({'job_id': job_id, 'changes': changes})
+            if error and len(self.errors) < MAX_SAMPLES:
+                self.errors.append({'job_id': job_id, 'error': error})
+
+    @property
+    def processed(self) -> int:
+        return sum(self.outcomes.values())
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'pipeline_version': self.target_version,
+                'dry_run': self.dry_run,
+                'started_at': self.started_at,
+                'processed': sum(self.outcomes.values()),
+                'outcomes': dict(sorted(self.outcomes.items())),
+                'changed_fields': dict(sorted(self.changed_fields.items())),
+                'samples': list(self.samples),
+                'errors': list(self.errors),
+            }
+
+
+def run(
+    concurrency: int = 8,
+    rate: float = 10.0,
+    limit: Optional[int] = None,
+    dry_run: bool = False,
+    restart: bool = False,
+    bucket: Optional[str] = None,
+    prefix: Optional[str] = None
+) -> Dict[str, Any]:
+    """Reprocess archives up to PIPELINE_VERSION; returns the report."""
+    bucket = bucket or sqs_handler.S3_BUCKET_OUTPUT
+    prefix = prefix or config.REPROCESS_PREFIX
+    version = config.PIPELINE_VERSION
+    # Dry runs neither resume from nor move the real checkpoint
+    checkpoint = None if restart or dry_run else _load_json(bucket, checkpoint_key(version))
+    report = Report(version, dry_run, checkpoint)
+    start_after = (checkpoint or {}).get('start_after')
+    if start_after:
+        logger.info("Resuming v%d reprocessing after %s (%d done)", version, start_after, report.processed)
+
+    pacer = Pacer(rate)
+
+    def process(key: str) -> None:
+        try:
+            with rate_limiter.lane(config.LANE_BULK):
+                report.add(*reprocess_one(key, bucket, version, pacer, dry_run))
+        except Exception as e:
+            logger.warning("Reprocessing %s failed: %s", key, e)
+            report.add(FAILED, job_id_from_key(key), {}, str(e))
+
+    done = 0
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for keys, last_key in list_archive_pages(bucket, prefix, start_after):
+            if limit is not None:
+                keys = keys[:limit - done]
+                if len(keys) < PAGE_SIZE:
+                    last_key = keys[-1] if keys else start_after
+            with tracing.span("reprocess_page"):
+                list(pool.map(process, keys))
+            done += len(keys)
+            start_after = last_key
+            if not dry_run:
+                _save_json(bucket, checkpoint_key(version), dict(report.to_dict(), start_after=last_key))
+            logger.info("Reprocessed through %s: %s", last_key, dict(report.outcomes))
+            if limit is not None and done >= limit:
+                break
+
+    result = dict(report.to_dict(), finished_at=datetime.utcnow().isoformat())
+    if not dry_run:
+        _save_json(bucket, report_key(version), result)
+    return result
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=8, help="Receipts processed in parallel")
+    parser.add_argument("--rate", type=float, default=10.0, help="Maximum receipts started per second (0 = no limit)")
+    parser.add_argument("--limit", type=int, default=None, help="Stop after this many archives")
+    parser.add_argument("--dry-run", action="store_true", help="Compare results without writing rows or the checkpoint")
+    parser.add_argument("--restart", action="store_true", help="Ignore the saved checkpoint")
+    parser.add_argument("--bucket", help="Bucket holding the archives (default: S3_BUCKET_OUTPUT)")
+    parser.add_argument("--prefix", help="Archive prefix (default: REPROCESS_PREFIX)")
+    parser.add_argument("--output", help="Also write the JSON report to this file")
+    args = parser.parse_args(argv)
+
+    report = run(args.concurrency, args.rate, args.limit, args.dry_run, args.restart, args.bucket, args.prefix)
+    text = json.dumps(report, indent=2, default=str)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    print(text)
+    return 0 if not report['outcomes'].get(FAILED) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,6 +1,6 @@
 
 
-from typing import Optional
+from typing import Literal, Optional
 from pydantic import BaseModel, Field
 
 class ReceiptItem(BaseModel):
@@ -19,6 +19,7 @@ class ParsedReceipt(BaseModel):
     job_id: str = Field(..., description="Unique job identifier")
     user_id: str = Field(..., description="User who uploaded the receipt")
     merchant: Optional[str] = Field(None, description="Merchant/store name")
+    merchant_raw: Optional[str] = Field(None, description="Merchant line as OCR'd, before canonicalization")
     purchase_date: Optional[str] = Field(None, description="Purchase date (ISO format)")
     subtotal: Optional[float] = Field(None, description="Subtotal amount")
     tax: Optional[float] = Field(None, description="Tax amount")
@@ -40,8 +41,11 @@ class MLResult(BaseModel):
     alerts: list[AlertEvent] = Field(default_factory=list, description="List of alerts/anomalies detected")
 
 class ReceiptJobEvent(BaseModel):
-    """Lambda input event schema."""
+    """SQS job message body."""
     
     job_id: str = Field(..., description="Unique job identifier")
     user_id: str = Field(..., description="User who uploaded the receipt")
     s3_key: str = Field(..., description="S3 key for the uploaded receipt image")
+    batch_id: Optional[str] = Field(None, description="Bulk upload the receipt belongs to")
+    priority: Literal["interactive", "bulk"] = Field("interactive", description="Lane the job was queued in")
+    origin: Optional[str] = Field(None, description="What queued the job (upload, direct_upload, s3_event, bulk_upload, ...)")
@@ -0,0 +1,155 @@
+"""Per-user inverted index over merchant names and line item descriptions.
+
+One item per (user_id, token) in the search table holds that token's posting
+list: a binary set of receipt ids, 16 bytes each for UUIDs. After a receipt
+is parsed the worker diffs its tokens against the previous result and only
+touches tokens that changed (set ADD / DELETE), so indexing cost does not
+grow with the user's history. The API answers queries from the same table:
+exact terms with BatchGetItem, `term*` prefixes with begins_with, and AND by
+intersecting posting lists.
+"""
+
+import re
+import threading
+import unicodedata
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+import boto3
+
+from config import get_logger
+import config
+import item_codec
+import tracing
+
+logger = get_logger(__name__)
+
+MIN_TOKEN_LENGTH = 2
+MAX_TOKEN_LENGTH = 40
+STOPWORDS = frozenset({'and', 'the', 'for', 'with', 'of', 'to', 'in', 'on', 'at', 'by', 'an'})
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def normalize(text: str) -> str:
+    """Lowercase and strip accents (café -> cafe)."""
+    decomposed = unicodedata.normalize('NFKD', text)
+    return decomposed.encode('ascii', 'ignore').decode('ascii').lower()
+
+
+def tokenize(text: Optional[str]) -> Set[str]:
+    if not text:
+        return set()
+    return {
+        token[:MAX_TOKEN_LENGTH]
+        for token in _TOKEN_RE.findall(normalize(text))
+        if len(token) >= MIN_TOKEN_LENGTH and not token.isdigit() and token not in STOPWORDS
+    }
+
+
+def receipt_tokens(receipt: Optional[Dict[str, Any]]) -> Set[str]:
+    """Tokens for a receipt row or parsed result (merchant + item descriptions)."""
+    if not receipt:
+        return set()
+    tokens = tokenize(receipt.get('merchant'))
+    for item in receipt.get('items') or item_codec.line_items(receipt):
+        if isinstance(item, dict):
+            tokens |= tokenize(item.get('description'))
+    return tokens
+
+
+def encode_posting(receipt_id: str) -> bytes:
+    """16 raw bytes for a UUID; anything else is tagged with a leading NUL."""
+    try:
+        return uuid.UUID(receipt_id).bytes
+    except ValueError:
+        return b'\x00' + receipt_id.encode('utf-8')
+
+
+def decode_posting(value: Any) -> str:
+    raw = bytes(getattr(value, 'value', value))
+    if len(raw) == 16:
+        return str(uuid.UUID(bytes=raw))
+    return raw[1:].decode('utf-8')
+
+
+class SearchIndex:
+
+    def __init__(self, table, max_workers: int = 8):
+        self.table = table
+        self.max_workers = max_workers
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def update(self, user_id: str, receipt_id: str, old_tokens: Iterable[str], new_tokens: Iterable[str]) -> int:
+        """Move a receipt's postings from old_tokens to new_tokens; returns items written."""
+        old_tokens, new_tokens = set(old_tokens), set(new_tokens)
+        posting = {encode_posting(receipt_id)}
+        changes = [(token, 'ADD') for token in new_tokens - old_tokens]
+        changes += [(token, 'DELETE') for token in old_tokens - new_tokens]
+        if not changes:
+            return 0
+
+        def apply(change):
+            token, action = change
+            self.table.update_item(
+                Key={'user_id': user_id, 'token': token},
+                UpdateExpression=f"{action} receipt_ids :ids",
+                ExpressionAttributeValues={':ids': posting}
+            )
+
+        if len(changes) == 1 or self.max_workers <= 1:
+            for change in changes:
+                apply(change)
+        else:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers)
+            list(self._executor.map(apply, changes))
+        return len(changes)
+
+
+index: Optional[SearchIndex] = None
+_index_lock = threading.Lock()
+
+
+def _get_index() -> Optional[SearchIndex]:
+    global index
+    if index is None and config.SEARCH_TABLE:
+        with _index_lock:
+            if index is None:
+                table = boto3.resource('dynamodb', region_name=config.AWS_REGION).Table(config.SEARCH_TABLE)
+                index = SearchIndex(table, config.SEARCH_INDEX_WORKERS)
+    return index
+
+
+def index_receipt(user_id: str, receipt_id: str, old: Optional[Dict[str, Any]], new: Optional[Dict[str, Any]]) -> None:
+    """Best effort: a failed index update must not fail the receipt (re-processing repairs it)."""
+    target = _get_index()
+    if target is None:
+        return
+    try:
+        with tracing.span("search_index"):
+            written = target.update(user_id, receipt_id, receipt_tokens(old), receipt_tokens(new))
+        tracing.incr("search_index_writes", written)
+    except Exception as e:
+        tracing.incr("search_index_errors")
+        logger.warning("Failed to index receipt %s: %s", receipt_id, e)
+
+
+def search(table, user_id: str, terms: List[str]) -> List[str]:
+    """Receipt ids matching every term (`term*` = prefix); used by tests and replay."""
+    postings = []
+    for term in terms:
+        prefix = term.endswith('*')
+        normalized = normalize(term.rstrip('*'))
+        response = table.query(
+            KeyConditionExpression='user_id = :uid AND begins_with(#t, :t)' if prefix else 'user_id = :uid AND #t = :t',
+            ExpressionAttributeNames={'#t': 'token'},
+            ExpressionAttributeValues={':uid': user_id, ':t': normalized}
+        )
+        ids = set()
+        for item in response.get('Items', []):
+            ids.update(decode_posting(v) for v in item.get('receipt_ids', ()))
+        postings.append(ids)
+    if not postings:
+        return []
+    return sorted(set.intersection(*sorted(postings, key=len)))
@@ -1,8 +1,10 @@
 import json
+import math
 import os
-import traceback
+import random
 import boto3
-from typing import Any, Dict
+from botocore.exceptions import ClientError
+from typing import Any, Dict, Optional
 from datetime import datetime
 from decimal import Decimal
 
@@ -10,8 +12,18 @@ from decimal import Decimal
 import parse_rekognition
 import ocr_rekognition
 import categorize
+import item_codec
 import anomalies
+import aggregates
 import config
+import preprocess
+import rate_limiter
+import recurring
+import search_index
+import tiled_ocr
+import job_status
+import tracing
+from schemas import ReceiptJobEvent
 
 logger = config.get_logger(__name__)
 
@@ -29,6 +41,7 @@ def convert_floats_to_decimal(obj):
 # AWS clients
 dynamodb = boto3.resource('dynamodb')
 sns_client = boto3.client('sns')
+sqs_client = boto3.client('sqs')
 DYNAMODB_TABLE = os.environ.get('DYNAMODB_TABLE', 'ReceiptMetadata')
 table = dynamodb.Table(DYNAMODB_TABLE)
 ANOMALY_TOPIC_ARN = os.environ.get('ANOMALY_TOPIC_ARN', '')
@@ -38,35 +51,79 @@ S3_BUCKET_OUTPUT = os.environ.get('S3_BUCKET_OUTPUT', S3_BUCKET_RECEIPTS)
 
 
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
-    logger.info(f"Received SQS event with {len(event.get('Records', []))} messages")
+    logger.debug("Received SQS event with %d messages", len(event.get('Records', [])))
+    
+    # Messages to leave on the queue (needs ReportBatchItemFailures)
+    batch_item_failures = []
+    throttled = False
     
     # Process each SQS message
     for record in event.get('Records', []):
+        if throttled:
+            # Quota is exhausted; don't start more work from this batch
+            batch_item_failures.append({"itemIdentifier": record['messageId']})
+            continue
+        
+        # Cleared per message so a failure never touches the previous receipt
+        job_id = user_id = batch_id = None
+        trace = tracing.begin_job()
         try:
             # Parse SQS message body
             message_body = json.loads(record['body'])
-            logger.info(f"Processing message: {message_body}")
+            logger.debug("Processing message: %s", record['body'])
+            job = ReceiptJobEvent(**message_body)
+            
+            job_id = job.job_id
+            user_id = job.user_id
+            s3_key = job.s3_key
+            batch_id = job.batch_id
+            trace.identify(job_id, user_id)
+            trace.queued(job.priority, int(record.get('attributes', {}).get('SentTimestamp', 0)))
+            tracing.annotate(s3_key=s3_key, batch_id=batch_id, origin=job.origin)
             
-            job_id = message_body['job_id']
-            user_id = message_body['user_id']
-            s3_key = message_body['s3_key']
+            if job.priority == config.LANE_BULK:
+                # Per-user cap: another user's bulk jobs go first while this one waits
+                wait = user_bulk_wait(user_id)
+                if wait > 0:
+                    trace.outcome = "Deferred"
+                    defer_message(record, wait)
+                    batch_item_failures.append({"itemIdentifier": record['messageId']})
+                    continue
             
-            # Process the receipt
-            result = process_receipt(job_id, user_id, s3_key)
+            with tracing.profiled(job_id), rate_limiter.lane(job.priority):
+                # Process the receipt
+                result = process_receipt(job_id, user_id, s3_key)
+                
+                # Update DynamoDB with results
+                with tracing.span("dynamodb_write"):
+                    update_dynamodb(user_id, job_id, result, batch_id)
             
-            # Update DynamoDB with results
-            update_dynamodb(user_id, job_id, result)
+            parsed = result['parsed_receipt']
+            job_status.publish(
+                user_id, job_id, job_status.COMPLETED,
+                merchant=parsed.get('merchant'),
+                total=str(parsed.get('total') or ''),
+                alerts=len(result['alerts'])
+            )
             
-            logger.info(f"Successfully processed job {job_id}")
+            logger.debug("Successfully processed job %s", job_id)
+            
+        except rate_limiter.RateLimitExceeded as e:
+            # Back-pressure: the message becomes visible again after the
+            # visibility timeout instead of being marked FAILED
+            trace.outcome = "Throttled"
+            throttled = True
+            logger.warning("Rate limited, returning message to queue: %s", e)
+            batch_item_failures.append({"itemIdentifier": record['messageId']})
             
         except Exception as e:
-            logger.error(f"Error processing SQS message: {str(e)}")
-            logger.error(traceback.format_exc())
+            trace.outcome = "Failure"
+            logger.error("Error processing SQS message: %s", e, exc_info=True)
             
             # Try to update DynamoDB with error status
             try:
-                if 'job_id' in locals() and 'user_id' in locals():
-                    table.update_item(
+                if job_id is not None and user_id is not None:
+                    response = table.update_item(
                         Key={'user_id': user_id, 'receipt_id': job_id},
                         UpdateExpression='SET #status = :status, #error = :error',
                         ExpressionAttributeNames={
@@ -76,48 +133,132 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                         ExpressionAttributeValues={
                             ':status': 'FAILED',
                             ':error': str(e)
-                        }
+                        },
+                        ReturnValues='ALL_OLD'
                     )
+                    update_aggregates(user_id, response.get('Attributes'), {
+                        'status': 'FAILED',
+                        'batch_id': batch_id
+                    })
+                    job_status.publish(user_id, job_id, job_status.FAILED, error=str(e))
             except Exception as db_error:
-                logger.error(f"Failed to update DynamoDB with error: {db_error}")
+                logger.error("Failed to update DynamoDB with error: %s", db_error)
+        finally:
+            tracing.end_job(trace)
     
-    return {"statusCode": 200, "body": "Processing complete"}
+    # Logging is asynchronous; write everything before Lambda freezes the container
+    config.flush_logs()
+    return {
+        "statusCode": 200,
+        "body": "Processing complete",
+        "batchItemFailures": batch_item_failures
+    }
+
+
+def user_bulk_wait(user_id: str) -> float:
+    """Seconds until the user may start another bulk job (0 = start now).
+    
+    Fails open: if the cap can't be checked the job runs.
+    """
+    try:
+        bucket = rate_limiter.user_bucket(user_id)
+        return bucket.try_acquire() if bucket else 0.0
+    except Exception as e:
+        tracing.incr("fairness_errors")
+        logger.warning("Per-user bulk cap check failed for %s: %s", user_id, e)
+        return 0.0
+
+
+def defer_message(record: Dict[str, Any], wait: float) -> None:
+    """Return a message to its queue after about `wait` seconds (backing off
+    as it keeps getting deferred) rather than the full visibility timeout."""
+    receives = int(record.get('attributes', {}).get('ApproximateReceiveCount', 1))
+    delay = min(config.BULK_DEFER_MAX_SECONDS, math.ceil(wait) * 2 ** min(receives - 1, 6))
+    # Jitter so a user's deferred jobs don't all come back together
+    delay = random.randint(max(1, delay // 2), max(1, delay))
+    arn = record.get('eventSourceARN', '')
+    if not record.get('receiptHandle') or arn.count(':') != 5:
+        return
+    _, _, _, region, account, queue_name = arn.split(':')
+    try:
+        sqs_client.change_message_visibility(
+            QueueUrl=f"https://sqs.{region}.amazonaws.com/{account}/{queue_name}",
+            ReceiptHandle=record['receiptHandle'],
+            VisibilityTimeout=delay
+        )
+    except Exception as e:
+        # The message still comes back, just after the queue's visibility timeout
+        logger.warning("Could not shorten visibility of deferred message: %s", e)
 
 
 def process_receipt(job_id: str, user_id: str, s3_key: str) -> Dict[str, Any]:
-    logger.info(f"Processing receipt: job_id={job_id}, s3_key={s3_key}")
+    logger.debug("Processing receipt: job_id=%s, s3_key=%s", job_id, s3_key)
     
     # Step 1: Run Rekognition OCR
-    logger.info(f"Running Rekognition on s3://{S3_BUCKET_RECEIPTS}/{s3_key}")
-    rekognition_response = ocr_rekognition.run_rekognition_on_s3_object(
-        bucket=S3_BUCKET_RECEIPTS,
-        key=s3_key
-    )
+    logger.debug("Running Rekognition on s3://%s/%s", S3_BUCKET_RECEIPTS, s3_key)
+    prepared = load_preprocessed_image(s3_key)
+    with tracing.span("ocr"):
+        if prepared is not None and tiled_ocr.is_tall(prepared.width, prepared.height):
+            rekognition_response = tiled_ocr.run_tiled_ocr(prepared.image_bytes)
+        elif prepared is not None:
+            rekognition_response = ocr_rekognition.run_rekognition_on_bytes(prepared.image_bytes)
+        else:
+            rekognition_response = ocr_rekognition.run_rekognition_on_s3_object(
+                bucket=S3_BUCKET_RECEIPTS,
+                key=s3_key
+            )
+    job_status.publish(user_id, job_id, job_status.OCR_DONE)
     
     # Step 2: Save raw output (optional, for debugging)
     rekognition_output_key = f"rekognition-output/{job_id}.json"
-    ocr_rekognition.save_rekognition_output_to_s3(
-        rekognition_response=rekognition_response,
-        output_bucket=S3_BUCKET_OUTPUT,
-        output_key=rekognition_output_key
-    )
+    with tracing.span("s3_archive"):
+        ocr_rekognition.save_rekognition_output_to_s3(
+            rekognition_response=rekognition_response,
+            output_bucket=S3_BUCKET_OUTPUT,
+            output_key=rekognition_output_key
+        )
     
+    return analyze_receipt(job_id, user_id, rekognition_response, rekognition_output_key)
+
+
+def analyze_receipt(
+    job_id: str,
+    user_id: str,
+    rekognition_response: Dict[str, Any],
+    rekognition_output_key: str,
+    reprocessing: bool = False
+) -> Dict[str, Any]:
+    """Parse, categorize and check an OCR result.
+
+    reprocess.py calls this on archived output with reprocessing=True: no
+    status events or SNS, and no duplicate/recurring checks, whose answers
+    depend on processing order (it keeps the row's earlier alerts instead).
+    """
     # Step 3: Parse Rekognition response
-    logger.info("Parsing Rekognition response")
-    parsed_receipt = parse_rekognition.parse_rekognition_response(
-        job_id=job_id,
-        user_id=user_id,
-        rekognition_response=rekognition_response,
-        rekognition_s3_key=rekognition_output_key
-    )
+    logger.debug("Parsing Rekognition response")
+    with tracing.span("parse"):
+        parsed_receipt = parse_rekognition.parse_rekognition_response(
+            job_id=job_id,
+            user_id=user_id,
+            rekognition_response=rekognition_response,
+            rekognition_s3_key=rekognition_output_key
+        )
     
     # Step 4: Categorize with Bedrock
-    logger.info("Running categorization")
-    parsed_receipt = categorize.categorize_parsed_receipt(parsed_receipt, use_ml=True)
+    logger.debug("Running categorization")
+    with tracing.span("categorize"):
+        parsed_receipt = categorize.categorize_parsed_receipt(parsed_receipt, use_ml=True)
+    if not reprocessing:
+        job_status.publish(user_id, job_id, job_status.CATEGORIZED)
     
     # Step 5: Detect anomalies
-    logger.info("Running anomaly detection")
-    alerts = anomalies.detect_anomalies(parsed_receipt)
+    logger.debug("Running anomaly detection")
+    with tracing.span("anomalies"):
+        alerts = anomalies.detect_anomalies(parsed_receipt, check_duplicates=not reprocessing)
+    
+    # Step 5b: Subscriptions, missed charges and price increases
+    if not reprocessing:
+        alerts += recurring.detect_recurring(parsed_receipt)
     
     # Package results
     result = {
@@ -125,16 +266,47 @@ def process_receipt(job_id: str, user_id: str, s3_key: str) -> Dict[str, Any]:
         "alerts": [alert.model_dump() for alert in alerts]
     }
     
-    logger.info(f"Processing complete: {len(parsed_receipt.items)} items, {len(alerts)} alerts")
+    tracing.annotate(
+        merchant=parsed_receipt.merchant,
+        purchase_date=parsed_receipt.purchase_date,
+        total=parsed_receipt.total,
+        items=len(parsed_receipt.items),
+        category=parsed_receipt.items[0].category if parsed_receipt.items else None,
+        alerts=[alert.type for alert in alerts]
+    )
     
     # Send SNS notification if anomalies detected
-    if alerts and ANOMALY_TOPIC_ARN:
-        send_anomaly_notification(job_id, parsed_receipt, alerts)
+    if not reprocessing and alerts and ANOMALY_TOPIC_ARN:
+        with tracing.span("sns"):
+            send_anomaly_notification(job_id, parsed_receipt, alerts)
     
     return result
 
 
-def update_dynamodb(user_id: str, job_id: str, result: Dict[str, Any]):
+def load_preprocessed_image(s3_key: str) -> Optional[preprocess.PreprocessResult]:
+    """Download and shrink the upload; None means OCR the original S3 object."""
+    if not config.PREPROCESS_ENABLED or not preprocess.is_available():
+        return None
+    try:
+        with tracing.span("s3_download"):
+            original = ocr_rekognition.download_image(S3_BUCKET_RECEIPTS, s3_key)
+        with tracing.span("preprocess"):
+            result = preprocess.preprocess_image(original)
+        tracing.incr("preprocess_bytes_saved", result.bytes_saved)
+        return result
+    except Exception as e:
+        logger.warning("Pre-processing failed for %s, using original image: %s", s3_key, e)
+        return None
+
+
+def update_dynamodb(
+    user_id: str,
+    job_id: str,
+    result: Dict[str, Any],
+    batch_id: Optional[str] = None,
+    reprocessing: bool = False
+):
+    """Write a result; with reprocessing=True only an existing row from an older pipeline is replaced."""
     parsed = result['parsed_receipt']
     alerts = result['alerts']
     
@@ -143,6 +315,7 @@ def update_dynamodb(user_id: str, job_id: str, result: Dict[str, Any]):
         SET #status = :status,
             merchant = :merchant,
             merchant_name = :merchant_name,
+            merchant_raw = :merchant_raw,
             purchase_date = :date,
             subtotal = :subtotal,
             tax = :tax,
@@ -153,8 +326,15 @@ def update_dynamodb(user_id: str, job_id: str, result: Dict[str, Any]):
             category_confidence = :confidence,
             categorization_method = :method,
             alerts = :alerts,
-            processed_at = :processed_at
+            processed_at = :processed_at,
+            pipeline_version = :pipeline_version
     """
+    # Items go in one compressed columnar attribute; drop the older list form
+    encoded_items = item_codec.encode(parsed.get('items'))
+    if encoded_items:
+        update_expr += ", line_items_z = :line_items_z REMOVE line_items"
+    else:
+        update_expr += " REMOVE line_items, line_items_z"
     
     # Get category info from first item (all items have same category)
     category = "Other"
@@ -170,7 +350,7 @@ def update_dynamodb(user_id: str, job_id: str, result: Dict[str, Any]):
     categorization_method = "ML (Bedrock/Claude)" if category_confidence > 0.85 else "Rule-based"
     
     try:
-        table.update_item(
+        response = table.update_item(
             Key={
                 'user_id': user_id,
                 'receipt_id': job_id
@@ -184,6 +364,8 @@ def update_dynamodb(user_id: str, job_id: str, result: Dict[str, Any]):
                 ':status': 'COMPLETED',
                 ':merchant': parsed.get('merchant') or 'Unknown',
                 ':merchant_name': parsed.get('merchant') or 'Unknown',
+                # Kept so a wrong canonical match can be spotted and redone
+                ':merchant_raw': parsed.get('merchant_raw'),
                 ':date': parsed.get('purchase_date'),
                 ':subtotal': convert_floats_to_decimal(parsed.get('subtotal')),
                 ':tax': convert_floats_to_decimal(parsed.get('tax')),
@@ -194,13 +376,51 @@ def update_dynamodb(user_id: str, job_id: str, result: Dict[str, Any]):
                 ':method': categorization_method,
                 ':alerts': convert_floats_to_decimal(alerts),
                 ':processed_at': datetime.utcnow().isoformat(),
-                ':amount': str(parsed.get('total') or '0.00')
-            }
+                ':amount': str(parsed.get('total') or '0.00'),
+                ':pipeline_version': config.PIPELINE_VERSION,
+                **({':line_items_z': encoded_items} if encoded_items else {})
+            },
+            # Previous result, so re-processing replaces its rollup contribution
+            ReturnValues='UPDATED_OLD',
+            **({'ConditionExpression': (
+                # AND binds tighter than OR; a stored pipeline_version implies the row exists
+                'attribute_exists(receipt_id) AND attribute_not_exists(pipeline_version) '
+                'OR pipeline_version < :pipeline_version'
+            )} if reprocessing else {})
         )
-        logger.info(f"Updated DynamoDB for job {job_id}")
+        logger.debug("Updated DynamoDB for job %s", job_id)
+    except ClientError as e:
+        # With reprocessing=True a failed condition just means the row was
+        # deleted or already reprocessed since it was read; the caller skips it
+        if not (reprocessing and e.response.get('Error', {}).get('Code') == 'ConditionalCheckFailedException'):
+            logger.error("Failed to update DynamoDB: %s", e)
+        raise
     except Exception as e:
-        logger.error(f"Failed to update DynamoDB: {e}")
+        logger.error("Failed to update DynamoDB: %s", e)
         raise
+    
+    update_aggregates(user_id, response.get('Attributes'), {
+        'status': 'COMPLETED',
+        'merchant': parsed.get('merchant') or 'Unknown',
+        'total': parsed.get('total'),
+        'category': category,
+        'purchase_date': parsed.get('purchase_date'),
+        'alerts': alerts,
+        'batch_id': batch_id
+    })
+    search_index.index_receipt(user_id, job_id, response.get('Attributes'), {
+        'merchant': parsed.get('merchant'),
+        'line_items': parsed.get('items')
+    })
+
+
+def update_aggregates(user_id: str, old: Dict[str, Any], new: Dict[str, Any]):
+    """Keep the per-user rollups in step; a stats failure must not fail the receipt."""
+    try:
+        aggregates.record_result(user_id, old, new)
+    except Exception as e:
+        tracing.incr("aggregate_errors")
+        logger.error("Failed to update aggregates for user %s: %s", user_id, e)
 
 
 def send_anomaly_notification(job_id: str, parsed_receipt, alerts: list):
@@ -234,7 +454,7 @@ review this receipt in your dashboard.
             Subject=f"⚠️ Receipt Anomaly Alert - {merchant}",
             Message=message
         )
-        logger.info(f"Anomaly notification sent for receipt {job_id}")
+        logger.debug("Anomaly notification sent for receipt %s", job_id)
     except Exception as e:
-        logger.error(f"Failed to send anomaly notification: {str(e)}")
+        logger.error("Failed to send anomaly notification: %s", e)
 
@@ -0,0 +1,658 @@
+"""In-process stand-ins for the AWS services used by the ML worker and the API.
+
+Each stand-in accepts the same keyword arguments as the boto3 call it
+replaces, sleeps according to a configurable LatencyModel and can raise
+throttling errors, so the real sqs_handler can be replayed locally and the
+API load-tested (backend/loadtest.py).
+"""
+
+import io
+import json
+import operator
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from botocore.exceptions import ClientError
+
+import categorize
+import job_status
+
+LOCAL_BUCKET = "local-receipts"
+LOCAL_TOPIC_ARN = "arn:aws:sns:local:000000000000:receipt-anomaly-notifications"
+
+
+class LatencyModel:
+    """Latency and throttling distribution for one service.
+
+    Specs are strings such as ``fixed:20``, ``uniform:50:150`` or
+    ``lognormal:300:0.4`` (median ms, sigma).
+    """
+
+    def __init__(
+        self,
+        kind: str = "fixed",
+        a: float = 0.0,
+        b: float = 0.0,
+        throttle_rate: float = 0.0,
+        rng: Optional[random.Random] = None
+    ):
+        if kind not in ("fixed", "uniform", "lognormal"):
+            raise ValueError(f"Unknown latency distribution: {kind}")
+        self.kind = kind
+        self.a = a
+        self.b = b
+        self.throttle_rate = throttle_rate
+        self._rng = rng or random.Random()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def parse(cls, spec: str, throttle_rate: float = 0.0, rng: Optional[random.Random] = None) -> "LatencyModel":
+        parts = spec.split(":")
+        kind = parts[0]
+        values = [float(p) for p in parts[1:]] + [0.0, 0.0]
+        return cls(kind, values[0], values[1], throttle_rate, rng)
+
+    def sample_ms(self) -> float:
+        with self._lock:
+            if self.kind == "uniform":
+                return self._rng.uniform(self.a, self.b)
+            if self.kind == "lognormal":
+                if self.a <= 0:
+                    return 0.0
+                return self.a * self._rng.lognormvariate(0.0, self.b)
+            return self.a
+
+    def should_throttle(self) -> bool:
+        if self.throttle_rate <= 0:
+            return False
+        with self._lock:
+            return self._rng.random() < self.throttle_rate
+
+
+class _StandIn:
+    """Shared call accounting: latency, throttling and concurrency tracking."""
+
+    service = "service"
+
+    def __init__(self, latency: Optional[LatencyModel] = None):
+        self.latency = latency or LatencyModel()
+        self.calls: Dict[str, int] = {}
+        self.throttled = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def _call(self, operation: str) -> Iterator[None]:
+        with self._lock:
+            self.calls[operation] = self.calls.get(operation, 0) + 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            delay_ms = self.latency.sample_ms()
+            if delay_ms > 0:
+                time.sleep(delay_ms / 1000.0)
+            if self.latency.should_throttle():
+                with self._lock:
+                    self.throttled += 1
+                raise ClientError(
+                    {"Error": {"Code": "ThrottlingException", "Message": f"{self.service} stand-in throttled"}},
+                    operation
+                )
+            yield
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+    def reset_stats(self) -> None:
+        with self._lock:
+            self.calls = {}
+            self.throttled = 0
+            self.max_in_flight = self.in_flight
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "calls": dict(self.calls),
+            "throttled": self.throttled,
+            "max_in_flight": self.max_in_flight,
+        }
+
+
+class FakeRekognition(_StandIn):
+    service = "rekognition"
+
+    def __init__(self, latency: Optional[LatencyModel] = None, seed: Optional[int] = None):
+        super().__init__(latency)
+        self.responses: Dict[str, Dict[str, Any]] = {}
+        self._rng = random.Random(seed)
+        self._rng_lock = threading.Lock()
+
+    def add_response(self, key: str, response: Dict[str, Any]) -> None:
+        """Serve a recorded DetectText response for an S3 key."""
+        self.responses[key] = response
+
+    def detect_text(self, Image: Dict[str, Any], **kwargs) -> Dict[str, Any]:
+        with self._call("DetectText"):
+            key = Image.get("S3Object", {}).get("Name")
+            if key in self.responses:
+                return self.responses[key]
+            with self._rng_lock:
+                return synthetic_rekognition_response(self._rng)
+
+
+class FakeS3(_StandIn):
+    service = "s3"
+
+    def __init__(self, latency: Optional[LatencyModel] = None):
+        super().__init__(latency)
+        self.objects: Dict[Tuple[str, str], Dict[str, Any]] = {}
+
+    def put_object(self, Bucket: str, Key: str, Body: Any = b"", ContentType: Optional[str] = None, **kwargs) -> Dict[str, Any]:
+        with self._call("PutObject"):
+            data = Body.encode() if isinstance(Body, str) else (Body.read() if hasattr(Body, "read") else bytes(Body))
+            self.objects[(Bucket, Key)] = {"Body": data, "ContentType": ContentType}
+            return {"ETag": f'"{hash(data) & 0xffffffff:08x}"'}
+
+    def get_object(self, Bucket: str, Key: str, **kwargs) -> Dict[str, Any]:
+        with self._call("GetObject"):
+            obj = self._lookup(Bucket, Key, "GetObject")
+            return {
+                "Body": io.BytesIO(obj["Body"]),
+                "ContentLength": len(obj["Body"]),
+                "ContentType": obj["ContentType"],
+            }
+
+    def head_object(self, Bucket: str, Key: str, **kwargs) -> Dict[str, Any]:
+        with self._call("HeadObject"):
+            obj = self._lookup(Bucket, Key, "HeadObject")
+            return {"ContentLength": len(obj["Body"]), "ContentType": obj["ContentType"]}
+
+    def list_objects_v2(
+        self,
+        Bucket: str,
+        Prefix: str = "",
+        StartAfter: str = "",
+        ContinuationToken: Optional[str] = None,
+        MaxKeys: int = 1000,
+        **kwargs
+    ) -> Dict[str, Any]:
+        """Keys in UTF-8 order; the continuation token is the last key returned."""
+        with self._call("ListObjectsV2"):
+            after = ContinuationToken or StartAfter
+            keys = sorted(k for b, k in list(self.objects) if b == Bucket and k.startswith(Prefix) and k > after)
+            page = keys[:MaxKeys]
+            response = {
+                "Contents": [{"Key": k, "Size": len(self.objects[(Bucket, k)]["Body"])} for k in page],
+                "KeyCount": len(page),
+                "IsTruncated": len(keys) > MaxKeys,
+            }
+            if response["IsTruncated"]:
+                response["NextContinuationToken"] = page[-1]
+            return response
+
+    def generate_presigned_url(self, ClientMethod: str, Params: Optional[Dict[str, Any]] = None, ExpiresIn: int = 3600, **kwargs) -> str:
+        # Signing is local in boto3 as well, so no latency and no call counted
+        params = Params or {}
+        return f"https://{params.get('Bucket')}.s3.local/{params.get('Key')}?X-Amz-Expires={ExpiresIn}"
+
+    def generate_presigned_post(self, Bucket: str, Key: str, Fields: Optional[Dict[str, Any]] = None, ExpiresIn: int = 3600, **kwargs) -> Dict[str, Any]:
+        return {"url": f"https://{Bucket}.s3.local/", "fields": dict(Fields or {}, key=Key)}
+
+    def _lookup(self, bucket: str, key: str, operation: str) -> Dict[str, Any]:
+        if (bucket, key) not in self.objects:
+            raise ClientError({"Error": {"Code": "NoSuchKey", "Message": key}}, operation)
+        return self.objects[(bucket, key)]
+
+
+class FakeBedrock(_StandIn):
+    service = "bedrock"
+
+    def invoke_model(self, modelId: str, body: str, **kwargs) -> Dict[str, Any]:
+        with self._call("InvokeModel"):
+            prompt = json.loads(body)["messages"][0]["content"]
+            # Only classify the receipt section, not the list of categories
+            receipt_text = prompt.split("Categories:")[0]
+            category, _ = categorize.rule_based_category(receipt_text, [])
+            text = json.dumps({"category": category, "confidence": 0.9, "reasoning": "stand-in"})
+            payload = {"content": [{"type": "text", "text": text}]}
+            return {"body": io.BytesIO(json.dumps(payload).encode())}
+
+
+class FakeSNS(_StandIn):
+    service = "sns"
+
+    def __init__(self, latency: Optional[LatencyModel] = None):
+        super().__init__(latency)
+        self.messages: list[Dict[str, Any]] = []
+
+    def publish(self, TopicArn: str, Message: str, Subject: Optional[str] = None, **kwargs) -> Dict[str, Any]:
+        with self._call("Publish"):
+            self.messages.append({"TopicArn": TopicArn, "Subject": Subject, "Message": Message})
+            return {"MessageId": str(len(self.messages))}
+
+
+class FakeSQS(_StandIn):
+    service = "sqs"
+
+    def __init__(self, latency: Optional[LatencyModel] = None):
+        super().__init__(latency)
+        self.queues: Dict[str, List[Dict[str, Any]]] = {}
+        self.visibility: Dict[str, int] = {}  # receipt handle -> last VisibilityTimeout set
+
+    def send_message(self, QueueUrl: str, MessageBody: str, **kwargs) -> Dict[str, Any]:
+        with self._call("SendMessage"):
+            return {"MessageId": self._append(QueueUrl, MessageBody, kwargs)}
+
+    def send_message_batch(self, QueueUrl: str, Entries: List[Dict[str, Any]], **kwargs) -> Dict[str, Any]:
+        with self._call("SendMessageBatch"):
+            successful = [
+                {"Id": entry["Id"], "MessageId": self._append(QueueUrl, entry["MessageBody"], entry)}
+                for entry in Entries
+            ]
+            return {"Successful": successful, "Failed": []}
+
+    def change_message_visibility(self, QueueUrl: str, ReceiptHandle: str, VisibilityTimeout: int, **kwargs) -> Dict[str, Any]:
+        with self._call("ChangeMessageVisibility"):
+            with self._lock:
+                self.visibility[ReceiptHandle] = VisibilityTimeout
+            return {}
+
+    def _append(self, queue_url: str, body: str, options: Dict[str, Any]) -> str:
+        with self._lock:
+            messages = self.queues.setdefault(queue_url, [])
+            messages.append({
+                "Body": body,
+                "MessageAttributes": options.get("MessageAttributes", {}),
+                "DelaySeconds": options.get("DelaySeconds", 0),
+            })
+            return f"{len(messages)}"
+
+
+_CLAUSE_RE = re.compile(r"\b(SET|ADD|REMOVE|DELETE)\b", re.IGNORECASE)
+
+
+class FakeTable(_StandIn):
+    """Dict-backed DynamoDB table supporting the expression subset the worker uses.
+
+    ``indexes`` maps index names to their (hash, range) attributes; queries on
+    those are sorted by the range attribute and paged like DynamoDB.
+    """
+
+    service = "dynamodb"
+
+    def __init__(
+        self,
+        hash_key: str,
+        range_key: Optional[str] = None,
+        latency: Optional[LatencyModel] = None,
+        indexes: Optional[Dict[str, Tuple[str, str]]] = None
+    ):
+        super().__init__(latency)
+        self.hash_key = hash_key
+        self.range_key = range_key
+        self.indexes = indexes or {}
+        self.items: Dict[Tuple[Any, ...], Dict[str, Any]] = {}
+        self._items_lock = threading.Lock()
+
+    def _key(self, key: Dict[str, Any]) -> Tuple[Any, ...]:
+        if self.range_key:
+            return (key[self.hash_key], key[self.range_key])
+        return (key[self.hash_key],)
+
+    def put_item(
+        self,
+        Item: Dict[str, Any],
+        ConditionExpression: Optional[str] = None,
+        ExpressionAttributeNames: Optional[Dict[str, str]] = None,
+        ExpressionAttributeValues: Optional[Dict[str, Any]] = None,
+        **kwargs
+    ) -> Dict[str, Any]:
+        with self._call("PutItem"), self._items_lock:
+            key = self._key(Item)
+            _check_condition(self.items.get(key), ConditionExpression, ExpressionAttributeNames, ExpressionAttributeValues, "PutItem")
+            self.items[key] = dict(Item)
+            return {}
+
+    def get_item(self, Key: Dict[str, Any], **kwargs) -> Dict[str, Any]:
+        with self._call("GetItem"), self._items_lock:
+            item = self.items.get(self._key(Key))
+            return {"Item": _project(item, kwargs)} if item is not None else {}
+
+    def delete_item(self, Key: Dict[str, Any], **kwargs) -> Dict[str, Any]:
+        with self._call("DeleteItem"), self._items_lock:
+            self.items.pop(self._key(Key), None)
+            return {}
+
+    def update_item(
+        self,
+        Key: Dict[str, Any],
+        UpdateExpression: str,
+        ExpressionAttributeNames: Optional[Dict[str, str]] = None,
+        ExpressionAttributeValues: Optional[Dict[str, Any]] = None,
+        ReturnValues: str = "NONE",
+        ConditionExpression: Optional[str] = None,
+        **kwargs
+    ) -> Dict[str, Any]:
+        names = ExpressionAttributeNames or {}
+        values = ExpressionAttributeValues or {}
+        with self._call("UpdateItem"), self._items_lock:
+            key = self._key(Key)
+            _check_condition(self.items.get(key), ConditionExpression, names, values, "UpdateItem")
+            old = dict(self.items.get(key, {}))
+            item = self.items.setdefault(key, dict(Key))
+            _apply_update(item, UpdateExpression, names, values)
+            if ReturnValues == "ALL_NEW":
+                return {"Attributes": dict(item)}
+            if ReturnValues in ("ALL_OLD", "UPDATED_OLD"):
+                return {"Attributes": old} if old else {}
+            return {}
+
+    def query(
+        self,
+        ExpressionAttributeValues: Dict[str, Any],
+        KeyConditionExpression: str = "",
+        **kwargs
+    ) -> Dict[str, Any]:
+        """Partition-key equality plus an optional sort-key `=` or begins_with.
+
+        With IndexName the partition attribute is read from the expression
+        (`receipt_id = :rid`), which covers the GSI lookups the code makes.
+        Indexes declared in ``indexes`` go through _query_index instead.
+        """
+        if kwargs.get("IndexName") in self.indexes:
+            return self._query_index(ExpressionAttributeValues, KeyConditionExpression, **kwargs)
+        with self._call("Query"), self._items_lock:
+            partition = next(iter(ExpressionAttributeValues.values()))
+            index_key = _PARTITION_RE.match(KeyConditionExpression) if kwargs.get("IndexName") else None
+            if index_key:
+                items = [dict(i) for i in self.items.values() if i.get(index_key.group(1)) == partition]
+            else:
+                items = [dict(i) for k, i in self.items.items() if k[0] == partition]
+            match = _RANGE_CONDITION_RE.search(KeyConditionExpression)
+            if match and self.range_key and not index_key:
+                wanted = ExpressionAttributeValues[match.group("value") or match.group("prefix")]
+                if match.group("prefix"):
+                    items = [i for i in items if str(i[self.range_key]).startswith(wanted)]
+                else:
+                    items = [i for i in items if i[self.range_key] == wanted]
+            if kwargs.get("Limit"):
+                items = items[:kwargs["Limit"]]
+            items = [_project(i, kwargs) for i in items]
+            return {"Items": items, "Count": len(items)}
+
+    def _query_index(self, values: Dict[str, Any], expression: str, **kwargs) -> Dict[str, Any]:
+        """Range conditions, ScanIndexForward, Limit and ExclusiveStartKey on a declared index."""
+        hash_key, range_key = self.indexes[kwargs["IndexName"]]
+        forward = kwargs.get("ScanIndexForward", True)
+        with self._call("Query"), self._items_lock:
+            partition = values[_PARTITION_RE.match(expression).group(2)]
+            items = [i for i in self.items.values() if i.get(hash_key) == partition and range_key in i]
+            bound = _RANGE_BOUND_RE.search(expression)
+            if bound:
+                items = [i for i in items if _in_range(i[range_key], bound, values)]
+            position = lambda item: (item[range_key], self._key(item))
+            items.sort(key=position, reverse=not forward)
+            start = kwargs.get("ExclusiveStartKey")
+            if start:
+                after = position(start)
+                items = [i for i in items if (position(i) > after if forward else position(i) < after)]
+            limit = kwargs.get("Limit") or len(items)
+            page = items[:limit]
+            response: Dict[str, Any] = {"Items": [_project(i, kwargs) for i in page], "Count": len(page)}
+            if len(items) > limit:
+                last = page[-1]
+                response["LastEvaluatedKey"] = {
+                    k: last[k] for k in dict.fromkeys([self.hash_key, self.range_key, hash_key, range_key]) if k
+                }
+            return response
+
+    def batch_writer(self, **kwargs) -> "FakeBatchWriter":
+        return FakeBatchWriter(self)
+
+
+class FakeBatchWriter:
+    """Buffers puts/deletes and flushes them 25 at a time like boto3's BatchWriter."""
+
+    FLUSH_AMOUNT = 25
+
+    def __init__(self, table: FakeTable):
+        self.table = table
+        self._requests: List[tuple] = []
+
+    def put_item(self, Item: Dict[str, Any]) -> None:
+        self._requests.append(("put", Item))
+        self._maybe_flush()
+
+    def delete_item(self, Key: Dict[str, Any]) -> None:
+        self._requests.append(("delete", Key))
+        self._maybe_flush()
+
+    def _maybe_flush(self) -> None:
+        if len(self._requests) >= self.FLUSH_AMOUNT:
+            self._flush()
+
+    def _flush(self) -> None:
+        if not self._requests:
+            return
+        table = self.table
+        with table._call("BatchWriteItem"), table._items_lock:
+            for action, data in self._requests:
+                if action == "put":
+                    table.items[table._key(data)] = dict(data)
+                else:
+                    table.items.pop(table._key(data), None)
+        self._requests = []
+
+    def __enter__(self) -> "FakeBatchWriter":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._flush()
+
+
+_PARTITION_RE = re.compile(r"^\s*(\w+)\s*=\s*(:\w+)")
+_RANGE_CONDITION_RE = re.compile(
+    r"AND\s+(?:begins_with\(\s*[#\w]+\s*,\s*(?P<prefix>:\w+)\s*\)|[#\w]+\s*=\s*(?P<value>:\w+))",
+    re.IGNORECASE
+)
+_RANGE_BOUND_RE = re.compile(
+    r"AND\s+[#\w]+\s*(?:BETWEEN\s+(?P<low>:\w+)\s+AND\s+(?P<high>:\w+)"
+    r"|(?P<op><=|>=|<|>|=)\s*(?P<value>:\w+)"
+    r"|begins_with\(\s*[#\w]+\s*,\s*(?P<prefix>:\w+)\s*\))",
+    re.IGNORECASE
+)
+_COMPARISON_RE = re.compile(r"^\s*([#\w.]+)\s*(=|<>|<=|>=|<|>)\s*(:\w+)\s*$")
+_FUNCTION_RE = re.compile(r"^\s*(attribute_exists|attribute_not_exists)\(\s*([#\w.]+)\s*\)\s*$")
+_OPERATORS: Dict[str, Callable[[Any, Any], bool]] = {
+    "=": operator.eq, "<>": operator.ne, "<": operator.lt,
+    "<=": operator.le, ">": operator.gt, ">=": operator.ge,
+}
+
+
+def _in_range(value: Any, bound: "re.Match[str]", values: Dict[str, Any]) -> bool:
+    if bound.group("low"):
+        return values[bound.group("low")] <= value <= values[bound.group("high")]
+    if bound.group("prefix"):
+        return str(value).startswith(values[bound.group("prefix")])
+    return _OPERATORS[bound.group("op")](value, values[bound.group("value")])
+
+
+def _project(item: Dict[str, Any], kwargs: Dict[str, Any]) -> Dict[str, Any]:
+    """Apply a ProjectionExpression of top-level attribute names."""
+    projection = kwargs.get("ProjectionExpression")
+    if not projection:
+        return dict(item)
+    names = kwargs.get("ExpressionAttributeNames") or {}
+    wanted = [names.get(name.strip(), name.strip()) for name in projection.split(",")]
+    return {name: item[name] for name in wanted if name in item}
+
+
+def _check_condition(
+    item: Optional[Dict[str, Any]],
+    expression: Optional[str],
+    names: Optional[Dict[str, str]],
+    values: Optional[Dict[str, Any]],
+    operation: str
+) -> None:
+    """Evaluate simple comparisons and attribute_(not_)exists joined by AND/OR."""
+    if not expression:
+        return
+    names = names or {}
+    values = values or {}
+    item = item or {}
+
+    def holds(term: str) -> bool:
+        match = _FUNCTION_RE.match(term)
+        if match:
+            present = names.get(match.group(2), match.group(2)) in item
+            return present if match.group(1) == "attribute_exists" else not present
+        match = _COMPARISON_RE.match(term)
+        if not match:
+            raise ValueError(f"Unsupported condition in stand-in: {term}")
+        attr, op, placeholder = names.get(match.group(1), match.group(1)), match.group(2), match.group(3)
+        if attr not in item:
+            return op == "<>"
+        return _OPERATORS[op](item[attr], values[placeholder])
+
+    ok = any(
+        all(holds(term) for term in re.split(r"\s+AND\s+", alternative, flags=re.IGNORECASE))
+        for alternative in re.split(r"\s+OR\s+", expression, flags=re.IGNORECASE)
+    )
+    if not ok:
+        raise ClientError(
+            {"Error": {"Code": "ConditionalCheckFailedException", "Message": "The conditional request failed"}},
+            operation
+        )
+
+
+def _apply_update(item: Dict[str, Any], expression: str, names: Dict[str, str], values: Dict[str, Any]) -> None:
+    parts = _CLAUSE_RE.split(expression)
+    # parts: [prefix, ACTION, body, ACTION, body, ...]
+    for action, body in zip(parts[1::2], parts[2::2]):
+        action = action.upper()
+        for clause in (c.strip() for c in body.split(",")):
+            if not clause:
+                continue
+            if action == "SET":
+                attr, value = (s.strip() for s in clause.split("=", 1))
+                item[names.get(attr, attr)] = values[value]
+            elif action == "ADD":
+                attr, value = clause.split()
+                attr = names.get(attr, attr)
+                if isinstance(values[value], (set, frozenset)):
+                    item[attr] = set(item.get(attr, set())) | set(values[value])
+                else:
+                    item[attr] = item.get(attr, 0) + values[value]
+            elif action == "DELETE":
+                attr, value = clause.split()
+                attr = names.get(attr, attr)
+                remaining = set(item.get(attr, set())) - set(values[value])
+                if remaining:
+                    item[attr] = remaining
+                else:
+                    item.pop(attr, None)
+            else:
+                item.pop(names.get(clause, clause), None)
+
+
+SYNTHETIC_MERCHANTS = ["WALMART", "TRADER JOE'S", "SHELL", "STARBUCKS", "TARGET", "CVS PHARMACY", "HOME DEPOT"]
+SYNTHETIC_ITEMS = ["MILK 2%", "BREAD", "EGGS 12CT", "COFFEE", "PAPER TOWELS", "PRINTER INK", "BANANAS", "SHAMPOO"]
+
+
+def synthetic_rekognition_response(rng: random.Random, max_items: int = 12) -> Dict[str, Any]:
+    """Build a plausible DetectText response with LINE geometry."""
+    lines = [rng.choice(SYNTHETIC_MERCHANTS), f"{rng.randint(1, 12):02d}/{rng.randint(1, 28):02d}/2025"]
+    subtotal = 0.0
+    for _ in range(rng.randint(1, max_items)):
+        price = round(rng.uniform(0.99, 49.99), 2)
+        subtotal += price
+        lines.extend([rng.choice(SYNTHETIC_ITEMS), f"{price:.2f}"])
+    tax = round(subtotal * 0.0925, 2)
+    lines.extend([
+        f"SUBTOTAL {subtotal:.2f}",
+        f"TAX {tax:.2f}",
+        f"TOTAL {subtotal + tax:.2f}",
+    ])
+    return rekognition_response_from_lines(lines)
+
+
+def rekognition_response_from_lines(lines: list[str]) -> Dict[str, Any]:
+    height = 1.0 / max(len(lines), 1)
+    detections = []
+    for i, text in enumerate(lines):
+        detections.append({
+            "DetectedText": text,
+            "Type": "LINE",
+            "Id": i,
+            "Confidence": 99.0,
+            "Geometry": {"BoundingBox": {"Left": 0.05, "Top": i * height, "Width": 0.9, "Height": height * 0.8}},
+        })
+    return {"TextDetections": detections}
+
+
+class AwsStandIns:
+    """Bundle of stand-ins that can be patched into the worker modules."""
+
+    def __init__(self, latencies: Optional[Dict[str, LatencyModel]] = None, seed: Optional[int] = None):
+        latencies = latencies or {}
+        self.rekognition = FakeRekognition(latencies.get("rekognition"), seed=seed)
+        self.s3 = FakeS3(latencies.get("s3"))
+        self.bedrock = FakeBedrock(latencies.get("bedrock"))
+        self.receipts_table = FakeTable("user_id", "receipt_id", latencies.get("dynamodb"))
+        self.sns = FakeSNS(latencies.get("sns"))
+        self.sqs = FakeSQS(latencies.get("sqs"))
+        self.rate_limit_table = FakeTable("bucket_id", latency=latencies.get("dynamodb"))
+        self.stats_table = FakeTable("user_id", "stat_key", latencies.get("dynamodb"))
+        self.search_table = FakeTable("user_id", "token", latencies.get("dynamodb"))
+        self.job_status = job_status.InMemoryJobStatusChannel()
+        self._restore: list[Callable[[], None]] = []
+
+    def _patch(self, module: Any, name: str, value: Any) -> None:
+        previous = getattr(module, name)
+        setattr(module, name, value)
+        self._restore.append(lambda: setattr(module, name, previous))
+
+    def install(self) -> None:
+        """Point the worker's module-level clients at the stand-ins."""
+        import aggregates
+        import categorize_bedrock
+        import ocr_rekognition
+        import rate_limiter
+        import search_index
+        import sqs_handler
+
+        self._patch(ocr_rekognition, "rekognition_client", self.rekognition)
+        self._patch(ocr_rekognition, "s3_client", self.s3)
+        self._patch(categorize_bedrock, "_bedrock_client", self.bedrock)
+        self._patch(sqs_handler, "table", self.receipts_table)
+        self._patch(sqs_handler, "sns_client", self.sns)
+        self._patch(sqs_handler, "sqs_client", self.sqs)
+        self._patch(sqs_handler, "ANOMALY_TOPIC_ARN", LOCAL_TOPIC_ARN)
+        self._patch(sqs_handler, "S3_BUCKET_RECEIPTS", LOCAL_BUCKET)
+        self._patch(sqs_handler, "S3_BUCKET_OUTPUT", LOCAL_BUCKET)
+        self._patch(rate_limiter, "_table", self.rate_limit_table)
+        self._patch(aggregates, "stats_table", self.stats_table)
+        self._patch(job_status, "channel", self.job_status)
+        self._patch(search_index, "index", search_index.SearchIndex(self.search_table, max_workers=1))
+        rate_limiter.reset()
+
+    def uninstall(self) -> None:
+        while self._restore:
+            self._restore.pop()()
+        import rate_limiter
+        rate_limiter.reset()
+
+    def stats(self) -> Dict[str, Any]:
+        stats = {
+            svc.service: svc.stats()
+            for svc in (self.rekognition, self.s3, self.bedrock, self.receipts_table, self.sns, self.sqs)
+        }
+        stats["dynamodb_rate_limits"] = self.rate_limit_table.stats()
+        stats["dynamodb_stats"] = self.stats_table.stats()
+        stats["dynamodb_search"] = self.search_table.stats()
+        stats["job_status_events"] = len(self.job_status.events)
+        return stats
@@ -0,0 +1,206 @@
+"""Tiled OCR for long receipts.
+
+Tall, narrow images are split into overlapping horizontal tiles, each tile is
+sent to DetectText concurrently and the detections are mapped back into the
+full image's normalized coordinates. Lines from the overlap regions are
+de-duplicated so parse_rekognition sees each printed line once.
+"""
+
+import contextvars
+import io
+import math
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional
+
+from config import get_logger
+import config
+import tracing
+
+logger = get_logger(__name__)
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+OcrFn = Callable[[bytes], Dict[str, Any]]
+
+# Two LINE detections closer than this (fraction of full height) with the same
+# text are treated as the same printed line
+DUPLICATE_LINE_TOLERANCE = 0.004
+
+
+@dataclass
+class Tile:
+    top: int
+    bottom: int
+    image_bytes: bytes
+
+    @property
+    def height(self) -> int:
+        return self.bottom - self.top
+
+
+def is_tall(width: int, height: int) -> bool:
+    return config.TILED_OCR_ENABLED and width > 0 and height / float(width) >= config.TILED_OCR_ASPECT
+
+
+def plan_tiles(width: int, height: int) -> List[tuple]:
+    """(top, bottom) pixel rows for overlapping tiles covering the image."""
+    tile_height = int(width * config.TILED_OCR_TILE_ASPECT)
+    overlap = int(tile_height * config.TILED_OCR_OVERLAP)
+    count = max(1, math.ceil((height - overlap) / float(tile_height - overlap)))
+
+    if count > config.TILED_OCR_MAX_TILES:
+        # Grow the tiles rather than exceed the per-job call budget
+        count = config.TILED_OCR_MAX_TILES
+        tile_height = math.ceil((height + overlap * (count - 1)) / float(count))
+
+    step = tile_height - overlap
+    bounds = []
+    for i in range(count):
+        top = i * step
+        bottom = height if i == count - 1 else min(height, top + tile_height)
+        bounds.append((top, bottom))
+    return bounds
+
+
+def split_into_tiles(image_bytes: bytes) -> tuple:
+    """Return (tiles, full_width, full_height)."""
+    if Image is None:
+        raise RuntimeError("Pillow is not installed")
+
+    img = Image.open(io.BytesIO(image_bytes))
+    img.load()
+    tiles = []
+    for top, bottom in plan_tiles(img.width, img.height):
+        out = io.BytesIO()
+        img.crop((0, top, img.width, bottom)).save(out, format="JPEG", quality=config.PREPROCESS_JPEG_QUALITY)
+        tiles.append(Tile(top, bottom, out.getvalue()))
+    return tiles, img.width, img.height
+
+
+def run_tiled_ocr(
+    image_bytes: bytes,
+    ocr_fn: Optional[OcrFn] = None,
+    max_workers: Optional[int] = None
+) -> Dict[str, Any]:
+    """OCR tiles concurrently and merge them into one DetectText-shaped response."""
+    if ocr_fn is None:
+        import ocr_rekognition
+        ocr_fn = ocr_rekognition.run_rekognition_on_bytes
+
+    tiles, _, full_height = split_into_tiles(image_bytes)
+    tracing.incr("ocr_tiles", len(tiles))
+    logger.debug("Running tiled OCR: %d tiles for image height %dpx", len(tiles), full_height)
+
+    workers = max_workers or config.TILED_OCR_MAX_WORKERS
+    with ThreadPoolExecutor(max_workers=min(workers, len(tiles))) as pool:
+        # Copy the context so tracing counters land on the current job
+        futures = [
+            pool.submit(contextvars.copy_context().run, ocr_fn, tile.image_bytes)
+            for tile in tiles
+        ]
+        responses = [f.result() for f in futures]
+
+    return merge_tile_responses(tiles, responses, full_height)
+
+
+def merge_tile_responses(tiles: List[Tile], responses: List[Dict[str, Any]], full_height: int) -> Dict[str, Any]:
+    """Map tile detections to full-image coordinates and drop overlap duplicates."""
+    # A line belongs to the tile whose overlap midline it falls on the inside of
+    cuts = [0.0]
+    for upper, lower in zip(tiles, tiles[1:]):
+        cuts.append((lower.top + upper.bottom) / 2.0 / full_height)
+    cuts.append(1.0)
+
+    merged: List[Dict[str, Any]] = []
+    next_id = 0
+    for index, (tile, response) in enumerate(zip(tiles, responses)):
+        lo, hi = cuts[index], cuts[index + 1]
+        id_map: Dict[int, int] = {}
+        detections = response.get("TextDetections", [])
+
+        for det in detections:
+            if det.get("Type") != "LINE":
+                continue
+            mapped = _to_full_image(det, tile, full_height)
+            center = _center_y(mapped)
+            if center is not None and not (lo <= center < hi or (hi == 1.0 and center >= hi)):
+                continue
+            if "Id" in det:
+                id_map[det["Id"]] = next_id
+            mapped["Id"] = next_id
+            next_id += 1
+            merged.append(mapped)
+
+        for det in detections:
+            if det.get("Type") != "WORD" or det.get("ParentId") not in id_map:
+                continue
+            mapped = _to_full_image(det, tile, full_height)
+            mapped["ParentId"] = id_map[det["ParentId"]]
+            mapped["Id"] = next_id
+            next_id += 1
+            merged.append(mapped)
+
+    lines = _dedupe_lines([d for d in merged if d.get("Type") == "LINE"])
+    kept_ids = {d["Id"] for d in lines}
+    words = [d for d in merged if d.get("Type") == "WORD" and d.get("ParentId") in kept_ids]
+    lines.sort(key=lambda d: (_center_y(d) or 0.0, _left(d)))
+    return {"TextDetections": lines + words}
+
+
+def _to_full_image(det: Dict[str, Any], tile: Tile, full_height: int) -> Dict[str, Any]:
+    mapped = dict(det)
+    geometry = det.get("Geometry")
+    if not geometry:
+        return mapped
+
+    scale = tile.height / float(full_height)
+    offset = tile.top / float(full_height)
+    new_geometry = {}
+    box = geometry.get("BoundingBox")
+    if box:
+        new_geometry["BoundingBox"] = {
+            "Left": box.get("Left", 0.0),
+            "Width": box.get("Width", 0.0),
+            "Top": offset + box.get("Top", 0.0) * scale,
+            "Height": box.get("Height", 0.0) * scale,
+        }
+    if geometry.get("Polygon"):
+        new_geometry["Polygon"] = [
+            {"X": p.get("X", 0.0), "Y": offset + p.get("Y", 0.0) * scale}
+            for p in geometry["Polygon"]
+        ]
+    mapped["Geometry"] = new_geometry
+    return mapped
+
+
+def _center_y(det: Dict[str, Any]) -> Optional[float]:
+    box = det.get("Geometry", {}).get("BoundingBox")
+    if not box:
+        return None
+    return box["Top"] + box["Height"] / 2.0
+
+
+def _left(det: Dict[str, Any]) -> float:
+    return det.get("Geometry", {}).get("BoundingBox", {}).get("Left", 0.0)
+
+
+def _dedupe_lines(lines: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Drop same-text lines at (nearly) the same height, keeping the most confident."""
+    kept: List[Dict[str, Any]] = []
+    for det in sorted(lines, key=lambda d: -d.get("Confidence", 0.0)):
+        text = det.get("DetectedText", "").strip().upper()
+        center = _center_y(det)
+        duplicate = any(
+            text == k.get("DetectedText", "").strip().upper()
+            and center is not None
+            and _center_y(k) is not None
+            and abs(center - _center_y(k)) <= DUPLICATE_LINE_TOLERANCE
+            for k in kept
+        )
+        if not duplicate:
+            kept.append(det)
+    return kept
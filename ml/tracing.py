@@ -0,0 +1,272 @@
+"""Per-stage tracing, CloudWatch EMF metrics and sampled profiling for the pipeline.
+
+Each job ends with one JSON log record: outcome, stage timings, counters and
+the fields set with annotate() (merchant, item count, ...). With
+METRICS_ENABLED it doubles as the job's EMF metrics record.
+"""
+
+import contextvars
+import os
+import time
+import zlib
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+import config
+
+logger = config.get_logger(__name__)
+
+# Per-job records carry the metrics, so LOG_LEVEL doesn't filter them
+_job_logger = config.get_record_logger(f"{__name__}.jobs")
+
+_current_trace: contextvars.ContextVar[Optional["JobTrace"]] = contextvars.ContextVar(
+    "current_job_trace", default=None
+)
+
+# Called with every finished trace (used by the local replay harness)
+_listeners: List[Callable[["JobTrace"], None]] = []
+
+
+class JobTrace:
+    """Timing spans and counters collected while processing one receipt job."""
+
+    def __init__(self, job_id: Optional[str] = None, user_id: Optional[str] = None):
+        self.job_id = job_id
+        self.user_id = user_id
+        self.outcome = "Success"
+        self.stages: Dict[str, float] = {}
+        self.counters: Dict[str, int] = {}
+        self.fields: Dict[str, Any] = {}
+        self.priority: Optional[str] = None
+        self.queue_ms: Optional[float] = None
+        self.failed_stage: Optional[str] = None
+        self.debug = False
+        self._started = time.perf_counter()
+        self._ended: Optional[float] = None
+
+    def identify(self, job_id: str, user_id: Optional[str] = None) -> None:
+        """Set the job's ids and decide (deterministically per job) whether it logs DEBUG."""
+        self.job_id, self.user_id = job_id, user_id
+        self.debug = is_sampled(job_id, config.LOG_DEBUG_SAMPLE_RATE)
+        config.set_debug_logging(self.debug)
+
+    def queued(self, priority: str, sent_at_ms: Optional[int] = None) -> None:
+        """Record the job's lane and how long it waited on the queue."""
+        self.priority = priority
+        if sent_at_ms:
+            self.queue_ms = max(0.0, time.time() * 1000.0 - sent_at_ms)
+
+    @contextmanager
+    def span(self, stage: str) -> Iterator[None]:
+        """Time a pipeline stage; repeated stages accumulate."""
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            if self.failed_stage is None:
+                self.failed_stage = stage
+            raise
+        finally:
+            elapsed_ms = (time.perf_counter() - start) * 1000.0
+            self.stages[stage] = self.stages.get(stage, 0.0) + elapsed_ms
+
+    def incr(self, name: str, value: int = 1) -> None:
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    @property
+    def total_ms(self) -> float:
+        end = self._ended if self._ended is not None else time.perf_counter()
+        return (end - self._started) * 1000.0
+
+    def finish(self) -> None:
+        if self._ended is None:
+            self._ended = time.perf_counter()
+
+    def to_record(self) -> Dict[str, Any]:
+        """The job's structured log record."""
+        record: Dict[str, Any] = {
+            "Service": config.METRICS_SERVICE,
+            "Outcome": self.outcome,
+            "job_id": self.job_id,
+            "user_id": self.user_id,
+            "total_ms": round(self.total_ms, 3),
+        }
+        if self.priority:
+            record["Priority"] = self.priority
+        if self.queue_ms is not None:
+            record["queue_ms"] = round(self.queue_ms, 3)
+        if self.failed_stage:
+            record["failed_stage"] = self.failed_stage
+        for stage, elapsed_ms in self.stages.items():
+            record[f"{stage}_ms"] = round(elapsed_ms, 3)
+        record.update(self.counters)
+        for name, value in self.fields.items():
+            record.setdefault(name, value)
+        return record
+
+    def to_emf(self) -> Dict[str, Any]:
+        """to_record() plus CloudWatch Embedded Metric Format metadata."""
+        metrics = [{"Name": f"{stage}_ms", "Unit": "Milliseconds"} for stage in self.stages]
+        metrics.append({"Name": "total_ms", "Unit": "Milliseconds"})
+        if self.queue_ms is not None:
+            metrics.append({"Name": "queue_ms", "Unit": "Milliseconds"})
+        metrics.extend({"Name": name, "Unit": "Count"} for name in self.counters)
+        dimensions = [["Service"], ["Service", "Outcome"]]
+        if self.priority:
+            # Per-lane latency: interactive p95 should not move with bulk load
+            dimensions.append(["Service", "Priority"])
+
+        record: Dict[str, Any] = {
+            "_aws": {
+                "Timestamp": int(time.time() * 1000),
+                "CloudWatchMetrics": [
+                    {
+                        "Namespace": config.METRICS_NAMESPACE,
+                        "Dimensions": dimensions,
+                        "Metrics": metrics,
+                    }
+                ],
+            },
+        }
+        # High-cardinality fields (job_id, user_id, annotations) are properties, not dimensions
+        record.update(self.to_record())
+        return record
+
+
+def begin_job(job_id: Optional[str] = None, user_id: Optional[str] = None) -> JobTrace:
+    """Start a trace and make it current for span()/incr() calls."""
+    trace = JobTrace(job_id, user_id)
+    _current_trace.set(trace)
+    return trace
+
+
+def end_job(trace: JobTrace) -> None:
+    """Close the trace, log its record and clear the current trace."""
+    trace.finish()
+    if _current_trace.get() is trace:
+        _current_trace.set(None)
+    config.set_debug_logging(False)
+    emit(trace.to_emf() if config.METRICS_ENABLED else trace.to_record())
+    for listener in _listeners:
+        listener(trace)
+
+
+def add_listener(listener: Callable[[JobTrace], None]) -> None:
+    _listeners.append(listener)
+
+
+def remove_listener(listener: Callable[[JobTrace], None]) -> None:
+    if listener in _listeners:
+        _listeners.remove(listener)
+
+
+def current() -> Optional[JobTrace]:
+    return _current_trace.get()
+
+
+@contextmanager
+def span(stage: str) -> Iterator[None]:
+    """Time a stage on the current trace (no-op outside a job)."""
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+    with trace.span(stage):
+        yield
+
+
+def incr(name: str, value: int = 1) -> None:
+    """Increment a counter on the current trace (no-op outside a job)."""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.incr(name, value)
+
+
+def annotate(**fields: Any) -> None:
+    """Add fields to the current job's record (no-op outside a job)."""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.fields.update(fields)
+
+
+def cache_result(cache: str, hit: bool) -> None:
+    """Record a hit or miss for a named in-process cache."""
+    incr(f"{cache}_cache_hits" if hit else f"{cache}_cache_misses")
+
+
+def emit(record: Dict[str, Any]) -> None:
+    # Serialized on the log listener thread; EMF is picked up from the log stream as-is
+    _job_logger.info(record)
+
+
+def is_sampled(job_id: Optional[str], rate: float) -> bool:
+    """Deterministic per-job sampling, so a replayed job is sampled again."""
+    if rate <= 0 or not job_id:
+        return False
+    if rate >= 1:
+        return True
+    return (zlib.crc32(job_id.encode()) % 10000) < rate * 10000
+
+
+def should_profile(job_id: str, sample_rate: Optional[float] = None) -> bool:
+    return is_sampled(job_id, config.PROFILE_SAMPLE_RATE if sample_rate is None else sample_rate)
+
+
+@contextmanager
+def profiled(job_id: str) -> Iterator[None]:
+    """Profile the wrapped block for sampled jobs and dump the result to PROFILE_DIR."""
+    if not should_profile(job_id):
+        yield
+        return
+
+    os.makedirs(config.PROFILE_DIR, exist_ok=True)
+
+    if config.PROFILER.lower() == "pyinstrument":
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            logger.warning("pyinstrument not installed, falling back to cProfile")
+        else:
+            profiler = Profiler()
+            profiler.start()
+            try:
+                yield
+            finally:
+                profiler.stop()
+                path = os.path.join(config.PROFILE_DIR, f"{job_id}.html")
+                with open(path, "w") as f:
+                    f.write(profiler.output_html())
+                logger.info("Profile for job %s written to %s", job_id, path)
+            return
+
+    import cProfile
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        path = os.path.join(config.PROFILE_DIR, f"{job_id}.prof")
+        profiler.dump_stats(path)
+        logger.info("Profile for job %s written to %s", job_id, path)
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(pct / 100.0 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def summarize(values: List[float]) -> Dict[str, float]:
+    """count/p50/p95/p99/max summary for latency samples (ms)."""
+    ordered = sorted(values)
+    return {
+        "count": len(ordered),
+        "p50": round(percentile(ordered, 50), 3),
+        "p95": round(percentile(ordered, 95), 3),
+        "p99": round(percentile(ordered, 99), 3),
+        "max": round(ordered[-1], 3) if ordered else 0.0,
+    }